@@ -24,7 +24,8 @@
 """ This modules contains functions for calculating and manipulating
 coincident triggers.
 """
-import numpy, logging, pycbc.pnutils, copy, lal
+import numpy, logging, itertools, pycbc.pnutils, copy, lal
+from pycbc.events.veto import coalesce_start_end
 
 def background_bin_from_string(background_bins, data):
     """ Return template ids for each bin as defined by the format string
@@ -116,44 +117,105 @@ def calculate_n_louder(bstat, fstat, dec, skip_background=False):
     fore_n_louder: numpy.ndarray
         The number of background triggers above each foreground trigger
     """
-    sort = bstat.argsort()
-    bstat = bstat[sort]
-    dec = dec[sort]
-
-    # calculate cumulative number of triggers louder than the trigger in
-    # a given index. We need to subtract the decimation factor, as the cumsum
-    # includes itself in the first sum (it is inclusive of the first value)
-    n_louder = dec[::-1].cumsum()[::-1] - dec
-
-    # Determine how many values are louder than the foreground ones
-    # We need to subtract one from the index, to be consistent with the definition
-    # of n_louder, as here we do want to include the background value at the
-    # found index
-    idx = numpy.searchsorted(bstat, fstat, side='left') - 1
-
-    # If the foreground are *quieter* than the background or at the same value
-    # then the search sorted alorithm will choose position -1, which does not exist
-    # We force it back to zero.
-    if isinstance(idx, numpy.ndarray): # Handle the case where our input is an array
-        idx[idx < 0] = 0
-    else: # Handle the case where we are simply given a scalar value
-        if idx < 0:
-            idx = 0
-
-    fore_n_louder = n_louder[idx]
+    index = BackgroundIndex(bstat, dec)
+    fore_n_louder = index.n_louder(fstat)
 
     if not skip_background:
-        unsort = sort.argsort()
-        back_cum_num = n_louder[unsort]
+        back_cum_num = index.background_n_louder()[1]
         return back_cum_num, fore_n_louder
     else:
         return fore_n_louder
 
-def timeslide_durations(start1, start2, end1, end2, timeslide_offsets):
+def hierarchical_removal(stat, time1, time2, timeslide_id, dec, window,
+                         max_removals=-1):
+    """ Remove, one at a time, the loudest foreground coincidence while
+    it is louder than all of the background, along with every coincidence
+    of any slide within a window of it.
+
+    The coincidences must already be clustered, so that removing some of
+    them leaves the rest clustered. Coincidences are tracked by their index
+    in the given arrays, and the background by a BackgroundIndex, so each
+    removal costs O(log N) plus the work to count the background louder
+    than the remaining foreground.
+
+    Parameters
+    ----------
+    stat: numpy.ndarray
+        Array of the ranking statistic values
+    time1: numpy.ndarray
+        Array of the times of the first detector
+    time2: numpy.ndarray
+        Array of the times of the second detector
+    timeslide_id: numpy.ndarray
+        Array of the slide ids, zero for the foreground
+    dec: numpy.ndarray
+        Array of the decimation factors
+    window: float
+        Coincidences with either time within this many seconds of the
+        average time of a removed foreground coincidence are also removed.
+    max_removals: {-1, int}
+        The largest number of removals to make, or -1 for no limit.
+
+    Yields
+    ------
+    removed: int
+        Index of the removed foreground coincidence
+    keep: numpy.ndarray
+        Boolean array, true for the coincidences left after the removal.
+        The same array is updated by each removal.
+    fore_n_louder: numpy.ndarray
+        The number of background coincidences above each of the remaining
+        foreground coincidences, in order
+    index: BackgroundIndex
+        Index of the remaining background, whose ids are the positions of
+        the coincidences among the background ones given
+    """
+    is_fore = timeslide_id == 0
+    fore = numpy.flatnonzero(is_fore)
+    back = numpy.flatnonzero(~is_fore)
+    index = BackgroundIndex(stat[back], dec[back])
+    back_id = numpy.zeros(len(stat), dtype=numpy.int64)
+    back_id[back] = numpy.arange(len(back))
+
+    keep = numpy.ones(len(stat), dtype=numpy.bool)
+    loudest = fore[stat[fore].argsort()[::-1]]
+    sort1, sort2 = time1.argsort(), time2.argsort()
+    sorted1, sorted2 = time1[sort1], time2[sort2]
+
+    num = 0
+    i = 0
+    while num != max_removals:
+        # Only the loudest remaining foreground can have no background
+        # louder than it
+        while i < len(loudest) and not keep[loudest[i]]:
+            i += 1
+        if i == len(loudest) or index.n_louder(stat[loudest[i]]) != 0:
+            break
+        removed = loudest[i]
+        num += 1
+
+        ave_time = (time1[removed] + time2[removed]) / 2.0
+        start, end = ave_time - window, ave_time + window
+        near = [sort[numpy.searchsorted(times, start):
+                     numpy.searchsorted(times, end)]
+                for sort, times in [(sort1, sorted1), (sort2, sorted2)]]
+        near = numpy.concatenate(near)
+        keep[near] = False
+        keep[removed] = False
+        index.remove(back_id[near[~is_fore[near]]])
+
+        fore_n_louder = index.n_louder(stat[keep & is_fore])
+        yield removed, keep, fore_n_louder, index
+
+def timeslide_durations(start1, start2, end1, end2, timeslide_offsets,
+                        chunk_size=2**20):
     """ Find the coincident time for each timeslide.
 
     Find the coincident time for each timeslide, where the first time vector
     is slid to the right by the offset in the given timeslide_offsets vector.
+    The overlap of each slid duration with the second set of durations is
+    found from the cumulative time of the second set, for all timeslides at
+    once.
 
     Parameters
     ----------
@@ -167,19 +229,79 @@ def timeslide_durations(start1, start2, end1, end2, timeslide_offsets):
         Array of the end of valid analyzed times for detector 2
     timseslide_offset: numpy.ndarray
         Array of offsets (in seconds) for each timeslide
+    chunk_size: {2**20, int}
+        The number of slid durations to find the overlap of at once
 
     Returns
     --------
     durations: numpy.ndarray
         Array of coincident time for each timeslide in the offset array
     """
-    from . import veto
-    durations = []
-    seg2 = veto.start_end_to_segments(start2, end2)
-    for offset in timeslide_offsets:
-        seg1 = veto.start_end_to_segments(start1 + offset, end1 + offset)
-        durations.append(abs((seg1 & seg2).coalesce()))
-    return numpy.array(durations)
+    start1, end1 = coalesce_start_end(start1, end1)
+    start2, end2 = coalesce_start_end(start2, end2)
+    offsets = numpy.array(timeslide_offsets, dtype=numpy.float64, ndmin=1)
+    durations = numpy.zeros(len(offsets))
+    if len(start1) == 0 or len(start2) == 0:
+        return durations
+
+    # The time of detector 2 before the start of each of its durations
+    lengths = end2 - start2
+    before = numpy.concatenate([[0], lengths.cumsum()])
+
+    def analyzed_before(time):
+        # The time of detector 2 before each of the given times
+        k = numpy.searchsorted(start2, time, side='right') - 1
+        within = numpy.clip(time - start2[k], 0, lengths[k])
+        return numpy.where(k < 0, 0, before[k] + within)
+
+    # The durations of detector 1 are disjoint, so the coincident time is
+    # the sum of the time of detector 2 within each of them
+    step = max(1, chunk_size // len(start1))
+    for i in range(0, len(offsets), step):
+        offset = offsets[i:i + step, None]
+        durations[i:i + step] = (analyzed_before(end1 + offset) -
+                                 analyzed_before(start1 + offset)).sum(axis=1)
+    return durations
+
+def take_ranges(values, left, right, loop_length=128):
+    """ Concatenate the slices values[l:r] for each pair of bounds
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The array to take the slices of
+    left : numpy.ndarray
+        Array of the start of each slice
+    right : numpy.ndarray
+        Array of the end of each slice
+    loop_length : {128, int}
+        Where the slices are this long or longer on average, they are copied
+        one at a time, as the cost of the loop in Python is then smaller
+        than that of building the index of every element.
+
+    Returns
+    -------
+    taken : numpy.ndarray
+        The concatenated slices
+    """
+    counts = right - left
+    keep = counts > 0
+    left, counts = left[keep], counts[keep]
+    total = counts.sum()
+    if total == 0:
+        return values[0:0]
+    if total >= loop_length * len(counts):
+        return numpy.concatenate([values[l:l + c]
+                                  for l, c in zip(left, counts)])
+
+    # Each index is one more than the one before it, except at the
+    # start of each slice, where it jumps to the left bound of the slice.
+    # The cumulative sum of these steps gives the indices.
+    steps = numpy.ones(total, dtype=numpy.int64)
+    starts = counts.cumsum()[:-1]
+    steps[0] = left[0]
+    steps[starts] = left[1:] - (left[:-1] + counts[:-1] - 1)
+    return values[steps.cumsum()]
 
 def time_coincidence(t1, t2, window, slide_step=0):
     """ Find coincidences by time window
@@ -224,13 +346,8 @@ def time_coincidence(t1, t2, window, slide_step=0):
     left = numpy.searchsorted(fold2, fold1 - window)
     right = numpy.searchsorted(fold2, fold1 + window)
 
-    idx1 = numpy.repeat(sort1, right-left)
-    idx2 = [sort2[l:r] for l,r in zip(left, right)]
-
-    if len(idx2) > 0:
-        idx2 = numpy.concatenate(idx2)
-    else:
-        idx2 = numpy.array([], dtype=numpy.int64)
+    idx1 = numpy.repeat(sort1, right - left)
+    idx2 = take_ranges(sort2, left, right)
 
     if slide_step:
         diff = ((t1 / slide_step)[idx1] - (t2 / slide_step)[idx2])
@@ -240,6 +357,197 @@ def time_coincidence(t1, t2, window, slide_step=0):
 
     return idx1.astype(numpy.uint32), idx2.astype(numpy.uint32), slide.astype(numpy.int32)
 
+def multi_time_coincidence(times, windows, slide_step=0):
+    """ Find coincidences by time window between any number of detectors
+
+    In time slide number `slide` the triggers of the k'th detector are
+    shifted by k * slide * slide_step, so that every pair of detectors is
+    slid relative to each other and a coincidence of any combination of
+    detectors has a single slide id. Each combination is found from the
+    folded times of the pairs, and extended one detector at a time, so that
+    the memory used scales with the number of coincidences rather than the
+    number of slides. With two detectors this is the same as
+    time_coincidence.
+
+    Parameters
+    ----------
+    times : list of numpy.ndarrays
+        Arrays of trigger times, one for each detector
+    windows : dict
+        The coincidence window in seconds of each pair of detectors, keyed
+        by the tuple (i, j), i < j, of their positions in `times`.
+    slide_step : optional, {None, float}
+        If calculating background coincidences, the interval between background
+        slides in seconds.
+
+    Returns
+    -------
+    coincs : dict
+        Keyed by the tuple of the positions in `times` of the detectors in
+        each combination, e.g. (0, 1), (0, 2), (1, 2) and (0, 1, 2) for three
+        detectors. Each value is a tuple of a list of arrays of indices, one
+        into the times of each detector in the combination, and the array
+        of slide ids. Coincidences of a combination are also counted in
+        those of each smaller combination they contain.
+    """
+    num = len(times)
+    coincs = {}
+    for i, j in itertools.combinations(range(num), 2):
+        idx1, idx2, slide = time_coincidence(times[i], times[j],
+                                             windows[i, j], slide_step)
+        # The pair is slid by (j - i) steps in each slide, so only the
+        # multiples of that belong to a slide of the whole network
+        if slide_step and j - i > 1:
+            keep = slide % (j - i) == 0
+            idx1, idx2, slide = idx1[keep], idx2[keep], slide[keep] // (j - i)
+        coincs[i, j] = ([idx1, idx2], slide)
+
+    for size in range(3, num + 1):
+        for combo in itertools.combinations(range(num), size):
+            ids, slide = coincs[combo[:-1]]
+            ref, det = combo[0], combo[-1]
+
+            # Where each coincidence of the smaller combination places the
+            # triggers of the added detector
+            target = times[ref][ids[0]] + (ref - det) * slide * slide_step
+            sort = times[det].argsort()
+            tdet = times[det][sort]
+            left = numpy.searchsorted(tdet, target - windows[ref, det])
+            right = numpy.searchsorted(tdet, target + windows[ref, det])
+
+            row = numpy.repeat(numpy.arange(len(target)), right - left)
+            idx = take_ranges(sort, left, right)
+
+            # The added trigger must also be in coincidence with the other
+            # detectors of the combination
+            keep = numpy.ones(len(idx), dtype=numpy.bool)
+            for pos, other in zip(combo[1:-1], ids[1:]):
+                dt = times[pos][other[row]] - times[det][idx] \
+                     + (pos - det) * slide[row] * slide_step
+                keep &= abs(dt) <= windows[pos, det]
+
+            row = row[keep]
+            ids = [i[row] for i in ids] + [idx[keep].astype(numpy.uint32)]
+            coincs[combo] = (ids, slide[row])
+
+    return coincs
+
+
+_cluster_sweep_code = """
+    // The triggers are sorted by slide, then time. l and r bound the
+    // triggers of the same slide within the window around trigger i, as
+    // numpy.searchsorted would, and only ever move forward.
+    long i = 0;
+    long j = 0;
+    long l = 0;
+    long r = 0;
+    while (i < n){
+        double t = times[i];
+        while (tslide[l] < tslide[i] || times[l] < t - window)
+            l++;
+        if (r < i)
+            r = i;
+        while (r < n && tslide[r] == tslide[i] && times[r] < t + window)
+            r++;
+
+        // If there are no other points to compare it is obviously the max
+        if ((r - l) == 1){
+            indices[j++] = i++;
+            continue;
+        }
+
+        // Find the location of the maximum within the time interval around i
+        long max_loc = l;
+        for (long k = l + 1; k < r; k++)
+            if (stat[k] > stat[max_loc])
+                max_loc = k;
+
+        // If this point is the max, we can skip to the right boundary
+        if (max_loc == i){
+            indices[j++] = i;
+            i = r;
+        }
+        // If the max is later than i, we can skip to it
+        else if (max_loc > i)
+            i = max_loc;
+        else
+            i++;
+    }
+    num[0] = j;
+"""
+
+def _cluster_sweep_compiled(stat, time, tslide, window):
+    """ Run the clustering sweep over triggers sorted by slide then time,
+    keeping the loudest in each window, in a compiled loop
+    """
+    from scipy.weave import inline
+    from pycbc import WEAVE_FLAGS
+    stat = numpy.array(stat, dtype=numpy.float64)
+    times = time
+    n = len(times)
+    window = float(window)
+    indices = numpy.zeros(n, dtype=numpy.int64)
+    num = numpy.zeros(1, dtype=numpy.int64)
+    inline(_cluster_sweep_code,
+           ['stat', 'times', 'tslide', 'window', 'n', 'indices', 'num'],
+           extra_compile_args=[WEAVE_FLAGS])
+    return indices[:num[0]]
+
+def _cluster_sweep_python(stat, time, tslide, window, argmax,
+                          chunk_size=2**20):
+    """ Run the clustering sweep over triggers sorted by slide then time,
+    keeping the loudest in each window as chosen by the given argmax
+    """
+    indices = numpy.zeros(len(time), dtype=numpy.int64)
+
+    # Find the window around each trigger among those of its own slide,
+    # a chunk of slides at a time
+    bounds = numpy.flatnonzero(numpy.diff(tslide)) + 1
+    bounds = numpy.concatenate([[0], bounds, [len(tslide)]])
+    left = numpy.zeros(len(time), dtype=numpy.int64)
+    right = numpy.zeros(len(time), dtype=numpy.int64)
+    start = 0
+    while start < len(bounds) - 1:
+        end = numpy.searchsorted(bounds, bounds[start] + chunk_size,
+                                 side='right') - 1
+        end = max(end, start + 1)
+        for s, e in zip(bounds[start:end], bounds[start + 1:end + 1]):
+            t = time[s:e]
+            left[s:e] = numpy.searchsorted(t, t - window) + s
+            right[s:e] = numpy.searchsorted(t, t + window) + s
+        start = end
+
+    # i is the index we are inspecting, j is the next one to save
+    i = 0
+    j = 0
+    while i < len(left):
+        l = left[i]
+        r = right[i]
+
+        # If there are no other points to compare it is obviously the max
+        if (r - l) == 1:
+            indices[j] = i
+            j += 1
+            i += 1
+            continue
+
+        # Find the location of the maximum within the time interval around i
+        max_loc = argmax(stat[l:r]) + l
+
+        # If this point is the max, we can skip to the right boundary
+        if max_loc == i:
+            indices[j] = i
+            i = r
+            j += 1
+
+        # If the max is later than i, we can skip to it
+        elif max_loc > i:
+            i = max_loc
+
+        elif max_loc < i:
+            i += 1
+
+    return indices[:j]
 
 def cluster_coincs(stat, time1, time2, timeslide_id, slide, window, argmax=numpy.argmax):
     """Cluster coincident events for each timeslide separately, across
@@ -259,6 +567,9 @@ def cluster_coincs(stat, time1, time2, timeslide_id, slide, window, argmax=numpy
         length of the timeslides offset interval
     window: float
         length to cluster over
+    argmax: function, optional
+        Function that chooses the loudest of a set of ranking values. The
+        sweep is compiled for the default, numpy.argmax.
 
     Returns
     -------
@@ -271,62 +582,255 @@ def cluster_coincs(stat, time1, time2, timeslide_id, slide, window, argmax=numpy
         logging.info('No coinc triggers in one, or both, ifos.')
         return numpy.array([])
 
-    indices = []
     if numpy.isfinite(slide):
         time = (time2 + (time1 + timeslide_id * slide)) / 2
     else:
         time = 0.5 * (time2 + time1)
+    time = numpy.array(time, dtype=numpy.float64)
 
-    tslide = timeslide_id.astype(numpy.float128)
-    time = time.astype(numpy.float128)
+    # Each timeslide is clustered separately, so sort by the integer slide
+    # and then by time rather than offsetting the times of each slide
+    tslide = numpy.rint(timeslide_id).astype(numpy.int64)
 
-    span = (time.max() - time.min()) + window * 10
-    time = time + span * tslide
-
-    time_sorting = time.argsort()
+    logging.info('sorting...')
+    time_sorting = numpy.lexsort((time, tslide))
     stat = stat[time_sorting]
     time = time[time_sorting]
-
-    logging.info('sorting...')
-    left = numpy.searchsorted(time, time - window)
-    right = numpy.searchsorted(time, time + window)
+    tslide = tslide[time_sorting]
     logging.info('done sorting')
-    indices = numpy.zeros(len(left), dtype=numpy.uint32)
 
-    # i is the index we are inspecting, j is the next one to save
-    i = 0
-    j = 0
-    while i < len(left):
-        l = left[i]
-        r = right[i]
+    if argmax is numpy.argmax and stat.dtype.names is None:
+        indices = _cluster_sweep_compiled(stat, time, tslide, window)
+    else:
+        indices = _cluster_sweep_python(stat, time, tslide, window, argmax)
 
-        # If there are no other points to compare it is obviously the max
-        if (r - l) == 1:
-            indices[j] = i
-            j += 1
-            i += 1
-            continue
+    logging.info('done clustering coinc triggers: %s triggers remaining' % len(indices))
+    return time_sorting[indices]
 
-        # Find the location of the maximum within the time interval around i
-        max_loc = argmax(stat[l:r]) + l
 
-        # If this point is the max, we can skip to the right boundary
-        if max_loc == i:
-            indices[j] = i
-            i = r
-            j += 1
+class BackgroundIndex(object):
+    """ Sorted index of background ranking statistic values and their
+    decimation factors, which counts the background louder than any given
+    values as entries are removed and added.
+
+    The decimation factors of the sorted values are kept in a binary indexed
+    (Fenwick) tree, so that removing an entry, or counting the indexed
+    background above a value, takes O(log N) time. The positions of the
+    tree are fixed, so new values cannot be inserted into it directly.
+    They are instead held in a sorted buffer of up to B entries, B being
+    `buffer_size`, and the whole index is rebuilt with a sort once the
+    buffer is full. Adding an entry therefore costs O(B) to keep the buffer
+    sorted, plus its O(N log N / B) share of the rebuilds, which is
+    O(sqrt(N) log N) amortised with the default B of sqrt(N). Counting also
+    needs O(B) to sum the buffer the first time after it changes. The
+    counts are those of calculate_n_louder applied to the entries in the
+    index.
+    """
 
-        # If the max is later than i, we can skip to it
-        elif max_loc > i:
-            i = max_loc
+    def __init__(self, stat, dec, buffer_size=None):
+        """
+        Parameters
+        ----------
+        stat: numpy.ndarray
+            Array of the background statistic values
+        dec: numpy.ndarray
+            Array of the decimation factors for the background statistics
+        buffer_size: int, optional
+            The number of added entries to hold before they are merged into
+            the index. The default is the square root of the number of
+            entries, and at least 1024.
+        """
+        stat = numpy.array(stat, ndmin=1)
+        dec = numpy.array(dec, ndmin=1)
+        self.wtype = numpy.int64 if dec.dtype.kind in 'biu' else numpy.float64
+        self.buffer_size = buffer_size
+        self._next_id = len(stat)
+        self._build(stat, dec.astype(self.wtype), numpy.arange(len(stat)))
+
+    def _build(self, stat, dec, ids):
+        sort = stat.argsort()
+        self.stat = stat[sort]
+        self.weight = dec[sort]
+        self.ids = ids[sort]
+        self.alive = numpy.ones(len(stat), dtype=numpy.bool)
+        self.first = 0
+
+        # The position in the index of each entry id, -1 if not indexed
+        self.pos = numpy.zeros(self._next_id, dtype=numpy.int64) - 1
+        self.pos[self.ids] = numpy.arange(len(self.ids))
+
+        # Node i of the tree holds the sum of the weights at the positions
+        # [i - (i & -i), i)
+        cum = numpy.zeros(len(stat) + 1, dtype=self.wtype)
+        cum[1:] = self.weight.cumsum()
+        node = numpy.arange(len(cum))
+        self.tree = cum - cum[node - (node & -node)]
+        self.total = cum[-1]
+
+        self.extra_stat = numpy.array([], dtype=stat.dtype)
+        self.extra_weight = numpy.array([], dtype=self.wtype)
+        self.extra_ids = numpy.array([], dtype=numpy.int64)
+        self._extra_cum = None
+
+        if self.buffer_size is None:
+            self.max_extra = max(1024, int(len(stat) ** 0.5))
+        else:
+            self.max_extra = self.buffer_size
 
-        elif max_loc < i:
-            i += 1
+    def __len__(self):
+        return int(self.alive.sum()) + len(self.extra_ids)
+
+    def _prefix(self, pos):
+        """ Sum the weights of the indexed entries before each position """
+        pos = numpy.array(pos, dtype=numpy.int64, ndmin=1)
+        total = numpy.zeros(len(pos), dtype=self.wtype)
+        locs = numpy.arange(len(pos))
+        pos, locs = pos[pos > 0], locs[pos > 0]
+        while len(pos) > 0:
+            total[locs] += self.tree[pos]
+            pos &= pos - 1
+            locs = locs[pos > 0]
+            pos = pos[pos > 0]
+        return total
 
-    indices = indices[:j]
+    def _update(self, pos, delta):
+        """ Add delta to the weights of the indexed entries at pos """
+        node = pos + 1
+        while len(node) > 0:
+            numpy.add.at(self.tree, node, delta)
+            node = node + (node & -node)
+            keep = node < len(self.tree)
+            node, delta = node[keep], delta[keep]
 
-    logging.info('done clustering coinc triggers: %s triggers remaining' % len(indices))
-    return time_sorting[indices]
+    def remove(self, ids):
+        """ Remove entries from the index
+
+        Parameters
+        ----------
+        ids: numpy.ndarray
+            The ids of the entries to remove. Those of the initial values
+            are their position in the arrays given to the index.
+        """
+        ids = numpy.unique(numpy.array(ids, dtype=numpy.int64, ndmin=1))
+        pos = self.pos[ids[ids < len(self.pos)]]
+        pos = pos[pos >= 0]
+        pos = pos[self.alive[pos]]
+        self.alive[pos] = False
+        self._update(pos, -self.weight[pos])
+        self.total -= self.weight[pos].sum()
+
+        keep = numpy.in1d(self.extra_ids, ids, invert=True)
+        if not keep.all():
+            self.extra_stat = self.extra_stat[keep]
+            self.extra_weight = self.extra_weight[keep]
+            self.extra_ids = self.extra_ids[keep]
+            self._extra_cum = None
+
+    def add(self, stat, dec):
+        """ Add entries to the index
+
+        Parameters
+        ----------
+        stat: numpy.ndarray
+            Array of the background statistic values
+        dec: numpy.ndarray
+            Array of the decimation factors for the background statistics
+
+        Returns
+        -------
+        ids: numpy.ndarray
+            The ids of the new entries
+        """
+        stat = numpy.array(stat, ndmin=1)
+        dec = numpy.array(dec, ndmin=1).astype(self.wtype)
+        ids = numpy.arange(self._next_id, self._next_id + len(stat))
+        self._next_id += len(stat)
+
+        # Insert into the sorted buffer after any equal values already there
+        sort = stat.argsort(kind='mergesort')
+        stat, dec, new_ids = stat[sort], dec[sort], ids[sort]
+        where = numpy.searchsorted(self.extra_stat, stat, side='right')
+        self.extra_stat = numpy.insert(self.extra_stat, where, stat)
+        self.extra_weight = numpy.insert(self.extra_weight, where, dec)
+        self.extra_ids = numpy.insert(self.extra_ids, where, new_ids)
+        self._extra_cum = None
+
+        if len(self.extra_ids) > self.max_extra:
+            self.merge()
+        return ids
+
+    def merge(self):
+        """ Rebuild the index with the added entries, dropping those that
+        have been removed
+        """
+        self._build(numpy.concatenate([self.stat[self.alive], self.extra_stat]),
+                    numpy.concatenate([self.weight[self.alive],
+                                       self.extra_weight]),
+                    numpy.concatenate([self.ids[self.alive], self.extra_ids]))
+
+    def n_louder(self, fstat):
+        """ Calculate the number of background events in the index that are
+        louder than each of the given values
+
+        Parameters
+        ----------
+        fstat: numpy.ndarray
+            Array of the foreground statistic values
+
+        Returns
+        -------
+        fore_n_louder: numpy.ndarray
+            The number of background triggers above each foreground trigger
+        """
+        scalar = numpy.isscalar(fstat) or numpy.ndim(fstat) == 0
+        fstat = numpy.array(fstat, ndmin=1)
+        if len(self) == 0:
+            count = numpy.zeros(len(fstat), dtype=self.wtype)
+            return count[0] if scalar else count
+
+        idx = numpy.searchsorted(self.stat, fstat, side='left')
+        count = self.total - self._prefix(idx)
+        if len(self.extra_ids) > 0:
+            if self._extra_cum is None:
+                cum = numpy.zeros(len(self.extra_ids) + 1, dtype=self.wtype)
+                cum[:-1] = self.extra_weight[::-1].cumsum()[::-1]
+                self._extra_cum = cum
+            count += self._extra_cum[numpy.searchsorted(self.extra_stat, fstat,
+                                            side='left')]
+
+        # As in calculate_n_louder, the quietest background value is not
+        # counted for foreground values at or below it
+        while self.first < len(self.alive) and not self.alive[self.first]:
+            self.first += 1
+        if self.first < len(self.alive) and (len(self.extra_ids) == 0 or
+                              self.stat[self.first] <= self.extra_stat[0]):
+            quietest = self.stat[self.first]
+            quietest_weight = self.weight[self.first]
+        else:
+            quietest = self.extra_stat[0]
+            quietest_weight = self.extra_weight[0]
+        count[fstat <= quietest] -= quietest_weight
+
+        return count[0] if scalar else count
+
+    def background_n_louder(self):
+        """ Calculate the number of background events in the index that are
+        louder than each of its entries
+
+        Returns
+        -------
+        ids: numpy.ndarray
+            The ids of the entries in the index, in increasing order
+        back_cum_num: numpy.ndarray
+            The number of background triggers above each of the entries
+        """
+        if len(self.extra_ids) > 0:
+            self.merge()
+        weight = self.weight[self.alive]
+        ids = self.ids[self.alive]
+        n_louder = weight[::-1].cumsum()[::-1] - weight
+        order = ids.argsort()
+        return ids[order], n_louder[order]
 
 class MultiRingBuffer(object):
     """Dynamic size n-dimensional ring buffer that can expire elements."""
@@ -24,7 +24,7 @@
 """This modules defines functions for clustering and thresholding timeseries to
 produces event triggers
 """
-import lal, numpy, copy, os.path
+import lal, numpy, copy, os.path, logging
 
 from pycbc import WEAVE_FLAGS
 from pycbc.types import Array
@@ -207,7 +207,57 @@ def effsnr(snr, reduced_x2, fac=250.):
     else:
         return effsnr[0]
 
+class EventSpool(object):
+    """ A temporary store on disk of events, appended to in chunks.
+
+    Parameters
+    ----------
+    filename : str
+        The HDF5 file to hold the events. It is removed by `close`.
+    dtype : numpy.dtype
+        The type of the events.
+    chunk_size : {65536, int}
+        The number of events in each chunk of the HDF5 dataset. This is the
+        unit in which HDF5 reads and writes the store, not a limit on the
+        number of events appended or read together.
+    """
+    def __init__(self, filename, dtype, chunk_size=2**16):
+        import h5py
+        self.filename = filename
+        self.file = h5py.File(filename, 'w')
+        self.data = self.file.create_dataset('events', shape=(0,),
+                                             maxshape=(None,), dtype=dtype,
+                                             chunks=(max(1, chunk_size),))
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, events):
+        """ Add events to the end of the store.
+        """
+        if len(events) == 0:
+            return
+        num = len(self.data)
+        self.data.resize((num + len(events),))
+        self.data[num:] = events
+
+    def chunks(self, size):
+        """ Iterate over the stored events in arrays of at most size events.
+        """
+        for start in xrange(0, len(self.data), size):
+            yield self.data[start:start + size]
+
+    def close(self):
+        """ Close and remove the store.
+        """
+        self.file.close()
+        os.remove(self.filename)
+
 class EventManager(object):
+    # Reductions which keep a number of events that depends on the analysed
+    # time rather than on the number of events
+    bounded_reductions = ['keep_loudest_in_interval', 'maximize_over_bank']
+
     def __init__(self, opt, column, column_types, **kwds):
         self.opt = opt
         self.global_params = kwds
@@ -221,6 +271,39 @@ class EventManager(object):
         self.template_index = -1
         self.template_events = numpy.array([], dtype=self.event_dtype)
         self.write_performance = False
+        self.num_found = 0
+        self.spool = None
+        self.max_events = None
+        self.next_flush = None
+        self.stream_reductions = []
+        self.final_reductions = []
+
+    @property
+    def events(self):
+        """ The events found so far, as a structured array.
+        """
+        return self._events[:self._num_events]
+
+    @events.setter
+    def events(self, events):
+        self._events = events
+        self._num_events = len(events)
+
+    def append_events(self, events):
+        """ Add events to the end of the events found so far.
+
+        The events are held in an array which grows geometrically, so that
+        adding the events of each template in turn takes time linear in the
+        total number of events.
+        """
+        num = self._num_events + len(events)
+        if num > len(self._events):
+            store = numpy.zeros(max(num, 2 * len(self._events)),
+                                dtype=self._events.dtype)
+            store[:self._num_events] = self.events
+            self._events = store
+        self._events[self._num_events:num] = events
+        self._num_events = num
 
     @classmethod
     def from_multi_ifo_interface(cls, opt, ifo, column, column_types, **kwds):
@@ -237,12 +320,10 @@ class EventManager(object):
         return cls(opt, column, column_types, **kwds)
 
     def chisq_threshold(self, value, num_bins, delta=0):
-        remove = []
-        for i, event in enumerate(self.events):
-            xi = event['chisq'] / (event['chisq_dof'] / 2 + 1 + delta * event['snr'].conj() * event['snr'])
-            if xi > value:
-                remove.append(i)
-        self.events = numpy.delete(self.events, remove)
+        e = self.events
+        snrsq = (e['snr'].conj() * e['snr']).real
+        xi = e['chisq'] / (e['chisq_dof'] / 2 + 1 + delta * snrsq)
+        self.events = e[~(xi > value)]
 
     def newsnr_threshold(self, threshold):
         """ Remove events with newsnr smaller than given threshold
@@ -250,9 +331,12 @@ class EventManager(object):
         if not self.opt.chisq_bins:
             raise RuntimeError('Chi-square test must be enabled in order to use newsnr threshold')
 
-        remove = [i for i, e in enumerate(self.events) if \
-            newsnr(abs(e['snr']), e['chisq'] / e['chisq_dof']) < threshold]
-        self.events = numpy.delete(self.events, remove)
+        e = self.events
+        if len(e) == 0:
+            return
+        stat = numpy.array(newsnr(abs(e['snr']), e['chisq'] / e['chisq_dof']),
+                           ndmin=1)
+        self.events = e[~(stat < threshold)]
         
     def keep_near_injection(self, window, injections):
         from pycbc.events.veto import indices_within_times
@@ -270,18 +354,18 @@ class EventManager(object):
             return
         
         e = self.events
-        stat = newsnr(abs(e['snr']), e['chisq'] / e['chisq_dof'])
+        stat = numpy.array(newsnr(abs(e['snr']), e['chisq'] / e['chisq_dof']),
+                           ndmin=1)
         time = e['time_index']
         
         wtime = (time / window).astype(numpy.int32)
-        bins = numpy.unique(wtime)
-        
-        keep = []
-        for b in bins:
-            bloc = numpy.where((wtime == b))[0]
-            bloudest = stat[bloc].argsort()[-num_keep:]
-            keep.append(bloc[bloudest])
-        keep = numpy.concatenate(keep)
+
+        # Sort by interval and then by statistic, and keep the last num_keep
+        # events of each interval
+        order = numpy.lexsort((stat, wtime))
+        wtime = wtime[order]
+        last = numpy.searchsorted(wtime, wtime, side='right')
+        keep = order[numpy.arange(len(order)) >= last - num_keep]
         self.events = e[keep]
 
     def maximize_over_bank(self, tcolumn, column, window):
@@ -292,22 +376,6 @@ class EventManager(object):
         cvec = self.events[column]
         tvec = self.events[tcolumn]
 
-        indices = []
-#        mint = tvec.min()
-#        maxt = tvec.max()
-#        edges = numpy.arange(mint, maxt, window)
-
-#        # Get the location of each time bin
-#        bins = numpy.searchsorted(tvec, edges)
-#        bins = numpy.append(bins, len(tvec))
-#        for i in range(len(bins)-1):
-#            kmin = bins[i]
-#            kmax = bins[i+1]
-#            if kmin == kmax:
-#                continue
-#            event_idx = numpy.argmax(cvec[kmin:kmax]) + kmin
-#            indices.append(event_idx)
-
         # This algorithm is confusing, but it is what lalapps_inspiral does
         # REMOVE ME!!!!!!!!!!!
         gps = tvec.astype(numpy.float64) / self.opt.sample_rate + self.opt.gps_start_time
@@ -317,13 +385,16 @@ class EventManager(object):
         wnsec = int(window * 1e9 / self.opt.sample_rate)
         win = gps_nsec.astype(int) / wnsec
 
-        indices.append(0)
-        for i in xrange(len(tvec)):
-            if gps_sec[i] == gps_sec[indices[-1]] and  win[i] == win[indices[-1]]:
-                    if abs(cvec[i]) > abs(cvec[indices[-1]]):
-                        indices[-1] = i
-            else:
-                indices.append(i)
+        # Events are grouped by the second and window they fall in, which
+        # are ordered in time, and the first of the loudest of each group
+        # is kept
+        start = numpy.ones(len(tvec), dtype=bool)
+        start[1:] = (gps_sec[1:] != gps_sec[:-1]) | (win[1:] != win[:-1])
+        group = numpy.cumsum(start)
+        order = numpy.lexsort((numpy.arange(len(tvec)), -abs(cvec), group))
+        first = numpy.ones(len(tvec), dtype=bool)
+        first[1:] = group[order][1:] != group[order][:-1]
+        indices = order[first]
 
         self.events = numpy.take(self.events, indices)
 
@@ -363,8 +434,92 @@ class EventManager(object):
         self.template_params[-1].update(kwds)
 
     def finalize_template_events(self):
-        self.events = numpy.append(self.events, self.template_events)
+        self.num_found += len(self.template_events)
+        self.append_events(self.template_events)
         self.template_events = numpy.array([], dtype=self.event_dtype)
+        if self.next_flush is not None and len(self.events) >= self.next_flush:
+            self.flush_events()
+
+    def stream_events(self, spool_name, max_events, reductions=()):
+        """ Keep a bounded number of events in memory while filtering.
+
+        Once more than max_events events are held, the reductions are applied
+        to them. If none of the reductions is one of `bounded_reductions`,
+        the remaining events are then moved to a spool file on disk, from
+        which they are read back in chunks when written out. Otherwise, the
+        reductions up to the first bounded reduction are applied to the
+        events held so far, which bounds their number, and the later
+        reductions are applied by `finish_streaming`. In either case the
+        events written are those the reductions would leave if applied once
+        all events were found.
+
+        Parameters
+        ----------
+        spool_name : str
+            The name of the temporary spool file.
+        max_events : int
+            The number of events held before they are reduced.
+        reductions : list of tuples
+            Each is the name of a reduction method of this class, such as
+            'chisq_threshold', and a tuple of its arguments, in the order
+            they are to be applied.
+        """
+        reductions = list(reductions)
+        names = [r[0] for r in reductions]
+        bounded = [i for i, n in enumerate(names)
+                   if n in self.bounded_reductions]
+        if bounded:
+            self.stream_reductions = reductions[:bounded[0] + 1]
+            self.final_reductions = reductions[bounded[0] + 1:]
+        else:
+            self.stream_reductions = reductions
+            self.final_reductions = []
+            self.spool = EventSpool(spool_name, self.event_dtype,
+                                    min(max_events, 2**16))
+        self.max_events = max_events
+        self.next_flush = max_events
+
+    def apply_reductions(self, reductions):
+        """ Apply the named reduction methods, in order, to the events held.
+        """
+        for name, args in reductions:
+            getattr(self, name)(*args)
+
+    def flush_events(self):
+        """ Reduce the events held, and move them to the spool if there is
+        one.
+        """
+        self.apply_reductions(self.stream_reductions)
+        if self.spool is not None:
+            # Later templates are always flushed later, so the spool stays
+            # sorted by template
+            self.events.sort(order='template_id')
+            self.spool.append(self.events)
+            self.events = numpy.array([], dtype=self.event_dtype)
+        elif self.max_events is not None:
+            # Reducing again before the events held have doubled would
+            # reduce the same events once per template
+            if len(self.events) >= self.max_events:
+                logging.warn("%s events remain after the reductions, more "
+                             "than the buffer limit of %s; the limit is too "
+                             "small for the reductions used",
+                             len(self.events), self.max_events)
+            self.next_flush = max(self.max_events, 2 * len(self.events))
+
+    def finish_streaming(self):
+        """ Apply all the reductions given to `stream_events` to the
+        remaining events.
+
+        Returns
+        -------
+        num_events : int
+            The number of events remaining.
+        """
+        self.flush_events()
+        self.apply_reductions(self.final_reductions)
+        if self.spool is not None:
+            return len(self.spool) + len(self.events)
+        return len(self.events)
 
     def make_output_dir(self, outname):
         path = os.path.dirname(outname)
@@ -373,10 +528,15 @@ class EventManager(object):
                 os.makedirs(path)
 
     def save_performance(self, ncores, nfilters, ntemplates, run_time,
-                         setup_time):
+                         setup_time, chisq_method_counts=None):
         """
         Calls variables from pycbc_inspiral to be used in a timing calculation
+
+        If given, chisq_method_counts is a dictionary of the number of
+        templates for which each power chisq method was used, which is
+        written alongside the timing information.
         """
+        self.chisq_method_counts = chisq_method_counts
         self.run_time = run_time
         self.setup_time = setup_time
         self.ncores = ncores
@@ -394,6 +554,72 @@ class EventManager(object):
         else:
             raise ValueError('Cannot write to this format')
 
+    def write_event_columns(self, store, events):
+        """ Store the output columns of a set of events.
+
+        Parameters
+        ----------
+        store : function
+            Called with the name and values of each column.
+        events : numpy.ndarray
+            The events, sorted by template id.
+        """
+        if not len(events):
+            return
+
+        th = numpy.array([p['tmplt'].template_hash for p in self.template_params])
+        tid = events['template_id']
+
+        store('snr', abs(events['snr']))
+        try:
+            # Precessing
+            store('u_vals', events['u_vals'])
+            store('coa_phase', events['coa_phase'])
+            store('hplus_cross_corr', events['hplus_cross_corr'])
+        except Exception:
+            # Not precessing
+            store('coa_phase', numpy.angle(events['snr']))
+        store('chisq', events['chisq'])
+        store('bank_chisq', events['bank_chisq'])
+        store('bank_chisq_dof', events['bank_chisq_dof'])
+        store('cont_chisq', events['cont_chisq'])
+        store('end_time', events['time_index'] / float(self.opt.sample_rate) + self.opt.gps_start_time)
+        try:
+            # Precessing
+            template_sigmasq_plus = numpy.array([t['sigmasq_plus'] for t in self.template_params], dtype=numpy.float32)
+            store('sigmasq_plus', template_sigmasq_plus[tid])
+            template_sigmasq_cross = numpy.array([t['sigmasq_cross'] for t in self.template_params], dtype=numpy.float32)
+            store('sigmasq_cross', template_sigmasq_cross[tid])
+            # FIXME: I want to put something here, but I haven't yet
+            #        figured out what it should be. I think we would also
+            #        need information from the plus and cross correlation
+            #        (both real and imaginary(?)) to get this.
+            store('sigmasq', template_sigmasq_plus[tid])
+        except Exception:
+            # Not precessing
+            template_sigmasq = numpy.array([t['sigmasq'] for t in self.template_params], dtype=numpy.float32)
+            store('sigmasq', template_sigmasq[tid])
+
+        template_durations = [p['tmplt'].template_duration for p in self.template_params]
+        store('template_duration', numpy.array(template_durations, dtype=numpy.float32)[tid])
+
+        # FIXME: Can we get this value from the autochisq instance?
+        cont_dof = self.opt.autochi_number_points
+        if self.opt.autochi_onesided is None:
+            cont_dof = cont_dof * 2
+        if self.opt.autochi_two_phase:
+            cont_dof = cont_dof * 2
+        if self.opt.autochi_max_valued_dof:
+            cont_dof = self.opt.autochi_max_valued_dof
+        store('cont_chisq_dof', numpy.repeat(cont_dof, len(events)))
+
+        if 'chisq_dof' in events.dtype.names:
+            store('chisq_dof', events['chisq_dof'] / 2 + 1)
+        else:
+            store('chisq_dof', numpy.zeros(len(events)))
+
+        store('template_hash', th[tid])
+
     def write_to_hdf(self, outname):
         class fw(object):
             def __init__(self, name, prefix):
@@ -408,61 +634,30 @@ class EventManager(object):
                                       compression_opts=9,
                                       shuffle=True)
 
-        self.events.sort(order='template_id')
-        th = numpy.array([p['tmplt'].template_hash for p in self.template_params])
-        tid = self.events['template_id']
-        f = fw(outname, self.opt.channel_name[0:2])
-
-        if len(self.events):
-            f['snr'] = abs(self.events['snr'])
-            try:
-                # Precessing
-                f['u_vals'] = self.events['u_vals']
-                f['coa_phase'] = self.events['coa_phase']
-                f['hplus_cross_corr'] = self.events['hplus_cross_corr']
-            except Exception:
-                # Not precessing
-                f['coa_phase'] = numpy.angle(self.events['snr'])
-            f['chisq'] = self.events['chisq']
-            f['bank_chisq'] = self.events['bank_chisq']
-            f['bank_chisq_dof'] = self.events['bank_chisq_dof']
-            f['cont_chisq'] = self.events['cont_chisq']
-            f['end_time'] = self.events['time_index'] / float(self.opt.sample_rate) + self.opt.gps_start_time
-            try:
-                # Precessing
-                template_sigmasq_plus = numpy.array([t['sigmasq_plus'] for t in self.template_params], dtype=numpy.float32)
-                f['sigmasq_plus'] = template_sigmasq_plus[tid]
-                template_sigmasq_cross = numpy.array([t['sigmasq_cross'] for t in self.template_params], dtype=numpy.float32)
-                f['sigmasq_cross'] = template_sigmasq_cross[tid]
-                # FIXME: I want to put something here, but I haven't yet
-                #        figured out what it should be. I think we would also
-                #        need information from the plus and cross correlation
-                #        (both real and imaginary(?)) to get this.
-                f['sigmasq'] = template_sigmasq_plus[tid]
-            except Exception:
-                # Not precessing
-                template_sigmasq = numpy.array([t['sigmasq'] for t in self.template_params], dtype=numpy.float32)
-                f['sigmasq'] = template_sigmasq[tid]
-
-            template_durations = [p['tmplt'].template_duration for p in self.template_params]
-            f['template_duration'] = numpy.array(template_durations, dtype=numpy.float32)[tid]
-
-            # FIXME: Can we get this value from the autochisq instance?
-            cont_dof = self.opt.autochi_number_points
-            if self.opt.autochi_onesided is None:
-                cont_dof = cont_dof * 2
-            if self.opt.autochi_two_phase:
-                cont_dof = cont_dof * 2
-            if self.opt.autochi_max_valued_dof:
-                cont_dof = self.opt.autochi_max_valued_dof
-            f['cont_chisq_dof'] = numpy.repeat(cont_dof, len(self.events))
-
-            if 'chisq_dof' in self.events.dtype.names:
-                f['chisq_dof'] = self.events['chisq_dof'] / 2 + 1
-            else:
-                f['chisq_dof'] = numpy.zeros(len(self.events))
+            def append(self, name, data):
+                col = self.prefix + '/' + name
+                if col not in self.f:
+                    self.f.create_dataset(col, data=data, maxshape=(None,),
+                                          compression='gzip',
+                                          compression_opts=9,
+                                          shuffle=True)
+                else:
+                    dset = self.f[col]
+                    num = len(dset)
+                    dset.resize((num + len(data),))
+                    dset[num:] = data
 
-            f['template_hash'] = th[tid]
+        f = fw(outname, self.opt.channel_name[0:2])
+        if self.spool is None:
+            self.events.sort(order='template_id')
+            self.write_event_columns(f.__setitem__, self.events)
+        else:
+            # The spooled events are already in template order
+            for events in self.spool.chunks(self.max_events):
+                self.write_event_columns(f.append, events)
+            self.write_event_columns(f.append, self.events)
+            self.spool.close()
+            self.spool = None
 
         if self.opt.trig_start_time:
             f['search/start_time'] = numpy.array([self.opt.trig_start_time])
@@ -488,6 +683,10 @@ class EventManager(object):
                 numpy.array([filters_per_core / float(self.run_time)])
             f['search/setup_time_fraction'] = \
                 numpy.array([float(self.setup_time) / float(self.run_time)])
+            if self.chisq_method_counts:
+                for method in self.chisq_method_counts:
+                    f['search/chisq_method_' + method] = \
+                        numpy.array([self.chisq_method_counts[method]])
 
         if 'gating_info' in self.global_params:
             gating_info = self.global_params['gating_info']
@@ -585,8 +784,7 @@ class EventManagerMultiDet(EventManager):
                         event2 = self.template_event_dict[ifo2][idx2]
                         self.coinc_list.append((event1, event2))
         for ifo in self.ifos:
-            self.events = numpy.append(self.events,
-                                       self.template_event_dict[ifo])
+            self.append_events(self.template_event_dict[ifo])
             self.template_event_dict[ifo] = numpy.array([],
                                                         dtype=self.event_dtype)
 
@@ -711,6 +909,10 @@ class EventManagerMultiDet(EventManager):
                     numpy.array([filters_per_core / float(self.run_time)])
                 f['search/setup_time_fraction'] = \
                     numpy.array([float(self.setup_time) / float(self.run_time)])
+                if self.chisq_method_counts:
+                    for method in self.chisq_method_counts:
+                        f['search/chisq_method_' + method] = \
+                            numpy.array([self.chisq_method_counts[method]])
 
             if 'gating_info' in self.global_params:
                 gating_info = self.global_params['gating_info']
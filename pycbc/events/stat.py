@@ -52,6 +52,10 @@ def get_newsnr(trigs):
 class Stat(object):
 
     """ Base class which should be extended to provide a coincident statistic"""
+
+    # Whether coinc_multiifo gives the statistic of more than two detectors
+    multiifo = False
+
     def __init__(self, files):
         """Create a statistic class instance
 
@@ -80,6 +84,8 @@ class NewSNRStatistic(Stat):
 
     """ Calculate the NewSNR coincident detection statistic """
 
+    multiifo = True
+
     def single(self, trigs):
         """Calculate the single detector statistic, here equal to newsnr
 
@@ -113,6 +119,25 @@ class NewSNRStatistic(Stat):
         """
         return (s0**2. + s1**2.) ** 0.5
 
+    def coinc_multiifo(self, stats, slide, step):
+        """Calculate the coincident statistic of more than two detectors,
+        the quadrature sum of the single detector values.
+
+        Parameters
+        ----------
+        stats: list of numpy.ndarrays
+            Single detector ranking statistic of each detector in the
+        coincidence.
+        slide: (unused in this statistic)
+        step: (unused in this statistic)
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of coincident ranking statistic values
+        """
+        return sum([s**2. for s in stats]) ** 0.5
+
 
 class NewSNRCutStatistic(NewSNRStatistic):
 
@@ -159,6 +184,13 @@ class NewSNRCutStatistic(NewSNRStatistic):
         cstat[s1==-1] = 0
         return cstat
 
+    def coinc_multiifo(self, stats, slide, step):
+        """Calculate the coincident statistic of more than two detectors"""
+        cstat = NewSNRStatistic.coinc_multiifo(self, stats, slide, step)
+        for s in stats:
+            cstat[s==-1] = 0
+        return cstat
+
 
 class PhaseTDStatistic(NewSNRStatistic):
 
@@ -167,6 +199,10 @@ class PhaseTDStatistic(NewSNRStatistic):
     The weighting is based on the PDF of time delays, phase differences and
     amplitude ratios between triggers in different ifos.
     """
+
+    # The signal rate histogram is only defined for pairs of detectors
+    multiifo = False
+
     def __init__(self, files):
         NewSNRStatistic.__init__(self, files)
         self.hist = self.files['phasetd_newsnr']['map'][:]
@@ -285,6 +321,9 @@ class ExpFitStatistic(NewSNRStatistic):
     template over single-ifo newsnr values.
     """
 
+    # The noise rate is only fitted for pairs of detectors
+    multiifo = False
+
     def __init__(self, files):
         if not len(files):
             raise RuntimeError("Can't find any statistic files !")
@@ -363,6 +402,9 @@ class ExpFitCombinedSNR(ExpFitStatistic):
     approximates combined (new)snr for coincs with similar newsnr in each ifo
     """
 
+    # coinc_multiifo scales the sum over any number of detectors
+    multiifo = True
+
     def __init__(self, files):
         ExpFitStatistic.__init__(self, files)
         # for low-mass templates the exponential slope alpha \approx 6
@@ -381,6 +423,10 @@ class ExpFitCombinedSNR(ExpFitStatistic):
         # scale by 1/sqrt(2) to resemble network SNR
         return (s0 + s1) / (2.**0.5)
 
+    def coinc_multiifo(self, stats, slide, step):
+        # scale by 1/sqrt(n) to resemble network SNR
+        return sum(stats) / (len(stats)**0.5)
+
 
 class PhaseTDExpFitStatistic(PhaseTDStatistic, ExpFitCombinedSNR):
 
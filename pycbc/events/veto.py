@@ -1,7 +1,7 @@
 """ This module contains utilities to manipulate trigger lists based on 
 segment.
 """
-import numpy, urlparse, os.path
+import numpy, urlparse, os.path, hashlib, tempfile
 import lal
 from glue.ligolw import ligolw, table, lsctables, utils as ligolw_utils
 from glue.segments import segment, segmentlist
@@ -38,6 +38,217 @@ def start_end_from_segments(segment_file):
     return start + start_ns * 1e-9, end + end_ns * 1e-9
 
 
+def coalesce_start_end(start, end):
+    """ Merge overlapping durations into a sorted set of disjoint ones
+
+    Parameters
+    ----------
+    start: numpy.ndarray
+        Array of the start of each duration
+    end: numpy.ndarray
+        Array of the end of each duration
+
+    Returns
+    --------
+    start: numpy.ndarray
+        Array of the start of each disjoint duration, in order
+    end: numpy.ndarray
+        Array of the end of each disjoint duration
+    """
+    start = numpy.array(start, dtype=numpy.float64, ndmin=1)
+    end = numpy.array(end, dtype=numpy.float64, ndmin=1)
+    keep = end > start
+    start, end = start[keep], end[keep]
+    if len(start) == 0:
+        return start, end
+
+    sort = start.argsort()
+    start, end = start[sort], end[sort]
+
+    # A duration begins a new disjoint one if it starts after every
+    # earlier duration has ended
+    first = numpy.ones(len(start), dtype=numpy.bool)
+    first[1:] = start[1:] > numpy.maximum.accumulate(end)[:-1]
+    first = numpy.flatnonzero(first)
+    return start[first], numpy.maximum.reduceat(end, first)
+
+class SegmentIndex(object):
+    """ A sorted set of disjoint segments held as arrays of their start and
+    end times.
+
+    Membership of any number of times is found by binary search, and set
+    operations on two indices take a single pass over both. Neither builds
+    a glue segmentlist. Segments are half open, so each contains its start
+    time but not its end time.
+
+    Parameters
+    ----------
+    start: numpy.ndarray
+        Array of the start of each segment, which may overlap and be in any
+        order
+    end: numpy.ndarray
+        Array of the end of each segment
+    """
+    def __init__(self, start=(), end=()):
+        self.start, self.end = coalesce_start_end(start, end)
+
+    def __len__(self):
+        return len(self.start)
+
+    def __abs__(self):
+        return (self.end - self.start).sum()
+
+    def contains(self, times):
+        """ Return whether each time lies within a segment
+
+        Parameters
+        ----------
+        times: numpy.ndarray
+            Array of times
+
+        Returns
+        -------
+        inside: numpy.ndarray
+            Boolean array of whether each time is within a segment
+        """
+        times = numpy.array(times, ndmin=1, copy=False)
+        if len(self) == 0:
+            return numpy.zeros(len(times), dtype=bool)
+        # The last segment starting at or before each time
+        i = numpy.searchsorted(self.start, times, side='right') - 1
+        return (i >= 0) & (times < self.end[numpy.maximum(i, 0)])
+
+    def indices_within(self, times):
+        """ Return the indices of the times that lie within a segment, in
+        order
+        """
+        return numpy.flatnonzero(self.contains(times))
+
+    def indices_outside(self, times):
+        """ Return the indices of the times that lie outside every segment,
+        in order
+        """
+        return numpy.flatnonzero(~self.contains(times))
+
+    def _combine(self, other, op):
+        # Sweep over the ends of both sets of segments in time order, noting
+        # whether each point is inside either set, and keep the stretches
+        # where op of the two is True. The segments of each set are sorted,
+        # so the stable sort merges two sorted runs.
+        times = numpy.concatenate([self.start, self.end,
+                                   other.start, other.end])
+        num, onum = len(self), len(other)
+        step1 = numpy.zeros(len(times), dtype=numpy.int8)
+        step2 = numpy.zeros(len(times), dtype=numpy.int8)
+        step1[:num], step1[num:2 * num] = 1, -1
+        step2[2 * num:2 * num + onum], step2[2 * num + onum:] = 1, -1
+
+        order = times.argsort(kind='mergesort')
+        times = times[order]
+        inside = op(step1[order].cumsum() > 0, step2[order].cumsum() > 0)
+
+        # Only the state after the last step at each time matters
+        last = numpy.ones(len(times), dtype=bool)
+        last[:-1] = times[1:] != times[:-1]
+        times, inside = times[last], inside[last]
+        change = numpy.diff(numpy.concatenate([[False], inside]).astype(int))
+        result = SegmentIndex()
+        result.start, result.end = times[change == 1], times[change == -1]
+        return result
+
+    def __and__(self, other):
+        return self._combine(other, numpy.logical_and)
+
+    def __or__(self, other):
+        return self._combine(other, numpy.logical_or)
+
+    def __sub__(self, other):
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def to_segmentlist(self):
+        """ Return the segments as a coalesced glue segmentlist
+        """
+        return start_end_to_segments(self.start, self.end)
+
+    @classmethod
+    def from_segment_file(cls, segment_file, segment_name=None, ifo=None,
+                          cache_dir=None):
+        """ Return the segments of a segment xml file that match the segment
+        name and ifo. See start_end_by_definer for the arguments.
+        """
+        return cls(*start_end_by_definer(segment_file, segment_name, ifo,
+                                          cache_dir=cache_dir))
+
+# Increment when the stored format of the segment cache files changes
+_SEGMENT_CACHE_VERSION = 1
+
+def start_end_by_definer(segment_file, segment_name=None, ifo=None,
+                         cache_dir=None):
+    """ Return the start and end times of the segments of a segment xml file
+    that match the segment name and ifo.
+
+    Parsing the xml is slow, so if a cache directory is given, either as
+    `cache_dir` or by the PYCBC_SEGMENT_CACHE_DIR environment variable, the
+    times found are stored there in a binary file, keyed by a hash of the
+    contents of the segment file, the segment name and the ifo. Later calls
+    by this or any other job read that file instead. The file is written
+    atomically, and a directory that cannot be written to only means the
+    times are not cached.
+
+    Parameters
+    ----------
+    segment_file: str
+        path to segment xml file
+    segment_name: str, optional
+        Name of segment
+    ifo: str, optional
+    cache_dir: str, optional
+        The directory of the cached segment times. By default the value of
+        the PYCBC_SEGMENT_CACHE_DIR environment variable, and if that is not
+        set the times are not cached.
+
+    Returns
+    -------
+    start: numpy.ndarray
+        Array of the start time of each matching segment, in file order
+    end: numpy.ndarray
+        Array of the end time of each matching segment
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('PYCBC_SEGMENT_CACHE_DIR', None)
+    if not cache_dir:
+        return _parse_start_end_by_definer(segment_file, segment_name, ifo)
+
+    with open(segment_file, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    key = hashlib.sha1(repr([_SEGMENT_CACHE_VERSION, digest, segment_name,
+                             ifo])).hexdigest()
+    path = os.path.join(cache_dir, '%s.%s.npy' %
+                        (os.path.basename(segment_file), key))
+
+    try:
+        start, end = numpy.load(path)
+        return start, end
+    except (IOError, ValueError):
+        pass
+
+    start, end = _parse_start_end_by_definer(segment_file, segment_name, ifo)
+    try:
+        # Write to a temporary file and rename it into place, so readers
+        # never see a partially written file. mkstemp makes the file
+        # readable only by its owner, so give it the usual permissions of
+        # a new file to let other users share the cache.
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            numpy.save(f, numpy.array([start, end], dtype=numpy.float64))
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+    return start, end
+
 def indices_within_times(times, start, end):
     """
     Return an index array into times that lie within the durations defined by start end arrays
@@ -56,18 +267,7 @@ def indices_within_times(times, start, end):
     indices: numpy.ndarray
         Array of indices into times
     """
-    # coalesce the start/end segments
-    start, end = segments_to_start_end(start_end_to_segments(start, end).coalesce())
-
-    tsort = times.argsort()
-    times_sorted = times[tsort]
-    left = numpy.searchsorted(times_sorted, start)
-    right = numpy.searchsorted(times_sorted, end)
-
-    if len(left) == 0:
-        return numpy.array([], dtype=numpy.uint32)
-
-    return tsort[numpy.hstack(numpy.r_[s:e] for s, e in zip(left, right))]
+    return SegmentIndex(start, end).indices_within(times)
 
 def indices_outside_times(times, start, end):
     """
@@ -87,26 +287,9 @@ def indices_outside_times(times, start, end):
     indices: numpy.ndarray
         Array of indices into times
     """
-    exclude = indices_within_times(times, start, end)
-    indices = numpy.arange(0, len(times))
-    return numpy.delete(indices, exclude)
+    return SegmentIndex(start, end).indices_outside(times)
 
-def select_segments_by_definer(segment_file, segment_name=None, ifo=None):
-    """ Return the list of segments that match the segment name
-    
-    Parameters
-    ----------
-    segment_file: str
-        path to segment xml file
-    
-    segment_name: str
-        Name of segment
-    ifo: str, optional
-    
-    Returns
-    -------
-    seg: list of segments
-    """
+def _parse_start_end_by_definer(segment_file, segment_name, ifo):
     from glue.ligolw.ligolw import LIGOLWContentHandler as h; lsctables.use_in(h)
     indoc = ligolw_utils.load_filename(segment_file, False, contenthandler=h)
     segment_table  = table.get_table(indoc, 'segment')
@@ -131,12 +314,54 @@ def select_segments_by_definer(segment_file, segment_name=None, ifo=None):
     start, end = start + 1e-9 * start_ns, end + 1e-9 * end_ns
     did = segment_table.getColumnByName('segment_def_id')
     
-    keep = numpy.array([d in valid_id for d in did])
-    if sum(keep) > 0:
-        return start_end_to_segments(start[keep], end[keep])
+    keep = numpy.array([d in valid_id for d in did], dtype=bool)
+    return start[keep], end[keep]
+
+def select_segments_by_definer(segment_file, segment_name=None, ifo=None):
+    """ Return the list of segments that match the segment name
+    
+    Parameters
+    ----------
+    segment_file: str
+        path to segment xml file
+    
+    segment_name: str
+        Name of segment
+    ifo: str, optional
+    
+    Returns
+    -------
+    seg: list of segments
+    """
+    start, end = start_end_by_definer(segment_file, segment_name, ifo)
+    if len(start) > 0:
+        return start_end_to_segments(start, end)
     else:
         return segmentlist([])
 
+def segment_index_by_definer(segment_files, ifo=None, segment_name=None):
+    """ Return the union of the segments of several segment files that match
+    the segment name and ifo
+
+    Parameters
+    ----------
+    segment_files: list of strings
+        The paths to xml files that contain a segment table
+    ifo: string, optional
+        The ifo to retrieve segments for from the segment files
+    segment_name: str, optional
+        name of segment
+
+    Returns
+    -------
+    index: SegmentIndex
+    """
+    times = [start_end_by_definer(f, segment_name, ifo)
+             for f in segment_files]
+    start = numpy.concatenate([[]] + [s for s, e in times])
+    end = numpy.concatenate([[]] + [e for s, e in times])
+    return SegmentIndex(start, end)
+
 def indices_within_segments(times, segment_files, ifo=None, segment_name=None):
     """ Return the list of indices that should be vetoed by the segments in the
     list of veto_files.
@@ -159,18 +384,9 @@ def indices_within_segments(times, segment_files, ifo=None, segment_name=None):
     segmentlist: 
         The segment list corresponding to the selected time.
     """
-    veto_segs = segmentlist([])
-    indices = numpy.array([], dtype=numpy.uint32)   
-    for veto_file in segment_files:
-        veto_segs += select_segments_by_definer(veto_file, segment_name, ifo)
-    veto_segs.coalesce()  
-    
-    start, end = segments_to_start_end(veto_segs)
-    if len(start) > 0:
-        idx = indices_within_times(times, start, end)
-        indices = numpy.union1d(indices, idx)
-
-    return indices, veto_segs.coalesce()
+    index = segment_index_by_definer(segment_files, ifo=ifo,
+                                     segment_name=segment_name)
+    return index.indices_within(times), index.to_segmentlist()
  
 def indices_outside_segments(times, segment_files, ifo=None, segment_name=None):
     """ Return the list of indices that are outside the segments in the
@@ -194,10 +410,9 @@ def indices_outside_segments(times, segment_files, ifo=None, segment_name=None):
     segmentlist: 
         The segment list corresponding to the selected time.
     """
-    exclude, segs = indices_within_segments(times, segment_files,
-                                         ifo=ifo, segment_name=segment_name)
-    indices = numpy.arange(0, len(times))
-    return numpy.delete(indices, exclude), segs
+    index = segment_index_by_definer(segment_files, ifo=ifo,
+                                     segment_name=segment_name)
+    return index.indices_outside(times), index.to_segmentlist()
 
 def get_segment_definer_comments(xml_file, include_version=True):
     """Returns a dict with the comment column as the value for each segment"""
@@ -2,6 +2,14 @@ from pycbc.types import zeros, complex64, complex128
 import numpy as _np
 import ctypes
 import functools
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import platform
+import tempfile
+import threading
 import pycbc.scheme as _scheme
 from pycbc.libutils import get_ctypes_library
 from .core import _BaseFFT, _BaseIFFT
@@ -230,6 +238,181 @@ def export_double_wisdom_to_filename(filename):
     if retval == 0:
         raise RuntimeError("Could not export wisdom to file {0}".format(filename))
 
+# A cache of wisdom shared by all jobs running on the same kind of host
+
+# Every plan made by this process, described by (size, nbatch, input dtype,
+# output dtype, direction, measure level, aligned, number of threads)
+_planned = set()
+
+def _record_plan(size, nbatch, idtype, odtype, direction, mlvl, aligned,
+                 nthreads):
+    _planned.add((int(size), int(nbatch), str(_np.dtype(idtype)),
+                  str(_np.dtype(odtype)), int(direction), int(mlvl),
+                  bool(aligned), int(nthreads)))
+
+def _library_version(lib, name):
+    try:
+        return ctypes.cast(getattr(lib, name), ctypes.c_char_p).value
+    except (AttributeError, ValueError):
+        return None
+
+def cpu_model():
+    """ Return a description of the processor of this host.
+    """
+    try:
+        with open('/proc/cpuinfo', 'r') as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except IOError:
+        pass
+    return platform.processor() or platform.machine()
+
+class WisdomCache(object):
+    """ A directory of FFTW wisdom shared between jobs.
+
+    Wisdom is only valid for the processor and FFTW library it was made
+    with, and for the number of threads used, so it is kept in a
+    subdirectory for each combination of these. The wisdom of a
+    subdirectory is imported by `load`, and `save` merges the wisdom of
+    this process into it under a file lock, along with an index of the
+    transform sizes that have been planned.
+
+    Parameters
+    ----------
+    directory : string
+        The top level directory of the cache. It is created if needed.
+    nthreads : int
+        The number of threads FFTW plans are made for.
+    """
+    # Increment when the layout of the cache changes
+    version = 1
+
+    def __init__(self, directory, nthreads):
+        self.nthreads = int(nthreads)
+        self.host = {'version': self.version,
+                     'cpu': cpu_model(),
+                     'float_version': _library_version(float_lib, 'fftwf_version'),
+                     'double_version': _library_version(double_lib, 'fftw_version'),
+                     'threads_backend': _fftw_threaded_lib,
+                     'nthreads': self.nthreads}
+        key = hashlib.sha1(json.dumps(self.host, sort_keys=True)).hexdigest()
+        self.directory = os.path.join(directory, key[0:16])
+        self.loaded = set()
+
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            if not os.path.isdir(self.directory):
+                raise
+
+        host_file = os.path.join(self.directory, 'host.json')
+        if not os.path.exists(host_file):
+            self._write_atomic(host_file, json.dumps(self.host, indent=1))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _lock(self, mode):
+        lock = open(self._path('lock'), 'a')
+        fcntl.flock(lock, mode)
+        return lock
+
+    def _write_atomic(self, filename, contents):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmpfile:
+            tmpfile.write(contents)
+        os.rename(tmp, filename)
+
+    def _read_index(self):
+        try:
+            with open(self._path('index.json'), 'r') as index:
+                return set(tuple(p) for p in json.load(index))
+        except (IOError, ValueError):
+            return set()
+
+    def _import(self):
+        for name, import_func in [('float.wisdom', import_single_wisdom_from_filename),
+                                  ('double.wisdom', import_double_wisdom_from_filename)]:
+            if os.path.exists(self._path(name)):
+                try:
+                    import_func(self._path(name))
+                except RuntimeError:
+                    logging.warning("Could not import FFTW wisdom from %s",
+                                    self._path(name))
+
+    def load(self):
+        """ Import the cached wisdom for this host.
+        """
+        lock = self._lock(fcntl.LOCK_SH)
+        try:
+            self._import()
+            self.loaded = self._read_index()
+        finally:
+            lock.close()
+        logging.info("Loaded FFTW wisdom for %s transforms from %s",
+                     len(self.loaded), self.directory)
+
+    def save(self):
+        """ Merge the wisdom of this process into the cache.
+
+        Returns
+        -------
+        num : int
+            The number of transforms added to the cache.
+        """
+        # Plans made with FFTW_ESTIMATE do not create wisdom
+        new = set(p for p in _planned if p[5] > 0 and p[7] == self.nthreads)
+        new -= self.loaded
+        if not new:
+            return 0
+
+        lock = self._lock(fcntl.LOCK_EX)
+        try:
+            # Pick up anything saved by other jobs since this one started
+            self._import()
+            index = self._read_index()
+            new -= index
+            for name, export_func in [('float.wisdom', export_single_wisdom_to_filename),
+                                      ('double.wisdom', export_double_wisdom_to_filename)]:
+                fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                os.close(fd)
+                export_func(tmp)
+                os.rename(tmp, self._path(name))
+            self._write_atomic(self._path('index.json'),
+                               json.dumps(sorted(index | new | self.loaded)))
+        finally:
+            lock.close()
+        self.loaded |= new
+        logging.info("Saved FFTW wisdom for %s new transforms to %s",
+                     len(new), self.directory)
+        return len(new)
+
+_wisdom_cache = None
+
+def use_wisdom_cache(directory):
+    """ Load the wisdom cached in directory for this host, and merge any new
+    wisdom back into it when the program exits.
+
+    Parameters
+    ----------
+    directory : string
+        The top level directory of the wisdom cache.
+
+    Returns
+    -------
+    cache : WisdomCache
+        The cache of this host.
+    """
+    global _wisdom_cache
+    import atexit
+    if not _fftw_threaded_set:
+        set_threads_backend()
+    _wisdom_cache = WisdomCache(directory, _scheme.mgr.state.num_threads)
+    _wisdom_cache.load()
+    atexit.register(_wisdom_cache.save)
+    return _wisdom_cache
+
 # Create function maps for the dtypes
 plan_function = {'float32': {'complex64': float_lib.fftwf_plan_dft_r2c_1d},
                  'float64': {'complex128': double_lib.fftw_plan_dft_r2c_1d},
@@ -247,8 +430,17 @@ execute_function = {'float32': {'complex64': float_lib.fftwf_execute_dft_r2c},
                                    'complex128': double_lib.fftw_execute_dft}
                    }
 
+# The FFTW planner may only be used by one thread at a time, while plans may
+# be executed by many
+_planner_lock = threading.Lock()
+
 @memoize
 def plan(size, idtype, odtype, direction, mlvl, aligned, nthreads, inplace):
+    with _planner_lock:
+        return _plan(size, idtype, odtype, direction, mlvl, aligned, nthreads,
+                     inplace)
+
+def _plan(size, idtype, odtype, direction, mlvl, aligned, nthreads, inplace):
     if not _fftw_threaded_set:
         set_threads_backend()
     if nthreads != _fftw_current_nthreads:
@@ -306,6 +498,7 @@ def plan(size, idtype, odtype, direction, mlvl, aligned, nthreads, inplace):
 
     # We don't need ip or op anymore
     del ip, op
+    _record_plan(size, 1, idtype, odtype, direction, mlvl, aligned, nthreads)
 
     # And done...
     return theplan
@@ -391,6 +584,10 @@ _plan_funcs_dict = { ('complex64', 'complex64') : plan_many_c2c_f,
 # classes.
 
 def _fftw_setup(fftobj):
+    with _planner_lock:
+        return _fftw_setup_plan(fftobj)
+
+def _fftw_setup_plan(fftobj):
         n = _np.asarray([fftobj.size], dtype=_np.int32)
         inembed = _np.asarray([len(fftobj.invec)], dtype=_np.int32)
         onembed = _np.asarray([len(fftobj.outvec)], dtype=_np.int32)
@@ -425,6 +622,10 @@ def _fftw_setup(fftobj):
                              flags)
         del tmpin
         del tmpout
+        _record_plan(fftobj.size, fftobj.nbatch, fftobj.invec.dtype,
+                     fftobj.outvec.dtype,
+                     FFTW_FORWARD if fftobj.forward else FFTW_BACKWARD,
+                     mlvl, aligned, nthreads)
         return plan
 
 class FFT(_BaseFFT):
@@ -482,6 +683,12 @@ def insert_fft_options(optgroup):
     optgroup.add_argument("--fftw-import-system-wisdom",
                           help = "If given, call fftw[f]_import_system_wisdom()",
                           action = "store_true")
+    optgroup.add_argument("--fftw-wisdom-cache-dir",
+                      help="Directory of FFTW wisdom shared between jobs. "
+                           "The wisdom for this host and number of threads "
+                           "is read at startup, and any new wisdom is "
+                           "merged back into it at exit.",
+                      default=None)
 
 def verify_fft_options(opt,parser):
     """Parses the FFT options and verifies that they are
@@ -523,5 +730,8 @@ def from_cli(opt):
     if opt.fftw_input_double_wisdom_file is not None:
         import_double_wisdom_from_filename(opt.fftw_input_double_wisdom_file)        
 
+    if opt.fftw_wisdom_cache_dir is not None:
+        use_wisdom_cache(opt.fftw_wisdom_cache_dir)
+
     # Set the user-provided measure level
     set_measure_level(opt.fftw_measure_level)
@@ -244,7 +244,7 @@ def fft_transpose_fftw(vec):
     """
     global _thetransposeplan
     outvec = pycbc.types.zeros(len(vec), dtype=vec.dtype)
-    if _theplan is None:
+    if _thetransposeplan is None:
         N1, N2 = splay(vec)
         _thetransposeplan = plan_transpose(N1, N2)
     ftexecute(_thetransposeplan, vec.ptr, outvec.ptr)
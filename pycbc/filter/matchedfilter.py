@@ -46,18 +46,109 @@ def correlate(x, y, z):
 def _correlate_factory(x, y, z):
     return
 
+def get_cache_size(level=2):
+    """ Return the size in bytes of the given level of cpu cache.
+
+    The value is taken from pycbc.opt when it could be determined, and
+    otherwise a conservative default is assumed.
+
+    Parameters
+    ----------
+    level : {2, 3}
+        The cache level.
+
+    Returns
+    -------
+    cache_size : int
+        The size of the cache in bytes.
+    """
+    import pycbc.opt
+    defaults = {2: 256 * 1024, 3: 8 * 1024 * 1024}
+    cache_size = getattr(pycbc.opt, 'LEVEL%s_CACHE_SIZE' % level, 0)
+    if not cache_size or cache_size <= 0:
+        cache_size = defaults[level]
+    return int(cache_size)
+
+def get_batch_correlate_block_size(num_vectors, itemsize, cache_size=None):
+    """ Return the number of frequency samples correlated per cache block
+    by the BatchCorrelator.
+
+    The block of data, together with the matching blocks of every template
+    and output vector, is chosen to fit within half of the level 2 cache.
+
+    Parameters
+    ----------
+    num_vectors : int
+        The number of templates in the batch.
+    itemsize : int
+        The size in bytes of a single sample.
+    cache_size : {None, int}
+        The cache size to block for in bytes. If None, use the level 2 cache.
+
+    Returns
+    -------
+    block_size : int
+        The number of samples in each block, a multiple of 64.
+    """
+    if cache_size is None:
+        cache_size = get_cache_size(2)
+    per_sample = (2 * num_vectors + 1) * itemsize
+    block_size = (cache_size / 2) / per_sample
+    return int(max(64, block_size - block_size % 64))
+
+def get_template_batch_size(kmin, kmax, itemsize, cache_size=None,
+                            max_batch_size=64):
+    """ Return the number of templates to filter together as one batch.
+
+    The templates of a batch are held resident while every segment is
+    filtered against them, so the batch is chosen such that the band
+    [kmin, kmax) of each template, plus that of a single segment, fits
+    within the last level cache.
+
+    Parameters
+    ----------
+    kmin : int
+        The first frequency index that is correlated.
+    kmax : int
+        One past the last frequency index that is correlated.
+    itemsize : int
+        The size in bytes of a single sample.
+    cache_size : {None, int}
+        The cache size to block for in bytes. If None, use the level 3 cache.
+    max_batch_size : {64, int}
+        The largest batch size to return.
+
+    Returns
+    -------
+    batch_size : int
+        The number of templates in each batch, at least one.
+    """
+    if cache_size is None:
+        cache_size = get_cache_size(3)
+    band = (kmax - kmin) * itemsize
+    batch_size = int(cache_size / band) - 1
+    return int(min(max(batch_size, 1), max_batch_size))
+
 class BatchCorrelator(object):
     """ Create a batch correlation engine 
     """
-    def __init__(self, xs, zs, size):
+    def __init__(self, xs, zs, size, block_size=None):
         """ Correlate x and y, store in z. Arrays need not be equal length, but
         must be at least size long and of the same dtype. No error checking
         will be performed, so be careful. All dtypes must be the same.
         Note, must be created within the processing context that it will be used in.
+
+        The frequency axis is processed in blocks of block_size samples, so
+        that each block of y is reused from cache by every x. If block_size
+        is None it is chosen from the level 2 cache size.
         """
         self.size = int(size)
         self.dtype = xs[0].dtype
         self.num_vectors = len(xs)
+        if block_size is None:
+            block_size = get_batch_correlate_block_size(self.num_vectors,
+                                                        xs[0].itemsize)
+        self.block_size = int(block_size)
 
         # Store each pointer as in integer array
         self.x = Array([v.ptr for v in xs], dtype=numpy.int)
@@ -115,7 +206,8 @@ class MatchedFilterControl(object):
     def __init__(self, low_frequency_cutoff, high_frequency_cutoff, snr_threshold, tlen,
                  delta_f, dtype, segment_list, template_output, use_cluster,
                  downsample_factor=1, upsample_threshold=1, upsample_method='pruned_fft',
-                 gpu_callback_method='none', cluster_function='symmetric'):
+                 gpu_callback_method='none', cluster_function='symmetric',
+                 batch_size=1, max_snr_loss=None):
         """ Create a matched filter engine.
 
         Parameters
@@ -142,11 +234,24 @@ class MatchedFilterControl(object):
             The fraction of the snr_threshold to trigger on the subsampled filter.
         upsample_method : {pruned_fft, str}
             The method to upsample or interpolate the reduced rate filter.
+        max_snr_loss : {None, float}, optional
+            When doing a heirarchical matched filter, the largest fraction of
+            a template's optimal snr that the reduced rate filter may lose.
+            The reduced rate threshold of each template is lowered so that a
+            signal at the snr threshold is not missed, and templates which
+            would lose more than this fraction are filtered at the full
+            sample rate instead. If None, the upsample_threshold is used as
+            given.
         cluster_function : {symmetric, str}, optional
             Which method is used to cluster triggers over time. If 'findchirp', a
             sliding forward window; if 'symmetric', each window's peak is compared
             to the windows before and after it, and only kept as a trigger if larger
             than both.
+        batch_size : {1, int}, optional
+            If greater than one, also allocate memory for filtering this many
+            templates at once against a single segment with
+            `batched_matched_filter_and_cluster`. Templates for the batch are
+            generated into the memory given by `batch_template_mem`.
         """
         # Assuming analysis time is constant across templates and segments, also
         # delta_f is constant across segments.
@@ -163,6 +268,8 @@ class MatchedFilterControl(object):
         self.cluster_function = cluster_function
         self.segments = segment_list
         self.htilde = template_output
+        self.use_cluster = use_cluster
+        self.batch_size = batch_size
 
         if downsample_factor == 1:
             self.snr_mem = zeros(self.tlen, dtype=self.dtype)
@@ -197,6 +304,9 @@ class MatchedFilterControl(object):
             # setup up the ifft we will do
             self.ifft = IFFT(self.corr_mem, self.snr_mem)
 
+            if batch_size > 1:
+                self._setup_batch(batch_size)
+
         elif downsample_factor >= 1:
             self.matched_filter_and_cluster = self.heirarchical_matched_filter_and_cluster
             self.downsample_factor = downsample_factor
@@ -220,10 +330,122 @@ class MatchedFilterControl(object):
             self.corr_mem_full = FrequencySeries(zeros(N_full, dtype=self.dtype), delta_f=self.delta_f)
             self.corr_mem = Array(self.corr_mem_full[0:N_red], copy=False)
             self.inter_vec = zeros(N_full, dtype=self.dtype)
+            self.htilde_transposed = zeros(N_full, dtype=self.dtype)
+
+            # Worst case snr fraction of the last template, and the memory
+            # used to filter templates at the full rate if it is too low
+            self.max_snr_loss = max_snr_loss
+            self._snr_fraction_key = None
+            self.snr_mem_full = None
+            self.num_full_rate = 0
 
         else:
             raise ValueError("Invalid downsample factor")
 
+    def _setup_batch(self, batch_size):
+        """ Allocate the template, correlation and snr memory used to filter
+        batch_size templates with a single batched correlation and IFFT.
+        """
+        flen = self.flen
+        tlen = self.tlen
+        corr_slice = slice(self.kmin, self.kmax)
+
+        self.batch_template_mem = zeros(batch_size * flen, dtype=self.dtype)
+        self.batch_corr_mem = zeros(batch_size * tlen, dtype=self.dtype)
+        self.batch_snr_mem = zeros(batch_size * tlen, dtype=self.dtype)
+
+        # Each template occupies one row of the block memory
+        self.batch_htilde = [self.batch_template_mem[i * flen:(i + 1) * flen]
+                             for i in range(batch_size)]
+        self.batch_corr = [self.batch_corr_mem[i * tlen:(i + 1) * tlen]
+                           for i in range(batch_size)]
+        self.batch_snr = [self.batch_snr_mem[i * tlen:(i + 1) * tlen]
+                          for i in range(batch_size)]
+
+        self.batch_correlator = BatchCorrelator(
+                                    [h[corr_slice] for h in self.batch_htilde],
+                                    [c[corr_slice] for c in self.batch_corr],
+                                    self.kmax - self.kmin)
+        self.batch_ifft = IFFT(self.batch_corr_mem, self.batch_snr_mem,
+                               nbatch=batch_size, size=tlen)
+
+        # Threshold and cluster engines are created on demand, as the
+        # analyzed region can differ between segments
+        self.batch_clusterers = {}
+
+    def _batch_threshold_and_cluster(self, row, stilde, threshold, window):
+        """ Threshold and cluster a single row of the batched snr memory
+        using the same method as the unbatched filter.
+        """
+        snr = self.batch_snr[row][stilde.analyze]
+        if self.use_cluster and self.cluster_function == 'symmetric':
+            key = (row, stilde.analyze.start, stilde.analyze.stop)
+            if key not in self.batch_clusterers:
+                self.batch_clusterers[key] = events.ThresholdCluster(snr)
+            return self.batch_clusterers[key].threshold_and_cluster(threshold,
+                                                                    window)
+        elif self.use_cluster:
+            idx, snrv = events.threshold(snr, threshold)
+            if len(idx) == 0:
+                return snrv, idx
+            idx, snrv = events.cluster_reduce(idx, snrv, window)
+            return snrv, idx
+        else:
+            idx, snrv = events.threshold_only(snr, threshold)
+            return snrv, idx
+
+    def batched_matched_filter_and_cluster(self, segnum, template_norms, window):
+        """ Return the complex snr and normalization for a batch of templates.
+
+        The templates held in the first len(template_norms) rows of
+        `batch_htilde` are correlated against a single segment, transformed
+        with one batched IFFT, and then each row is thresholded and clustered.
+
+        Parameters
+        ----------
+        segnum : int
+            Index into the list of segments at MatchedFilterControl construction
+            against which to filter.
+        template_norms : list of floats
+            The htilde, template normalization factor of each template in the
+            batch.
+        window : int or list of ints
+            Size of the window over which to cluster triggers, in samples. If
+            a list, one window for each template in the batch.
+
+        Returns
+        -------
+        results : list
+            For each template in the batch, a tuple of
+            (snr, norm, correlation, idx, snrv) with the same meaning as the
+            return values of `matched_filter_and_cluster`.
+        """
+        if len(template_norms) > self.batch_size:
+            raise ValueError("MatchedFilter: more templates given than the "
+                             "batch size of %s" % self.batch_size)
+
+        stilde = self.segments[segnum]
+        self.batch_correlator.execute(stilde[self.kmin:self.kmax])
+        self.batch_ifft.execute()
+
+        if not isinstance(window, (list, tuple, numpy.ndarray)):
+            window = [window] * len(template_norms)
+
+        results = []
+        for i, (template_norm, win) in enumerate(zip(template_norms, window)):
+            norm = (4.0 * self.delta_f) / sqrt(template_norm)
+            snrv, idx = self._batch_threshold_and_cluster(i, stilde,
+                                            self.snr_threshold / norm, win)
+            if len(idx) == 0:
+                results.append(([], [], [], [], []))
+                continue
+
+            logging.info("%s points above threshold in batch row %s"
+                         % (str(len(idx)), i))
+            results.append((self.batch_snr[i], norm, self.batch_corr[i],
+                            idx, snrv))
+        return results
+
     def full_matched_filter_and_cluster_symm(self, segnum, template_norm, window):
         """ Return the complex snr and normalization.
 
@@ -377,10 +599,31 @@ class MatchedFilterControl(object):
         stilde = self.segments[segnum]
 
         norm = (4.0 * stilde.delta_f) / sqrt(template_norm)
-        
+
+        # Choose the reduced rate threshold from the worst case snr that
+        # the reduced rate filter recovers for this template
+        upsample_threshold = self.upsample_threshold
+        if self.max_snr_loss is not None:
+            psd = getattr(stilde, 'psd', None)
+            key = (id(psd), template_norm)
+            if key != self._snr_fraction_key:
+                self._snr_fraction_key = key
+                self._snr_fraction = hierarchical_snr_fraction(htilde, psd,
+                                        self.kmin_red, self.kmax_red,
+                                        self.kmax_full, self.tlen,
+                                        self.downsample_factor)
+            if 1 - self._snr_fraction > self.max_snr_loss:
+                return self._full_rate_filter_and_cluster(segnum, norm,
+                                                          window)
+            upsample_threshold = min(upsample_threshold, self._snr_fraction)
+
         correlate(htilde[self.kmin_red:self.kmax_red], 
                   stilde[self.kmin_red:self.kmax_red], 
                   self.corr_mem[self.kmin_red:self.kmax_red]) 
+        # The bins above the reduced band may hold the full rate
+        # correlation of the previous template
+        if self.kmax_red < len(self.corr_mem):
+            self.corr_mem[self.kmax_red:].clear()
                      
         ifft(self.corr_mem, self.snr_mem)           
 
@@ -391,7 +634,7 @@ class MatchedFilterControl(object):
 
         
         idx_red, snrv_red = events.threshold(self.snr_mem[stilde.red_analyze], 
-                                self.snr_threshold / norm * self.upsample_threshold)
+                                self.snr_threshold / norm * upsample_threshold)
         if len(idx_red) == 0:
             return [], None, [], [], []
 
@@ -409,18 +652,19 @@ class MatchedFilterControl(object):
             # cache transposed  versions of htilde and stilde
             if not hasattr(self.corr_mem_full, 'transposed'):
                 self.corr_mem_full.transposed = zeros(len(self.corr_mem_full), dtype=self.dtype)
-                
-            if not hasattr(htilde, 'transposed'):
-                htilde.transposed = zeros(len(self.corr_mem_full), dtype=self.dtype)
-                htilde.transposed[self.kmin_full:self.kmax_full] = htilde[self.kmin_full:self.kmax_full]
-                htilde.transposed = fft_transpose(htilde.transposed)
+
+            # The template memory is reused by each template, so its
+            # transpose can not be cached
+            self.htilde_transposed.clear()
+            self.htilde_transposed[self.kmin_full:self.kmax_full] = htilde[self.kmin_full:self.kmax_full]
+            htilde_transposed = fft_transpose(self.htilde_transposed)
                 
             if not hasattr(stilde, 'transposed'):
                 stilde.transposed = zeros(len(self.corr_mem_full), dtype=self.dtype)
                 stilde.transposed[self.kmin_full:self.kmax_full] = stilde[self.kmin_full:self.kmax_full]
                 stilde.transposed = fft_transpose(stilde.transposed)  
                 
-            correlate(htilde.transposed, stilde.transposed, self.corr_mem_full.transposed)      
+            correlate(htilde_transposed, stilde.transposed, self.corr_mem_full.transposed)      
             snrv = pruned_c2cifft(self.corr_mem_full.transposed, self.inter_vec, idx, pretransposed=True)   
             idx = idx - stilde.analyze.start
             idx2, snrv = events.threshold(Array(snrv, copy=False), self.snr_threshold / norm)
@@ -438,6 +682,85 @@ class MatchedFilterControl(object):
         else:
             raise ValueError("Invalid upsample method")            
 
+    def _full_rate_filter_and_cluster(self, segnum, norm, window):
+        """ Filter the current template at the full sample rate, for
+        templates the reduced rate filter would lose too much snr for.
+        """
+        htilde = self.htilde
+        stilde = self.segments[segnum]
+        if self.snr_mem_full is None:
+            self.snr_mem_full = zeros(self.tlen, dtype=self.dtype)
+            self.ifft_full = IFFT(Array(self.corr_mem_full, copy=False),
+                                  self.snr_mem_full)
+        self.num_full_rate += 1
+
+        self.corr_mem_full.clear()
+        correlate(htilde[self.kmin_full:self.kmax_full],
+                  stilde[self.kmin_full:self.kmax_full],
+                  self.corr_mem_full[self.kmin_full:self.kmax_full])
+        self.ifft_full.execute()
+
+        idx, snrv = events.threshold(self.snr_mem_full[stilde.analyze],
+                                     self.snr_threshold / norm)
+        if len(idx) == 0:
+            return [], None, [], [], []
+
+        idx, snrv = events.cluster_reduce(idx, snrv, window)
+        logging.info("%s points above threshold at full rate" % len(idx))
+        return self.snr_mem_full, norm, self.corr_mem_full, idx, snrv
+
+def hierarchical_snr_fraction(htilde, psd, kmin, kmax_red, kmax_full, tlen,
+                              downsample_factor):
+    """ Return the worst case fraction of a template's optimal snr that is
+    recovered by the reduced rate stage of a heirarchical matched filter.
+
+    Two effects are included: the reduced rate filter only uses the
+    frequencies below kmax_red, and it only samples the snr every
+    downsample_factor samples, so that the peak of a signal may be up to
+    half of that away from the nearest sample. The fraction is exact
+    for a signal that matches the template.
+
+    Parameters
+    ----------
+    htilde : FrequencySeries
+        The template.
+    psd : {None, FrequencySeries}
+        The noise power spectral density. If None, white noise is assumed.
+    kmin : int
+        The first frequency index used by the filter.
+    kmax_red : int
+        The last frequency index (exclusive) of the reduced rate filter.
+    kmax_full : int
+        The last frequency index (exclusive) of the full rate filter.
+    tlen : int
+        The length of the full rate snr time series.
+    downsample_factor : int
+        The factor by which the reduced rate filter is decimated.
+
+    Returns
+    -------
+    fraction : float
+        The ratio of the smallest reduced rate snr to the full rate snr
+        of a matching signal.
+    """
+    kmax_red = min(kmax_red, kmax_full)
+    h = numpy.array(htilde[kmin:kmax_full].numpy(), dtype=numpy.complex128)
+    weight = h.real ** 2 + h.imag ** 2
+    if psd is not None:
+        weight /= psd[kmin:kmax_full].numpy()
+
+    total = weight.sum()
+    if total <= 0:
+        return 1.0
+
+    weight = weight[0:kmax_red - kmin]
+    k = numpy.arange(kmin, kmax_red)
+    worst = weight.sum()
+    for j in range(1, downsample_factor / 2 + 1):
+        phase = numpy.exp(2j * numpy.pi * k * j / float(tlen))
+        worst = min(worst, abs((weight * phase).sum()))
+    return worst / total
+
 class MatchedFilterSkyMaxControl(object):
     # FIXME: This seems much more simplistic than the aligned-spin class.
     #        E.g. no correlators. Is this worth updating?
@@ -1489,5 +1812,6 @@ class LiveBatchMatchedFilter(object):
 __all__ = ['match', 'matched_filter', 'sigmasq', 'sigma', 'get_cutoff_indices',
            'sigmasq_series', 'make_frequency_series', 'overlap', 'overlap_cplx',
            'matched_filter_core', 'correlate', 'MatchedFilterControl', 'LiveBatchMatchedFilter',
-           'MatchedFilterSkyMaxControl', 'compute_max_snr_over_sky_loc_stat']
+           'MatchedFilterSkyMaxControl', 'compute_max_snr_over_sky_loc_stat',
+           'get_template_batch_size', 'hierarchical_snr_fraction']
 
@@ -29,19 +29,28 @@ from .simd_correlate import default_segsize, corr_parallel_code, corr_support
 from .matchedfilter import _BaseCorrelator
 
 batch_correlator_code = """
-    #pragma omp parallel for
-    for (int i=0; i<num_vectors; i++){
-        std::complex<float>* xp = (std::complex<float>*) x[i];
-        std::complex<float>* zp = (std::complex<float>*) z[i];
-        for (int j=0; j<size; j++){
-            float xr, yr, xi, yi, re, im;
-            xr = xp[j].real();
-            xi = xp[j].imag();
-            yr = y[j].real();       
-            yi = y[j].imag();
-            re = xr*yr + xi*yi;
-            im = xr*yi - xi*yr;
-            zp[j] = std::complex<float>(re, im);
+    // The frequency axis is split into blocks, and each block of the data
+    // is correlated against every template before moving on, so that it
+    // stays resident in cache while the templates stream past it.
+    int num_blocks = (size + blocksize - 1) / blocksize;
+    #pragma omp parallel for schedule(static)
+    for (int b=0; b<num_blocks; b++){
+        int start = b * blocksize;
+        int end = start + blocksize;
+        if (end > size) end = size;
+        for (int i=0; i<num_vectors; i++){
+            std::complex<float>* xp = (std::complex<float>*) x[i];
+            std::complex<float>* zp = (std::complex<float>*) z[i];
+            for (int j=start; j<end; j++){
+                float xr, yr, xi, yi, re, im;
+                xr = xp[j].real();
+                xi = xp[j].imag();
+                yr = y[j].real();
+                yi = y[j].imag();
+                re = xr*yr + xi*yi;
+                im = xr*yi - xi*yr;
+                zp[j] = std::complex<float>(re, im);
+            }
         }
     }
 """
@@ -49,10 +58,12 @@ batch_correlator_code = """
 def batch_correlate_execute(self, y):
     num_vectors = self.num_vectors
     size = self.size
+    blocksize = self.block_size
     x = numpy.array(self.x.data, copy=False)
     z = numpy.array(self.z.data, copy=False)
     y = numpy.array(y.data, copy=False)        
-    inline(batch_correlator_code, ['x', 'y', 'z', 'size', 'num_vectors'],
+    inline(batch_correlator_code, ['x', 'y', 'z', 'size', 'num_vectors',
+                                   'blocksize'],
                 extra_compile_args=[WEAVE_FLAGS + '-march=native -O3 -w'] + omp_flags,
                 libraries=omp_libs)
 
@@ -6,6 +6,8 @@ import h5py
 import numpy as np
 import logging
 import inspect
+import zlib
+from functools import partial
 
 from lal import LIGOTimeGPS, YRJUL_SI
 
@@ -25,6 +27,36 @@ class HFile(h5py.File):
     """ Low level extensions to the capabilities of reading an hdf5 File
     """
 
+    def _template_rows(self, group, template_ids):
+        """ Return the rows of a group that hold the triggers of the given
+        templates, reading only the rows within the template boundaries
+        where the group has them
+        """
+        template_ids = np.asarray(template_ids)
+        size = len(group['template_id'])
+        columnar = self.attrs.get('layout') == 'columnar'
+        if 'template_boundaries' not in group:
+            rows = np.arange(size)
+        else:
+            boundaries = group['template_boundaries'][:]
+            if columnar:
+                left = boundaries[:-1][template_ids]
+                right = boundaries[1:][template_ids]
+            else:
+                # The region-reference layout only stores where each
+                # template starts, and it ends at the next start in the file
+                starts = np.unique(np.append(boundaries, size))
+                left = boundaries[template_ids]
+                right = starts[np.minimum(np.searchsorted(starts, left,
+                                                          side='right'),
+                                          len(starts) - 1)]
+            rows = [np.arange(l, r) for l, r in zip(left, right)]
+            rows = np.unique(np.concatenate([np.array([], dtype=int)] + rows))
+            if columnar:
+                return rows
+        tids = masked_column(group['template_id'], rows)
+        return rows[np.in1d(tids, template_ids)]
+
     def select(self, fcn, *args, **kwds):
         """ Return arrays from an hdf5 file that satisfy the given function
 
@@ -39,11 +71,37 @@ class HFile(h5py.File):
             refer to arrays of equal length.
 
         chunksize : {1e6, int}, optional
-            Number of elements to read and process at a time.
+            Number of elements to read and process at a time. By default
+            this is rounded to a whole number of the HDF5 chunks of the
+            first array.
 
         return_indices : bool, optional
             If True, also return the indices of elements passing the function.
 
+        return_data : {True, bool}, optional
+            If False, return only the indices of the elements passing the
+            function, without keeping the values of the arrays.
+
+        premask : numpy.ndarray, optional
+            A boolean array, or an array of indices, of the elements to
+            consider. Only the chunks holding these elements are read, and
+            the function is only given these elements.
+
+        start : {0, int}, optional
+            The first element to consider.
+
+        end : {None, int}, optional
+            One past the last element to consider. By default this is the
+            length of the arrays.
+
+        template_ids : numpy.ndarray, optional
+            Only consider elements with one of these template ids. The
+            template boundaries of the group of the first key are used to
+            read only the rows of these templates where the group has them.
+
+        threads : {1, int}, optional
+            Number of threads that read and process chunks at once.
+
         Returns
         -------
         values : np.ndarrays
@@ -59,33 +117,88 @@ class HFile(h5py.File):
         refs = {}
         data = {}
         for arg in args:
-            refs[arg] = self[arg]
-            data[arg] = []
+            refs[arg] = column_array(self[arg])
+            data[arg] = [np.array([], dtype=refs[arg].dtype)]
 
-        return_indices = kwds.get('return_indices', False)
-        indices = np.array([], dtype=np.uint64)
+        return_data = kwds.get('return_data', True)
+        return_indices = kwds.get('return_indices', False) or not return_data
+        indices = [np.array([], dtype=np.int64)]
 
         # To conserve memory read the array in chunks
-        chunksize = kwds.get('chunksize', int(1e6))
+        chunksize = kwds.get('chunksize', None)
+        if chunksize is None:
+            chunksize = int(1e6)
+            chunks = self[args[0]].chunks
+            if chunks is not None:
+                chunksize = max(chunksize // chunks[0], 1) * chunks[0]
         size = len(refs[arg])
-
-        i = 0
-        while i < size:
-            r = i + chunksize if i + chunksize < size else size
-
+        start = kwds.get('start', 0)
+        end = kwds.get('end', None)
+        end = size if end is None else min(end, size)
+
+        # The elements to consider, if only some are
+        select = None
+        premask = kwds.get('premask', None)
+        if premask is not None:
+            premask = np.asarray(premask)
+            if premask.dtype == bool:
+                select = np.flatnonzero(premask)
+            else:
+                select = np.unique(premask)
+        template_ids = kwds.get('template_ids', None)
+        if template_ids is not None:
+            rows = self._template_rows(self[args[0]].parent, template_ids)
+            select = rows if select is None else np.intersect1d(select, rows)
+
+        ranges = []
+        for i in range(start, end, chunksize):
+            r = min(i + chunksize, end)
+            if select is None:
+                ranges.append((i, r, None))
+                continue
+            sel = select[np.searchsorted(select, i):
+                         np.searchsorted(select, r)]
+            # skip the chunks without any of the selected elements
+            if len(sel) > 0:
+                ranges.append((i, r, sel))
+
+        def process(chunk):
+            i, r, sel = chunk
             #Read each chunks worth of data and find where it passes the function
             partial = [refs[arg][i:r] for arg in args]
+            if sel is not None:
+                partial = [part[sel - i] for part in partial]
             keep = fcn(*partial)
-            if return_indices:
-                indices = np.concatenate([indices, np.flatnonzero(keep) + i])
+            if sel is None:
+                idx = np.flatnonzero(keep) + i
+            else:
+                idx = sel[keep]
 
             #store only the results that pass the function
-            for arg, part in zip(args, partial):
-                data[arg].append(part[keep])
+            if return_data:
+                return idx, [part[keep] for part in partial]
+            return idx, None
+
+        threads = kwds.get('threads', 1)
+        if threads > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(threads)
+            results = pool.imap(process, ranges)
+        else:
+            results = (process(chunk) for chunk in ranges)
 
-            i += chunksize
+        for idx, values in results:
+            indices.append(idx)
+            if return_data:
+                for arg, part in zip(args, values):
+                    data[arg].append(part)
+        if threads > 1:
+            pool.close()
 
         # Combine the partial results into full arrays
+        indices = np.concatenate(indices)
+        if not return_data:
+            return indices
         if len(args) == 1:
             res = np.concatenate(data[args[0]])
             if return_indices:
@@ -100,6 +213,120 @@ class HFile(h5py.File):
                 return res
 
 
+def column_array(dset):
+    """ Return a read-only memory map of a dataset where it is stored
+    contiguously and without compression, as in the columnar layout of
+    pycbc_coinc_mergetrigs, and the dataset itself otherwise
+
+    Parameters
+    ----------
+    dset : h5py.Dataset
+        A one dimensional dataset of a trigger file
+
+    Returns
+    -------
+    column : numpy.memmap or h5py.Dataset
+        An array-like view of the dataset. Slices of a memory map read only
+        the part of the file they cover.
+    """
+    if dset.chunks is not None or dset.file.driver != 'sec2' or \
+            dset.dtype.hasobject or dset.size == 0:
+        return dset
+    offset = dset.id.get_offset()
+    if offset is None:
+        return dset
+    return np.memmap(dset.file.filename, mode='r', dtype=dset.dtype,
+                     shape=dset.shape, offset=offset)
+
+
+def _compress_chunk(chunk, level):
+    """ Apply the shuffle and deflate filters of HDF5 to a full chunk """
+    shuffled = chunk.view(np.uint8).reshape(len(chunk), -1).T
+    return zlib.compress(shuffled.tostring(), level)
+
+
+class ColumnWriter(object):
+    """ Write a one dimensional dataset in order, a block of values at a
+    time.
+
+    Where h5py can write chunks directly, gzip compressed chunks are
+    compressed by the given pool rather than serially by HDF5. The dataset
+    is the same as one h5py creates with the same compression and shuffle.
+
+    Parameters
+    ----------
+    f : h5py.File or h5py.Group
+        The file to create the dataset in.
+    key : str
+        The name of the dataset.
+    dtype : numpy.dtype
+        The type of the values.
+    size : int
+        The number of values that will be written.
+    compression : {None, 'gzip', 'lzf'}, optional
+        The compression of the dataset. Uncompressed datasets are stored
+        contiguously, so that they can be read with `column_array`.
+    compression_level : {None, int}, optional
+        The level of gzip compression. By default this is the h5py
+        default.
+    chunk_size : {2**18, int}, optional
+        The number of values in each chunk of a compressed dataset.
+    pool : {None, multiprocessing.pool.ThreadPool}, optional
+        A pool to compress the chunks on. By default they are compressed
+        serially.
+    """
+    def __init__(self, f, key, dtype, size, compression=None,
+                 compression_level=None, chunk_size=2**18, pool=None):
+        self.pos = 0
+        self.tail = np.array([], dtype=dtype)
+        self.chunk_size = min(size, chunk_size)
+        self.map = map if pool is None else pool.map
+        if compression is None or size == 0:
+            self.dset = f.create_dataset(key, shape=(size,), dtype=dtype)
+            self.direct = False
+            return
+
+        if compression != 'gzip':
+            compression_level = None
+        self.dset = f.create_dataset(key, shape=(size,), dtype=dtype,
+                                     chunks=(self.chunk_size,),
+                                     compression=compression,
+                                     compression_opts=compression_level,
+                                     shuffle=True)
+        self.direct = compression == 'gzip' and \
+                      hasattr(self.dset.id, 'write_direct_chunk')
+        if self.direct:
+            self.compress = partial(_compress_chunk,
+                                    level=self.dset.compression_opts)
+
+    def _write_chunks(self, data):
+        chunks = [data[i:i + self.chunk_size]
+                  for i in range(0, len(data), self.chunk_size)]
+        for chunk in self.map(self.compress, chunks):
+            self.dset.id.write_direct_chunk((self.pos,), chunk)
+            self.pos += self.chunk_size
+
+    def append(self, data):
+        """ Write the given values after those written so far """
+        if not self.direct:
+            self.dset[self.pos:self.pos + len(data)] = data
+            self.pos += len(data)
+            return
+        data = np.concatenate([self.tail, data])
+        num = len(data) - len(data) % self.chunk_size
+        self._write_chunks(data[:num])
+        self.tail = data[num:]
+
+    def close(self):
+        """ Write any values held back to fill the last chunk """
+        # HDF5 stores the last chunk at full size
+        if self.direct and len(self.tail) > 0:
+            chunk = np.zeros(self.chunk_size, dtype=self.tail.dtype)
+            chunk[:len(self.tail)] = self.tail
+            self._write_chunks(chunk)
+            self.tail = self.tail[:0]
+
+
 class DictArray(object):
     """ Utility for organizing sets of arrays of equal length. 
     
@@ -287,7 +514,7 @@ class FileData(object):
         # catch corner case with an empty file (group with no datasets)
         if not len(self.group.keys()):
             return np.array([])
-        vals = self.group[col]
+        vals = column_array(self.group[col])
         if self.filter_func:
             return vals[self.mask]
         else:
@@ -329,9 +556,76 @@ class DataFromFiles(object):
         logging.info('- got %i values' % sum(len(v) for v in vals))
         return np.concatenate(vals)
 
+def masked_column(dset, mask, chunk_size=2**20):
+    """ Read the values of a one dimensional dataset that are selected by a
+    mask, a chunk of the dataset at a time
+
+    Parameters
+    ----------
+    dset : h5py.Dataset or numpy.ndarray
+        The column to read from
+    mask : numpy.ndarray or int
+        Either a boolean array of the length of the dataset, an array of
+        indices into it in any order, or a single index
+    chunk_size : {2**20, int}, optional
+        The number of values of the dataset to read at a time. Chunks that
+        contain no selected values are not read.
+
+    Returns
+    -------
+    values : numpy.ndarray
+        The selected values, in the order of the mask. A single index gives
+        a single value.
+    """
+    if isinstance(dset, h5py.Dataset):
+        dset = column_array(dset)
+    if not isinstance(dset, h5py.Dataset):
+        return dset[mask]
+
+    mask = np.asarray(mask)
+    if mask.ndim == 0:
+        return dset[int(mask)]
+    if mask.dtype == bool:
+        values = [np.array([], dtype=dset.dtype)]
+        for i in range(0, len(mask), chunk_size):
+            part = mask[i:i + chunk_size]
+            if part.any():
+                values.append(dset[i:i + chunk_size][part])
+        return np.concatenate(values)
+
+    order = mask.argsort(kind='mergesort')
+    idx = mask[order]
+    values = np.empty(len(idx), dtype=dset.dtype)
+    i = 0
+    while i < len(idx):
+        start = idx[i]
+        j = np.searchsorted(idx, start + chunk_size)
+        values[order[i:j]] = dset[start:start + chunk_size][idx[i:j] - start]
+        i = j
+    return values
+
+
+def _cached_column(func):
+    """ Make a property of SingleDetTriggers whose value is kept until the
+    mask changes
+    """
+    name = func.__name__
+    def getter(self):
+        if name not in self._cache:
+            self._cache[name] = func(self)
+        return self._cache[name]
+    getter.__doc__ = func.__doc__
+    return property(getter)
+
+
 class SingleDetTriggers(object):
     """
     Provides easy access to the parameters of single-detector CBC triggers.
+
+    Columns are read only when first used, and only the values selected by
+    the mask are read. Columns and the values derived from them are cached
+    until the mask is set again or clear_cache is called, so the arrays
+    returned should not be modified in place.
     """
     # FIXME: Some of these are optional and should be kwargs.
     def __init__(self, trig_file, bank_file, veto_file, segment_name, filter_func, detector):
@@ -346,20 +640,32 @@ class SingleDetTriggers(object):
             # empty dict in place of non-existent hdf file
             self.bank = {}
 
-        if veto_file:
+        self.veto_file = veto_file
+        self.segment_name = segment_name
+        self.filter_func = filter_func
+        self.detector = detector
+        self._mask = None
+        self._cache = {}
+        self._bank_columns = {}
+
+    def _build_mask(self):
+        """ Apply the vetoes and the filter function to find the mask
+        """
+        if self.veto_file:
             logging.info('Applying veto segments')
+            end_time = self.trigs['end_time'][:]
             # veto_mask is an array of indices into the trigger arrays
             # giving the surviving triggers 
-            logging.info('%i triggers before vetoes',
-                          len(self.trigs['end_time'][:]))
+            logging.info('%i triggers before vetoes', len(end_time))
             self.veto_mask, segs = events.veto.indices_outside_segments(
-                self.trigs['end_time'][:], [veto_file],
-                ifo=detector, segment_name=segment_name)
+                end_time, [self.veto_file],
+                ifo=self.detector, segment_name=self.segment_name)
             logging.info('%i triggers remain after vetoes',
                           len(self.veto_mask))
         else:
             self.veto_mask = np.arange(len(self.trigs['end_time']))
 
+        filter_func = self.filter_func
         if filter_func:
             # get required columns into the namespace with dummy attribute
             # names to avoid confusion with other class properties
@@ -369,19 +675,53 @@ class SingleDetTriggers(object):
             for c in self.bank.keys():
                 if c in filter_func:
                     # get template parameters corresponding to triggers
-                    setattr(self, '_'+c,
-                          np.array(self.bank[c])[self.trigs['template_id'][:]])
+                    setattr(self, '_'+c, self._bank_column(c)[
+                            self.trigs['template_id'][:]])
             self.filter_mask = eval(filter_func.replace('self.', 'self._'))
             # remove the dummy attributes
             for c in self.trigs.keys() + self.bank.keys():
                 if c in filter_func: delattr(self, '_'+c)
             self.boolean_veto = np.in1d(np.arange(len(self.trigs['end_time'])),
                   self.veto_mask, assume_unique=True)
-            self.mask = np.logical_and(self.boolean_veto, self.filter_mask)
+            mask = np.logical_and(self.boolean_veto, self.filter_mask)
             logging.info('%i triggers remain after cut on %s',
-                          len(self.trigs['end_time'][self.mask]), filter_func)
-        else:
-            self.mask = self.veto_mask
+                          mask.sum(), filter_func)
+            return mask
+        return self.veto_mask
+
+    @property
+    def mask(self):
+        """ The triggers to use, as a boolean array or an array of indices
+        """
+        if self._mask is None:
+            self._mask = self._build_mask()
+        return self._mask
+
+    @mask.setter
+    def mask(self, mask):
+        self._mask = mask
+        self.clear_cache()
+
+    def clear_cache(self):
+        """ Forget the columns read and derived so far, so that they are
+        read again at their next use
+        """
+        self._cache = {}
+
+    def _masked(self, name):
+        """ Return the values of a trigger column selected by the mask
+        """
+        key = ('column', name)
+        if key not in self._cache:
+            self._cache[key] = masked_column(self.trigs[name], self.mask)
+        return self._cache[key]
+
+    def _bank_column(self, name):
+        """ Return a full column of the bank, which is read only once
+        """
+        if name not in self._bank_columns:
+            self._bank_columns[name] = np.array(self.bank[name])
+        return self._bank_columns[name]
 
     def checkbank(self, param):
         if self.bank == {}:
@@ -392,7 +732,7 @@ class SingleDetTriggers(object):
     def get_param_names(cls):
         """Returns a list of plottable CBC parameter variables"""
         return [m[0] for m in inspect.getmembers(cls) \
-            if type(m[1]) == property]
+            if type(m[1]) == property and m[0] != 'mask']
 
     def mask_to_n_loudest_clustered_events(self, n_loudest=10,
                                            ranking_statistic="newsnr",
@@ -438,72 +778,72 @@ class SingleDetTriggers(object):
         else:
             self.mask = self.mask[index]
 
-    @property
+    @_cached_column
     def template_id(self):
-        return np.array(self.trigs['template_id'])[self.mask]
+        return self._masked('template_id')
 
-    @property
+    @_cached_column
     def mass1(self):
         self.checkbank('mass1')
-        return np.array(self.bank['mass1'])[self.template_id]
+        return self._bank_column('mass1')[self.template_id]
 
-    @property
+    @_cached_column
     def mass2(self):
         self.checkbank('mass2')
-        return np.array(self.bank['mass2'])[self.template_id]
+        return self._bank_column('mass2')[self.template_id]
 
-    @property
+    @_cached_column
     def spin1z(self):
         self.checkbank('spin1z')
-        return np.array(self.bank['spin1z'])[self.template_id]
+        return self._bank_column('spin1z')[self.template_id]
 
-    @property
+    @_cached_column
     def spin2z(self):
         self.checkbank('spin2z')
-        return np.array(self.bank['spin2z'])[self.template_id]
+        return self._bank_column('spin2z')[self.template_id]
 
-    @property
+    @_cached_column
     def spin2x(self):
         self.checkbank('spin2x')
-        return np.array(self.bank['spin2x'])[self.template_id]
+        return self._bank_column('spin2x')[self.template_id]
 
-    @property
+    @_cached_column
     def spin2y(self):
         self.checkbank('spin2y')
-        return np.array(self.bank['spin2y'])[self.template_id]
+        return self._bank_column('spin2y')[self.template_id]
 
-    @property
+    @_cached_column
     def spin1x(self):
         self.checkbank('spin1x')
-        return np.array(self.bank['spin1x'])[self.template_id]
+        return self._bank_column('spin1x')[self.template_id]
 
-    @property
+    @_cached_column
     def spin1y(self):
         self.checkbank('spin1y')
-        return np.array(self.bank['spin1y'])[self.template_id]
+        return self._bank_column('spin1y')[self.template_id]
 
-    @property
+    @_cached_column
     def inclination(self):
         self.checkbank('inclination')
-        return np.array(self.bank['inclination'])[self.template_id]
+        return self._bank_column('inclination')[self.template_id]
 
-    @property
+    @_cached_column
     def mtotal(self):
         return self.mass1 + self.mass2
 
-    @property
+    @_cached_column
     def mchirp(self):
         mchirp, eta = pnutils.mass1_mass2_to_mchirp_eta(
             self.mass1, self.mass2)
         return mchirp
 
-    @property
+    @_cached_column
     def eta(self):
         mchirp, eta = pnutils.mass1_mass2_to_mchirp_eta(
             self.mass1, self.mass2)
         return eta
 
-    @property
+    @_cached_column
     def effective_spin(self):
         # FIXME assumes aligned spins
         return pnutils.phenomb_chi(self.mass1, self.mass2,
@@ -512,38 +852,38 @@ class SingleDetTriggers(object):
     # IMPROVEME: would like to have a way to access all get_freq and/or
     # other pnutils.* names rather than hard-coding each one
     # - eg make this part of a fancy interface to the bank file ?
-    @property
+    @_cached_column
     def f_seobnrv2_peak(self):
         return pnutils.get_freq('fSEOBNRv2Peak', self.mass1, self.mass2,
                                 self.spin1z, self.spin2z)
 
-    @property
+    @_cached_column
     def f_seobnrv4_peak(self):
         return pnutils.get_freq('fSEOBNRv4Peak', self.mass1, self.mass2,
                                 self.spin1z, self.spin2z)
 
-    @property
+    @_cached_column
     def end_time(self):
-        return np.array(self.trigs['end_time'])[self.mask]
+        return self._masked('end_time')
 
-    @property
+    @_cached_column
     def template_duration(self):
-        return np.array(self.trigs['template_duration'])[self.mask]
+        return self._masked('template_duration')
 
-    @property
+    @_cached_column
     def snr(self):
-        return np.array(self.trigs['snr'])[self.mask]
+        return self._masked('snr')
 
-    @property
+    @_cached_column
     def u_vals(self):
-        return np.array(self.trigs['u_vals'])[self.mask]
+        return self._masked('u_vals')
 
-    @property
+    @_cached_column
     def rchisq(self):
-        return np.array(self.trigs['chisq'])[self.mask] \
-            / (np.array(self.trigs['chisq_dof'])[self.mask] * 2 - 2)
+        return self._masked('chisq') \
+            / (self._masked('chisq_dof') * 2 - 2)
 
-    @property
+    @_cached_column
     def newsnr(self):
         return events.newsnr(self.snr, self.rchisq)
 
@@ -551,7 +891,7 @@ class SingleDetTriggers(object):
         if hasattr(self, cname):
             return getattr(self, cname)
         else:
-            return np.array(self.trigs[cname])[self.mask]
+            return self._masked(cname)
 
 
 class ForegroundTriggers(object):
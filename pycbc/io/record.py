@@ -28,7 +28,7 @@ useful for storing and retrieving data created by a search for gravitationa
 waves.
 """
 
-import os, sys, types, re, copy, numpy, inspect
+import os, sys, types, re, copy, numpy, inspect, weakref
 from glue.ligolw import types as ligolw_types
 from pycbc import coordinates
 from pycbc.detector import Detector
@@ -194,6 +194,24 @@ def get_instance_fields_from_arg(arg):
     """
     return set(_instfieldparser.findall(arg))
 
+# the code of expressions evaluated on arrays, compiled once
+_compiled_expressions = {}
+def compile_expression(arg):
+    """Returns the code object of the given python expression. The code is
+    compiled on the first call with a given expression, and the same code
+    object is returned on later calls.
+    """
+    try:
+        return _compiled_expressions[arg]
+    except KeyError:
+        code = compile(arg, '<string>', 'eval')
+        _compiled_expressions[arg] = code
+        return code
+
+# the names used by the source code of properties and methods, keyed by
+# their functions; reading the source of a function is slow
+_function_fields = {}
+
 def get_needed_fieldnames(arr, names):
     """Given a FieldArray-like array and a list of names, determines what
     fields are needed from the array so that using the names does not result
@@ -240,16 +258,27 @@ def get_needed_fieldnames(arr, names):
                 # using their fget attribute
                 func = getattr(cls, name).fget
             except AttributeError:
-                # no fget attribute, assume is an instance method
-                func = getattr(arr, name)
+                # no fget attribute, assume is an instance method or a
+                # virtual field of a ColumnArray
+                if isinstance(arr, ColumnArray) and name in arr.virtualfields:
+                    func = arr._virtualfields[name]
+                else:
+                    func = getattr(arr, name)
             # evaluate the source code of the function
             try:
-                sourcecode = inspect.getsource(func)
-            except TypeError:
-                # not a function, just pass
-                continue
-            # evaluate the source code for the fields
-            possible_fields = get_instance_fields_from_arg(sourcecode)
+                possible_fields = _function_fields[func]
+            except (KeyError, TypeError):
+                try:
+                    sourcecode = inspect.getsource(func)
+                except TypeError:
+                    # not a function, just pass
+                    continue
+                # evaluate the source code for the fields
+                possible_fields = get_instance_fields_from_arg(sourcecode)
+                try:
+                    _function_fields[func] = possible_fields
+                except TypeError:
+                    pass
             # some of the variables returned by possible fields may themselves
             # be methods/properties that depend on other fields. For instance,
             # mchirp relies on eta and mtotal, which each use mass1 and mass2;
@@ -818,7 +847,8 @@ class FieldArray(numpy.recarray):
 
             # add numpy functions
             item_dict.update(numpy.__dict__)
-            return eval(item, {"__builtins__": None}, item_dict)
+            return eval(compile_expression(item), {"__builtins__": None},
+                        item_dict)
 
     def __contains__(self, field):
         """Returns True if the given field name is in self's fields."""
@@ -1329,6 +1359,433 @@ def _isstring(dtype):
     return dtype.type == numpy.unicode_ or dtype.type == numpy.string_
 
 
+#
+# =============================================================================
+#
+#                           Struct of arrays backend
+#
+# =============================================================================
+#
+class _ColumnBuffer(object):
+    """The storage shared by ColumnArrays that were appended to one another.
+    Each column is allocated with room to grow, and `size` is the number of
+    rows in use. Columns that fill the capacity are used without a copy.
+    `users` holds the arrays that use the buffer, so that one that is about
+    to be changed in place can tell whether it must copy its fields first.
+    """
+    def __init__(self, columns, capacity):
+        self.columns = {}
+        for name, col in columns.items():
+            if len(col) == capacity:
+                self.columns[name] = col
+                continue
+            buf = numpy.empty((capacity,) + col.shape[1:], dtype=col.dtype)
+            buf[:len(col)] = col
+            self.columns[name] = buf
+        self.size = len(columns.values()[0]) if columns else 0
+        self.capacity = capacity
+        self.users = weakref.WeakSet()
+
+
+class ColumnArray(object):
+    """
+    An alternative to FieldArray that stores each field as a separate
+    contiguous array rather than as one array of records.
+
+    Getting a field returns its array without a copy, and indexing with a
+    slice, boolean array or index array indexes each field separately.
+    Expressions such as ``arr['mass1 + mass2']`` are compiled once, and
+    virtual fields are methods that are looked up when used. Appending
+    grows the fields geometrically, so that building an array by repeated
+    appends takes time linear in its final size.
+
+    Most of the FieldArray interface is supported, and
+    :py:meth:`from_fieldarray` and :py:meth:`to_fieldarray` convert between
+    the two.
+
+    Parameters
+    ----------
+    shape : int
+        The number of elements of the array.
+    name : {None, str}
+        A name for the array.
+    zero : {True, bool}
+        Set each element to the default empty value of its type. Otherwise
+        the elements are left uninitialized.
+    dtype : numpy.dtype, or something that can be converted to one
+        The fields of the array and their types.
+    """
+    __persistent_attributes__ = ['name', 'id_maps']
+
+    def __init__(self, shape, name=None, zero=True, dtype=None):
+        dtype = numpy.dtype(dtype)
+        if zero:
+            columns = [(n, default_empty(shape, dtype[n]))
+                       for n in dtype.names]
+        else:
+            columns = [(n, numpy.empty(shape, dtype=dtype[n]))
+                       for n in dtype.names]
+        self._set_columns(columns)
+        self.name = name
+        self.id_maps = None
+        self._virtualfields = {}
+
+    def _set_columns(self, columns, buf=None):
+        """Sets the fields of self from a list of (name, array) tuples, or
+        from the given buffer.
+        """
+        if buf is None:
+            names = [n for n, c in columns]
+            columns = dict(columns)
+            size = len(columns[names[0]]) if names else 0
+            buf = _ColumnBuffer(columns, size)
+        else:
+            names = list(self._names)
+            size = buf.size
+        if '_buffer' in self.__dict__:
+            self._buffer.users.discard(self)
+        self._names = tuple(names)
+        self._buffer = buf
+        self._size = size
+        buf.users.add(self)
+
+    def _own(self):
+        """Copies the fields of self to a buffer of its own if another array
+        shares them, so that they can be changed without changing it.
+        """
+        if len(self._buffer.users) > 1:
+            self._set_columns([(n, self._column(n).copy())
+                               for n in self._names])
+
+    def _new(self, columns, buf=None):
+        """Returns a new instance of this class with the given fields, and
+        with the attributes and virtual fields of self.
+        """
+        obj = object.__new__(type(self))
+        obj._names = self._names
+        obj._set_columns(columns, buf)
+        obj.__persistent_attributes__ = self.__persistent_attributes__
+        for attr in self.__persistent_attributes__:
+            setattr(obj, attr, copy.copy(getattr(self, attr, None)))
+        obj._virtualfields = self._virtualfields.copy()
+        return obj
+
+    def _column(self, name):
+        return self._buffer.columns[name][:self._size]
+
+    @classmethod
+    def from_arrays(cls, arrays, name=None, names=None):
+        """Creates a new instance of self from the given (list of) array(s).
+
+        Parameters
+        ----------
+        arrays : (list of) numpy array(s)
+            The values of each field. These are copied.
+        name : {None|str}
+            What the output array should be named.
+        names : (list of) strings
+            The names of the fields. If None, the fields are named ``'fi'``
+            where i is the index of the array in arrays.
+
+        Returns
+        -------
+        array : instance of this class
+        """
+        if isinstance(arrays, numpy.ndarray) and arrays.dtype.names is None:
+            arrays = [arrays]
+        if names is None:
+            names = ['f%i' % i for i in range(len(arrays))]
+        elif isinstance(names, str) or isinstance(names, unicode):
+            names = names.split(',')
+        obj = object.__new__(cls)
+        obj._set_columns([(str(n), numpy.array(a, ndmin=1))
+                          for n, a in zip(names, arrays)])
+        obj.name = name
+        obj.id_maps = None
+        obj._virtualfields = {}
+        return obj
+
+    @classmethod
+    def from_kwargs(cls, **kwargs):
+        """Creates a new instance of self from the given keyword arguments,
+        as in FieldArray.from_kwargs.
+        """
+        names = kwargs.keys()
+        return cls.from_arrays([kwargs[n] for n in names], names=names)
+
+    @classmethod
+    def from_records(cls, records, name=None, **kwargs):
+        """Creates a new instance of self from the given (list of)
+        record(s). See `numpy.rec.fromrecords` for the keyword parameters.
+        """
+        rec = numpy.rec.fromrecords(records, **kwargs)
+        return cls.from_arrays([rec[n] for n in rec.dtype.names],
+                               names=rec.dtype.names, name=name)
+
+    @classmethod
+    def from_fieldarray(cls, array):
+        """Creates a new instance of self with the fields, virtual fields and
+        name of the given FieldArray.
+        """
+        obj = cls.from_arrays([array[n] for n in array.fieldnames],
+                              names=array.fieldnames, name=array.name)
+        for vf in array.virtualfields:
+            obj._virtualfields[vf] = getattr(type(array), vf).fget
+        return obj
+
+    def to_fieldarray(self, cls=FieldArray):
+        """Returns the fields of self as a FieldArray, or an instance of the
+        given subclass of it. Virtual fields are not copied.
+        """
+        return cls.from_arrays([self._column(n) for n in self._names],
+                               names=list(self._names), name=self.name)
+
+    @property
+    def fieldnames(self):
+        """Returns a tuple listing the field names in self."""
+        return self._names
+
+    @property
+    def virtualfields(self):
+        """Returns a tuple listing the names of virtual fields in self."""
+        return tuple(self._virtualfields.keys())
+
+    @property
+    def fields(self):
+        """Returns a tuple listing the names of fields and virtual fields in
+        self."""
+        return self.fieldnames + self.virtualfields
+
+    @property
+    def aliases(self):
+        """ColumnArrays have no aliases; returns an empty dictionary."""
+        return {}
+
+    @property
+    def dtype(self):
+        """The numpy dtype of the records of self."""
+        return numpy.dtype([(n, self._buffer.columns[n].dtype,
+                             self._buffer.columns[n].shape[1:])
+                            for n in self._names])
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def shape(self):
+        return (self._size,)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, field):
+        """Returns True if the given field name is in self's fields."""
+        return field in self.fields
+
+    def __dir__(self):
+        return sorted(set(dir(type(self)) + list(self.__dict__.keys()) +
+                          list(self.fields)))
+
+    def __getattr__(self, attr):
+        # only called when normal lookup fails, so fields and virtual
+        # fields are found here
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if attr in self._names:
+            self._own()
+            return self._column(attr)
+        if attr in self._virtualfields:
+            return self._virtualfields[attr](self)
+        raise AttributeError("%s has no attribute or field %s" %
+                             (type(self).__name__, attr))
+
+    def __getitem__(self, item):
+        """Returns a field, virtual field or a function of them if item is
+        a string. Otherwise, returns the elements given by item, which may
+        be an integer, slice, boolean array or array of indices.
+        """
+        if isinstance(item, str) or isinstance(item, unicode):
+            if item in self._names:
+                self._own()
+                return self._column(item)
+            if item in self._virtualfields:
+                return self._virtualfields[item](self)
+            return self._evaluate(item)
+        if isinstance(item, (int, long, numpy.integer)):
+            return numpy.rec.fromarrays(
+                [self._column(n)[item:item + 1 or None] for n in self._names],
+                dtype=self.dtype)[0]
+        return self._new([(n, self._column(n)[item]) for n in self._names])
+
+    def _evaluate(self, item):
+        """Evaluates a python expression of the fields, virtual fields and
+        attributes of self.
+        """
+        code = compile_expression(item)
+        names = {}
+        for name in code.co_names:
+            if name in self._names:
+                names[name] = self._column(name)
+            elif name in self._virtualfields or name in self.__dict__ or \
+                    hasattr(type(self), name):
+                names[name] = getattr(self, name)
+        return eval(code, _numpy_namespace, names)
+
+    def __setitem__(self, item, values):
+        """Sets the values of a field if item is a string, adding the field
+        if self does not have it. Otherwise, sets the fields of the elements
+        given by item from the fields of values.
+        """
+        self._own()
+        if isinstance(item, str) or isinstance(item, unicode):
+            if item in self._names:
+                self._column(item)[:] = values
+            else:
+                self.add_fields(values, item, inplace=True)
+            return
+        for n in self._names:
+            self._column(n)[item] = values[n]
+
+    def sort(self, axis=-1, kind='quicksort', order=None):
+        """Sort the array in place, by the given field, virtual field or
+        expression, or list of them. If order is None, sort by every field,
+        the first given most weight.
+        """
+        if order is None:
+            order = list(self._names)
+        if isinstance(order, list):
+            idx = numpy.lexsort([self[o] for o in order[::-1]])
+        else:
+            idx = self[order].argsort(kind=kind)
+        self._own()
+        for n in self._names:
+            col = self._column(n)
+            col[:] = col[idx]
+
+    def add_fields(self, arrays, names=None, assubarray=False, inplace=False):
+        """Adds the given arrays as new fields.
+
+        Parameters
+        ----------
+        arrays : (list of) numpy array(s)
+            The arrays to add.
+        names : (list of) strings
+            The names of the new fields.
+        assubarray : bool
+            Not supported by ColumnArrays; must be False.
+        inplace : {False, bool}
+            Add the fields to self rather than return a new array with them.
+
+        Returns
+        -------
+        new_array : instance of this class
+            An array with the fields added, which is self if inplace.
+        """
+        if assubarray:
+            raise ValueError("ColumnArrays do not support subarray fields")
+        if inplace:
+            self._own()
+        if isinstance(names, str) or isinstance(names, unicode):
+            names = [names]
+            arrays = [arrays]
+        columns = [(n, self._column(n)) for n in self._names]
+        for n, a in zip(names, arrays):
+            a = numpy.array(a, ndmin=1)
+            if len(a) != self._size:
+                a = numpy.resize(a, (self._size,) + a.shape[1:])
+            columns.append((str(n), a))
+        if inplace:
+            self._set_columns(columns)
+            return self
+        return self._new(columns)
+
+    def add_methods(self, names, methods):
+        """Adds the given method(s) as instance method(s) of self. The
+        method(s) must take `self` as a first argument.
+        """
+        if isinstance(names, str) or isinstance(names, unicode):
+            names = [names]
+            methods = [methods]
+        for name, method in zip(names, methods):
+            setattr(self, name, types.MethodType(method, self))
+
+    def add_virtualfields(self, names, methods):
+        """Returns a copy of this array that shares its fields, with the
+        given methods added as virtual fields.
+        """
+        if isinstance(names, str) or isinstance(names, unicode):
+            names = [names]
+            methods = [methods]
+        out = self._new([(n, self._column(n)) for n in self._names])
+        out._virtualfields.update(zip(names, methods))
+        return out
+
+    add_properties = add_virtualfields
+
+    def addattr(self, attrname, value=None, persistent=True):
+        """Adds an attribute to self. Persistent attributes are copied to
+        the arrays created from this one.
+        """
+        setattr(self, attrname, value)
+        if persistent and attrname not in self.__persistent_attributes__:
+            self.__persistent_attributes__ = \
+                self.__persistent_attributes__ + [attrname]
+
+    def append(self, other):
+        """Appends another array to this array.
+
+        The returned array shares the fields of this array where they have
+        room for the values of other, and this array is the last one
+        appended to them, so that repeated appends copy each value a bounded
+        number of times. This array itself is unchanged. Either array copies
+        the shared fields before they are set, sorted or returned, if the
+        other still exists. String fields are
+        widened to hold the longest string of either array.
+
+        Parameters
+        ----------
+        other : ColumnArray, FieldArray or numpy record array
+            The array to append values from. It must have the same fields as
+            this array.
+
+        Returns
+        -------
+        array
+            An array with others values appended to this array's values.
+        """
+        buf = self._buffer
+        num = len(other)
+        size = self._size + num
+        other = dict((n, numpy.asarray(other[n])) for n in self._names)
+        widen = [n for n in self._names
+                 if _isstring(buf.columns[n].dtype) and
+                 other[n].dtype.itemsize > buf.columns[n].dtype.itemsize]
+
+        if buf.size != self._size or size > buf.capacity or widen:
+            columns = {}
+            for n in self._names:
+                dtype = buf.columns[n].dtype
+                if n in widen:
+                    dtype = other[n].dtype
+                columns[n] = self._column(n).astype(dtype)
+            buf = _ColumnBuffer(columns, max(2 * size, 16))
+
+        for n in self._names:
+            buf.columns[n][self._size:size] = other[n]
+        buf.size = size
+        return self._new(None, buf)
+
+    # these only use the interface shared with FieldArray
+    to_array = FieldArray.__dict__['to_array']
+    parse_boolargs = FieldArray.__dict__['parse_boolargs']
+
+
+# the globals of expressions evaluated on ColumnArrays
+_numpy_namespace = dict(numpy.__dict__)
+_numpy_namespace['__builtins__'] = None
+
+
 def aliases_from_fields(fields):
     """Given a dictionary of fields, will return a dictionary mapping the
     aliases to the names.
@@ -1781,4 +2238,4 @@ class WaveformArray(_FieldArrayWithDefaults):
         return time_delay_from_center(detector, self.ra, self.dec, self.tc)
 
 
-__all__ = ['FieldArray', 'WaveformArray']
+__all__ = ['FieldArray', 'ColumnArray', 'WaveformArray']
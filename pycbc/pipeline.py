@@ -0,0 +1,124 @@
+# Copyright (C) 2017 The PyCBC team
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+This module provides a pipeline which runs a sequence of processing stages
+concurrently, each on its own thread, within a single process.
+"""
+import sys
+import Queue
+import threading
+
+# Marks the end of the items passed between stages
+_DONE = object()
+
+class Pipeline(object):
+    """ Pass items through a sequence of stages, each run on its own thread.
+
+    While the last stage works on one item, the stage before it may work on
+    the next item, and so on, so that the stages overlap in time. This is
+    useful where the stages spend much of their time in code that releases
+    the GIL, such as FFTW or numpy. Each stage sees the items in order.
+
+    Parameters
+    ----------
+    stages : list of callables
+        The first stage is called with each item given to `run`, and each
+        later stage with the return value of the stage before it. The
+        return value of the last stage is discarded.
+    depth : {1, int}
+        The number of items that may wait between two stages. This bounds
+        the number of items in the pipeline at once to
+        len(stages) + depth * (len(stages) - 1).
+    """
+    def __init__(self, stages, depth=1):
+        if len(stages) == 0:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.depth = depth
+        self.error = None
+        self.error_stage = None
+
+    @property
+    def max_items(self):
+        """ The largest number of items that can be in the pipeline at once.
+        """
+        return len(self.stages) + self.depth * (len(self.stages) - 1)
+
+    def _worker(self, num, stage, inqueue, outqueue):
+        while True:
+            item = inqueue.get()
+            if item is _DONE:
+                break
+
+            # After an error, the failed stage and those before it keep
+            # draining their queues so that no stage blocks, but do no more
+            # work. Later stages finish the items already passed to them.
+            if self.error_stage is not None and num <= self.error_stage:
+                continue
+            try:
+                result = stage(item)
+            except Exception:
+                if self.error is None:
+                    self.error = sys.exc_info()
+                    self.error_stage = num
+                continue
+
+            if outqueue is not None:
+                outqueue.put(result)
+
+        if outqueue is not None:
+            outqueue.put(_DONE)
+
+    def run(self, items):
+        """ Pass each item through every stage, and wait for all to finish.
+
+        Parameters
+        ----------
+        items : iterable
+            The inputs of the first stage.
+
+        Raises
+        ------
+        Exception
+            The first exception raised by any stage is raised again here,
+            once every stage has stopped.
+        """
+        self.error = None
+        self.error_stage = None
+        queues = [Queue.Queue(maxsize=self.depth) for s in self.stages]
+        queues.append(None)
+
+        threads = []
+        for i, stage in enumerate(self.stages):
+            thread = threading.Thread(target=self._worker,
+                                      args=(i, stage, queues[i],
+                                            queues[i + 1]))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for item in items:
+                if self.error is not None:
+                    break
+                queues[0].put(item)
+        finally:
+            queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
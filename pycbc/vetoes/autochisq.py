@@ -18,10 +18,132 @@ from pycbc.filter import  matched_filter_core
 from pycbc.types import Array
 import numpy as np
 import logging
+import hashlib
+from collections import OrderedDict
 
 BACKEND_PREFIX="pycbc.vetoes.autochisq_"
 
 
+def autochisq_offsets(num_samples, stride=1, num_points=None, oneside=None):
+    """ Return the offsets from a trigger of the points tested by the
+    auto-chisq.
+
+    Parameters
+    ----------
+    num_samples: int
+        The length of the snr time series.
+    stride: [int, optional; default = 1]
+        stride for points selection for autochisq
+    num_points: [int, optional; default=None]
+        Number of points used for autochisq on each side, if None all points
+        are used.
+    oneside: [str, optional; default=None]
+        If None two sided offsets are returned, or if 'left' or 'right' only
+        those before or after the trigger.
+
+    Returns
+    -------
+    offsets: numpy.ndarray
+        The offsets, in samples, of the points tested.
+    num_points: int
+        The number of points on each side, limited by the length of the
+        time series.
+    """
+    num_points_all = int(num_samples/stride)
+    if num_points is None:
+        num_points = num_points_all
+    if (num_points > num_points_all):
+        num_points = num_points_all
+
+    start_point = - stride*num_points
+    end_point = stride*num_points+1
+    if oneside == 'left':
+        achisq_idx_list = np.arange(start_point, 0, stride)
+    elif oneside == 'right':
+        achisq_idx_list = np.arange(stride, end_point, stride)
+    else:
+        achisq_idx_list_pt1 = np.arange(start_point, 0, stride)
+        achisq_idx_list_pt2 = np.arange(stride, end_point, stride)
+        achisq_idx_list = np.append(achisq_idx_list_pt1,
+                                    achisq_idx_list_pt2)
+    return achisq_idx_list, num_points
+
+def autochisq_at_offsets(sn, corr_sn, hauto_corr_vec, offsets, indices,
+                         twophase=True, maxvalued=False,
+                         max_elements=2**20):
+    """ Compute the auto-chisq of many triggers at once, given the
+    autocorrelation of the template at the offsets tested.
+
+    Parameters
+    ----------
+    sn: Array[complex]
+        normalized (!) array of complex snr for the template that produced the
+        trigger(s) being tested
+    corr_sn : Array[complex]
+        normalized (!) array of complex snr for the template that you want to
+        produce a correlation chisq test for.
+    hauto_corr_vec: numpy.ndarray
+        The time domain autocorrelation of the template at each of `offsets`.
+    offsets: numpy.ndarray
+        The offsets from each trigger of the points tested, as returned by
+        `autochisq_offsets`.
+    indices: Array[int]
+        compute correlation chisquare at the points specified in this array,
+    twophase: Boolean, optional; default=True
+        If True calculate the auto-chisq using both phases of the filter.
+    maxvalued: Boolean, optional; default=False
+        Return the largest auto-chisq at any of the points tested if True.
+    max_elements: {2**20, int}
+        The largest number of trigger and offset pairs evaluated together,
+        which bounds the memory used. At least one trigger is always
+        evaluated at a time.
+
+    Returns
+    -------
+    achisq: numpy.ndarray
+        The auto-chisq of each trigger.
+    """
+    sn = sn.numpy() if isinstance(sn, Array) else np.asarray(sn)
+    corr_sn = corr_sn.numpy() if isinstance(corr_sn, Array) \
+                                                  else np.asarray(corr_sn)
+    hauto_corr_vec = np.asarray(hauto_corr_vec)
+    indices = np.array(indices, dtype=np.int64, ndmin=1)
+    Nsnr = len(sn)
+
+    hauto_norm = hauto_corr_vec.real*hauto_corr_vec.real
+    # REMOVE THIS LINE TO REPRODUCE OLD RESULTS
+    hauto_norm += hauto_corr_vec.imag*hauto_corr_vec.imag
+    chisq_norm = 1.0 - hauto_norm
+
+    achisq = np.zeros(len(indices))
+    block_size = max(1, max_elements // max(1, len(offsets)))
+    for start in range(0, len(indices), block_size):
+        ind = indices[start:start + block_size]
+        snr = sn[ind]
+        snrabs = np.abs(snr)
+        cphi = (snr.real / snrabs)[:, None]
+        sphi = (snr.imag / snrabs)[:, None]
+        # By construction, the other "phase" of the SNR is 0
+        snr_ind = snr.real[:, None]*cphi + snr.imag[:, None]*sphi
+
+        # Wrap indices if needed (maybe should fail in this case?)
+        points = corr_sn[(ind[:, None] + offsets[None, :]) % Nsnr]
+
+        z = points.real*cphi + points.imag*sphi
+        dz = z - hauto_corr_vec.real*snr_ind
+        achisq_list = dz*dz/chisq_norm
+
+        if twophase:
+            z = -points.real*sphi + points.imag*cphi
+            dz = z - hauto_corr_vec.imag*snr_ind
+            achisq_list += dz*dz/chisq_norm
+
+        if maxvalued:
+            achisq[start:start + block_size] = achisq_list.max(axis=1)
+        else:
+            achisq[start:start + block_size] = achisq_list.sum(axis=1)
+    return achisq
+
 def autochisq_from_precomputed(sn, corr_sn, hautocorr, indices,
                        stride=1, num_points=None, oneside=None,
                        twophase=True, maxvalued=False):
@@ -65,69 +187,14 @@ def autochisq_from_precomputed(sn, corr_sn, hautocorr, indices,
         returns autochisq values and snr corresponding to the instances 
         of time defined by indices
     """
-    Nsnr = len(sn)
-
-    indx = np.array([])
-
-    achisq = np.zeros(len(indices))
-    num_points_all = int(Nsnr/stride)
-    if num_points is None:
-        num_points = num_points_all
-    if (num_points > num_points_all):
-        num_points = num_points_all
-
-    snrabs = np.abs(sn[indices])
-    cphi_array = (sn[indices]).real / snrabs
-    sphi_array = (sn[indices]).imag / snrabs
-
-    start_point = - stride*num_points
-    end_point = stride*num_points+1
-    if oneside == 'left':
-        achisq_idx_list = np.arange(start_point, 0, stride)
-    elif oneside == 'right':
-        achisq_idx_list = np.arange(stride, end_point, stride)
-    else:
-        achisq_idx_list_pt1 = np.arange(start_point, 0, stride)
-        achisq_idx_list_pt2 = np.arange(stride, end_point, stride)
-        achisq_idx_list = np.append(achisq_idx_list_pt1,
-                                    achisq_idx_list_pt2)
-
-    hauto_corr_vec = hautocorr[achisq_idx_list]
-    hauto_norm = hauto_corr_vec.real*hauto_corr_vec.real
-    # REMOVE THIS LINE TO REPRODUCE OLD RESULTS
-    hauto_norm += hauto_corr_vec.imag*hauto_corr_vec.imag
-    chisq_norm = 1.0 - hauto_norm
-
-    for ip,ind in enumerate(indices):
-        curr_achisq_idx_list = achisq_idx_list + ind
-        
-        cphi = cphi_array[ip]
-        sphi = sphi_array[ip]
-        # By construction, the other "phase" of the SNR is 0
-        snr_ind =  sn[ind].real*cphi + sn[ind].imag*sphi
-
-        # Wrap index if needed (maybe should fail in this case?)
-        if curr_achisq_idx_list[0] < 0:
-            curr_achisq_idx_list[curr_achisq_idx_list < 0] += Nsnr
-        if curr_achisq_idx_list[-1] > (Nsnr - 1):
-            curr_achisq_idx_list[curr_achisq_idx_list > (Nsnr-1)] -= Nsnr
-
-        z = corr_sn[curr_achisq_idx_list].real*cphi + \
-             corr_sn[curr_achisq_idx_list].imag*sphi
-        dz = z - hauto_corr_vec.real*snr_ind
-        curr_achisq_list = dz*dz/chisq_norm
-
-        if twophase:
-            chisq_norm = 1.0 - hauto_norm
-            z = -corr_sn[curr_achisq_idx_list].real*sphi + \
-                 corr_sn[curr_achisq_idx_list].imag*cphi
-            dz = z - hauto_corr_vec.imag*snr_ind
-            curr_achisq_list += dz*dz/chisq_norm
-          
-        if maxvalued:
-            achisq[ip] = curr_achisq_list.max()
-        else:
-            achisq[ip] = curr_achisq_list.sum()
+    offsets, num_points = autochisq_offsets(len(sn), stride=stride,
+                                            num_points=num_points,
+                                            oneside=oneside)
+    hautocorr = hautocorr.numpy() if isinstance(hautocorr, Array) \
+                                                else np.asarray(hautocorr)
+    achisq = autochisq_at_offsets(sn, corr_sn, hautocorr[offsets], offsets,
+                                  indices, twophase=twophase,
+                                  maxvalued=maxvalued)
 
     dof = num_points
     if oneside is None:
@@ -143,7 +210,7 @@ class SingleDetAutoChisq(object):
     """	
     def __init__(self, stride, num_points, onesided=None, twophase=False,
                  reverse_template=False, take_maximum_value=False,
-                 maximal_value_dof=None):
+                 maximal_value_dof=None, cache_size=1024):
         """
         Initialize autochisq calculation instance
 
@@ -171,6 +238,10 @@ class SingleDetAutoChisq(object):
         maximal_value_dof : int, required if using take_maximum_value
             If using take_maximum_value the expected value is not known. This
             value specifies what to store in the cont_chisq_dof output.
+        cache_size : optional, default=1024
+            The number of template autocorrelations kept, for different
+            templates or PSDs, before the least recently used is discarded.
+            Only the autocorrelation at the points tested is kept.
         """
         if stride > 0:
             self.do = True
@@ -195,11 +266,69 @@ class SingleDetAutoChisq(object):
                     raise ValueError(err_msg)
                 self.dof = maximal_value_dof
             
-            self._autocor = None
-            self._autocor_id = None
+            self.cache_size = cache_size
+            self._autocor_cache = OrderedDict()
+            self._psd_keys = {}
         else:
             self.do = False
 
+    def psd_key(self, psd):
+        """ Return a digest identifying the contents of a PSD.
+        """
+        key = id(psd)
+        if key not in self._psd_keys:
+            data = np.array(psd.numpy())
+            self._psd_keys[key] = hashlib.sha1(data.tostring()).hexdigest()
+        return self._psd_keys[key]
+
+    def autocorrelation(self, template, psd, offsets,
+                        low_frequency_cutoff=None, high_frequency_cutoff=None):
+        """ Return the autocorrelation of the template at the given offsets.
+
+        Autocorrelations are cached by the hash of the template and the
+        contents of the PSD, and the least recently used is discarded once
+        there are more than cache_size.
+        """
+        params = getattr(template, 'params', None)
+        template_key = getattr(params, 'template_hash', None)
+        if template_key is None:
+            template_key = id(template)
+        key = (template_key, len(template), self.psd_key(psd),
+               low_frequency_cutoff, high_frequency_cutoff,
+               offsets.tostring())
+
+        if key in self._autocor_cache:
+            autocor = self._autocor_cache.pop(key)
+            self._autocor_cache[key] = autocor
+            return autocor
+
+        logging.info("Calculating autocorrelation")
+        htilde = make_frequency_series(template)
+        if not self.reverse_template:
+            Pt, _Ptilde, P_norm = matched_filter_core(htilde,
+                      htilde, psd=psd,
+                      low_frequency_cutoff=low_frequency_cutoff,
+                      high_frequency_cutoff=high_frequency_cutoff)
+            Pt = Pt * (1./ Pt[0])
+        else:
+            Pt, _Ptilde, P_norm = matched_filter_core(htilde.conj(),
+                      htilde, psd=psd,
+                      low_frequency_cutoff=low_frequency_cutoff,
+                      high_frequency_cutoff=high_frequency_cutoff)
+
+            # T-reversed template has same norm as forward template
+            # so we can normalize using that
+            # FIXME: Here sigmasq has to be cast to a float or the
+            #        code is really slow ... why??
+            norm_fac = P_norm / float(((template.sigmasq(psd))**0.5))
+            Pt *= norm_fac
+
+        autocor = np.array(Pt.numpy()[offsets])
+        self._autocor_cache[key] = autocor
+        if len(self._autocor_cache) > self.cache_size:
+            self._autocor_cache.popitem(last=False)
+        return autocor
+
     def values(self, sn, indices, template, psd, norm, stilde=None,
                low_frequency_cutoff=None, high_frequency_cutoff=None):
         """
@@ -227,39 +356,18 @@ class SingleDetAutoChisq(object):
             The upper frequency to consider in matched-filters
         """
         if self.do and (len(indices) > 0):
-            htilde = make_frequency_series(template)
-
-            # Check if we need to recompute the autocorrelation
-            key = (id(template), id(psd))
-            if key != self._autocor_id:
-                logging.info("Calculating autocorrelation")
-
-                if not self.reverse_template:
-                    Pt, _Ptilde, P_norm = matched_filter_core(htilde,
-                              htilde, psd=psd,
-                              low_frequency_cutoff=low_frequency_cutoff,
-                              high_frequency_cutoff=high_frequency_cutoff)
-                    Pt = Pt * (1./ Pt[0])
-                    self._autocor = Array(Pt, copy=True)
-                else:
-                    Pt, _Ptilde, P_norm = matched_filter_core(htilde.conj(),
-                              htilde, psd=psd,
-                              low_frequency_cutoff=low_frequency_cutoff,
-                              high_frequency_cutoff=high_frequency_cutoff)
-
-                    # T-reversed template has same norm as forward template
-                    # so we can normalize using that
-                    # FIXME: Here sigmasq has to be cast to a float or the
-                    #        code is really slow ... why??
-                    norm_fac = P_norm / float(((template.sigmasq(psd))**0.5))
-                    Pt *= norm_fac
-                    self._autocor = Array(Pt, copy=True)
-                self._autocor_id = key
-            
+            offsets, num_points = autochisq_offsets(len(sn),
+                               stride=self.stride, num_points=self.num_points,
+                               oneside=self.one_sided)
+            autocor = self.autocorrelation(template, psd, offsets,
+                               low_frequency_cutoff=low_frequency_cutoff,
+                               high_frequency_cutoff=high_frequency_cutoff)
+
             logging.info("...Calculating autochisquare")
             sn = sn*norm
             if self.reverse_template:
                 assert(stilde is not None)
+                htilde = make_frequency_series(template)
                 asn, acor, ahnrm = matched_filter_core(htilde.conj(), stilde,
                                  low_frequency_cutoff=low_frequency_cutoff,
                                  high_frequency_cutoff=high_frequency_cutoff,
@@ -268,13 +376,16 @@ class SingleDetAutoChisq(object):
             else:
                 correlation_snr = sn
 
-            achi_list = np.array([])
-            index_list = np.array(indices)
-            dof, achi_list, _ = autochisq_from_precomputed(sn, correlation_snr,
-                               self._autocor, index_list, stride=self.stride,
-                               num_points=self.num_points,
-                               oneside=self.one_sided, twophase=self.two_phase,
+            achi_list = autochisq_at_offsets(sn, correlation_snr, autocor,
+                               offsets, np.array(indices),
+                               twophase=self.two_phase,
                                maxvalued=self.take_maximum_value)
+
+            dof = num_points
+            if self.one_sided is None:
+                dof = dof * 2
+            if self.two_phase:
+                dof = dof * 2
             self.dof = dof
             return achi_list
 
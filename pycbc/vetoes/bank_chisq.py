@@ -21,7 +21,7 @@
 #
 # =============================================================================
 #
-import logging, numpy
+import logging, numpy, os, hashlib, tempfile
 from pycbc.types import Array, zeros, real_same_precision_as, TimeSeries
 from pycbc.filter import overlap_cplx, matched_filter_core
 from pycbc.waveform import FilterBank
@@ -162,12 +162,163 @@ def bank_chisq_from_filters(tmplt_snr, tmplt_norm, bank_snrs, bank_norms,
         return TimeSeries(bank_chisq, delta_t=tmplt_snr.delta_t,
                           epoch=tmplt_snr.start_time, copy=False)
 
+def psd_fingerprint(psd, kmin, kmax, num_bands=64):
+    """ Summarize a PSD by the log of its mean in a number of bands.
+
+    Parameters
+    ----------
+    psd: FrequencySeries
+    kmin: int
+        The first frequency index of the summarized band.
+    kmax: int
+        One past the last frequency index of the summarized band.
+    num_bands: {64, int}
+        The number of equal width bands averaged over.
+
+    Returns
+    -------
+    fingerprint: numpy.ndarray
+        The log of the mean of the PSD in each band.
+    """
+    data = numpy.array(psd.numpy()[kmin:kmax], dtype=numpy.float64)
+    bands = numpy.array_split(data, min(num_bands, len(data)))
+    return numpy.log(numpy.array([b.mean() for b in bands]))
+
+def psd_distance(fingerprint1, fingerprint2):
+    """ The largest fractional difference, approximately, between the band
+    averages of two PSDs summarized by `psd_fingerprint`.
+    """
+    return abs(fingerprint1 - fingerprint2).max()
+
+class BankVetoOverlapCache(object):
+    """ Store of the overlaps between templates and bank veto filters on disk.
+
+    The overlaps of each template are stored as a .npy file of complex64
+    values, one for each bank veto filter, under a key describing the
+    template, the filters and the PSD. The fingerprints of the PSDs are
+    stored too, so that jobs may reuse the overlaps made with a PSD close
+    to their own. The directory may be shared between any number of jobs;
+    files are written atomically so concurrent writers are safe.
+
+    Parameters
+    ----------
+    directory: string
+        The directory holding the cache. It is created if it does not exist.
+    """
+    # Increment when the stored format or the overlap calculation changes
+    version = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._fingerprints = {}
+        for subdir in ['psds', 'overlaps']:
+            try:
+                os.makedirs(os.path.join(directory, subdir))
+            except OSError:
+                if not os.path.isdir(os.path.join(directory, subdir)):
+                    raise
+
+    @classmethod
+    def key(cls, template_hash, psd_key, filters_key, **kwds):
+        """ Return the key under which the overlaps of a template are stored.
+
+        Parameters
+        ----------
+        template_hash: int
+            The hash identifying the template parameters.
+        psd_key: string
+            The key identifying the PSD.
+        filters_key: string
+            The key identifying the bank veto filters.
+        \**kwds:
+            Anything else which changes the overlaps.
+
+        Returns
+        -------
+        key: string
+            A hex digest uniquely describing the overlaps.
+        """
+        desc = [cls.version, int(template_hash), psd_key, filters_key]
+        desc += [(k, repr(kwds[k])) for k in sorted(kwds.keys())]
+        return hashlib.sha1(repr(desc)).hexdigest()
+
+    def _write(self, path, data):
+        # Write to a temporary file and rename it into place, so readers
+        # never see a partially written file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            numpy.save(f, data)
+        os.rename(tmp, path)
+
+    def fingerprints(self):
+        """ Return the fingerprints of every PSD stored by any job.
+
+        Returns
+        -------
+        fingerprints: dict
+            The fingerprint of each PSD, keyed by the key of the PSD.
+        """
+        path = os.path.join(self.directory, 'psds')
+        for name in os.listdir(path):
+            psd_key, ext = os.path.splitext(name)
+            if ext != '.npy' or psd_key in self._fingerprints:
+                continue
+            try:
+                self._fingerprints[psd_key] = numpy.load(
+                                                os.path.join(path, name))
+            except (IOError, ValueError):
+                continue
+        return self._fingerprints
+
+    def add_fingerprint(self, psd_key, fingerprint):
+        """ Store the fingerprint of a PSD for use by other jobs.
+        """
+        self._fingerprints[psd_key] = fingerprint
+        self._write(os.path.join(self.directory, 'psds', psd_key + '.npy'),
+                    fingerprint)
+
+    def _path(self, key):
+        return os.path.join(self.directory, 'overlaps', key[0:2],
+                            key + '.npy')
+
+    def get(self, key):
+        """ Return the overlaps stored under key, or None if there are none.
+        """
+        try:
+            overlaps = numpy.load(self._path(key))
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return overlaps
+
+    def put(self, key, overlaps):
+        """ Store the overlaps of a template under key.
+        """
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(path)):
+                raise
+        self._write(path, numpy.array(overlaps, dtype=numpy.complex64))
+
 class SingleDetBankVeto(object):
     """This class reads in a template bank file for a bank veto, handles the
        memory management of its filters internally, and calculates the bank
        veto TimeSeries.
+
+       The overlaps of each template with the filters are kept for each PSD.
+       PSDs whose fingerprints lie within psd_distance of a PSD already seen,
+       by this job or by any job sharing the overlap_cache, share the
+       overlaps calculated with that PSD.
     """
-    def __init__(self, bank_file, flen, delta_f, f_low, cdtype, approximant=None, **kwds):
+    def __init__(self, bank_file, flen, delta_f, f_low, cdtype, approximant=None,
+                 overlap_cache=None, psd_distance=0, **kwds):
+        self.overlap_cache = overlap_cache
+        self.psd_distance = psd_distance
         if bank_file is not None:
             self.do = True
 
@@ -192,6 +343,15 @@ class SingleDetBankVeto(object):
 
             self._overlaps_cache = {}
             self._segment_snrs_cache = {}
+            self._psd_keys = {}
+            self._psd_fingerprints = {}
+
+            # Identifies the filters, for the keys of the overlap cache
+            desc = [[int(f.params.template_hash) for f in self.filters],
+                    str(approximant), repr(float(f_low)),
+                    repr(float(delta_f)), int(flen), numpy.dtype(cdtype).str]
+            desc += [(k, repr(kwds[k])) for k in sorted(kwds.keys())]
+            self.filters_key = hashlib.sha1(repr(desc)).hexdigest()
         else:
             self.do = False
 
@@ -203,11 +363,62 @@ class SingleDetBankVeto(object):
             self._segment_snrs_cache[key] = data
         return self._segment_snrs_cache[key]
 
+    def psd_key(self, psd):
+        """ Return the key identifying the overlaps made with a PSD.
+
+        This is the key of an earlier PSD if one lies within psd_distance.
+        """
+        if id(psd) in self._psd_keys:
+            return self._psd_keys[id(psd)]
+
+        kmin = int(self.f_low / self.delta_f)
+        data = numpy.array(psd.numpy()[kmin:self.seg_len_freq])
+        key = hashlib.sha1(data.tostring()).hexdigest()
+
+        if self.psd_distance > 0:
+            fingerprint = psd_fingerprint(psd, kmin, self.seg_len_freq)
+            known = self._psd_fingerprints
+            if self.overlap_cache is not None:
+                known = self.overlap_cache.fingerprints()
+
+            nearest = None
+            for other, other_fingerprint in known.items():
+                if len(other_fingerprint) != len(fingerprint):
+                    continue
+                distance = psd_distance(fingerprint, other_fingerprint)
+                if distance <= self.psd_distance and \
+                        (nearest is None or distance < nearest[1]):
+                    nearest = other, distance
+
+            if nearest is not None:
+                logging.info("Reusing bank veto overlaps of a PSD at "
+                             "distance %.3g", nearest[1])
+                key = nearest[0]
+            elif self.overlap_cache is not None:
+                self.overlap_cache.add_fingerprint(key, fingerprint)
+            else:
+                self._psd_fingerprints[key] = fingerprint
+
+        self._psd_keys[id(psd)] = key
+        return key
+
     def cache_overlaps(self, template, psd):
-        key = (id(template.params), id(psd))
+        psd_key = self.psd_key(psd)
+        key = (id(template.params), psd_key)
         if key not in self._overlaps_cache:
-            logging.info("...Calculate bank veto overlaps")
-            o = template_overlaps(self.filters, template, psd, self.f_low)
+            o = None
+            if self.overlap_cache is not None:
+                cache_key = self.overlap_cache.key(
+                    template.params.template_hash, psd_key, self.filters_key,
+                    approximant=str(template.approximant),
+                    f_lower=float(template.f_lower), length=len(template))
+                o = self.overlap_cache.get(cache_key)
+
+            if o is None:
+                logging.info("...Calculate bank veto overlaps")
+                o = template_overlaps(self.filters, template, psd, self.f_low)
+                if self.overlap_cache is not None:
+                    self.overlap_cache.put(cache_key, o)
             self._overlaps_cache[key] = o
         return self._overlaps_cache[key]
 
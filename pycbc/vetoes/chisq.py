@@ -21,9 +21,10 @@
 #
 # =============================================================================
 #
-import numpy, logging, math, pycbc.fft
+import numpy, logging, math, time, pycbc.fft
 
 from pycbc.types import zeros, real_same_precision_as, TimeSeries, complex_same_precision_as
+from pycbc.types import Array, complex64
 from pycbc.filter import sigmasq_series, make_frequency_series, matched_filter_core, get_cutoff_indices
 from pycbc.scheme import schemed
 import pycbc.pnutils
@@ -216,6 +217,151 @@ def power_chisq_from_precomputed(corr, snr, snr_norm, bins, indices=None, return
     else:
         return chisq
 
+def power_chisq_at_points_from_ifft(corr, snr, snr_norm, bins, indices):
+    """Calculate the chisq values for only selected points by inverse FFT.
+
+    This function does an inverse FFT of each bin, as
+    `power_chisq_from_precomputed`, but needs only the snr at the selected
+    points. Its cost does not depend on the number of points, so it is
+    cheaper than `power_chisq_at_points_from_precomputed` when there are
+    many points.
+
+    Parameters
+    ----------
+    corr: FrequencySeries
+        The product of the template and data in the frequency domain.
+    snr: numpy.ndarray
+        The unnormalized array of snr values at only the selected points in `indices`.
+    snr_norm: float
+        The snr normalization factor
+    bins: List of integers
+        The edges of the equal power bins
+    indices: Array
+        The indices where we will calculate the chisq. These must be relative
+        to the given `corr` series.
+
+    Returns
+    -------
+    chisq: Array
+        An array containing only the chisq at the selected points.
+    """
+    global _q_l, _qtilde_l
+
+    if _q_l is None or len(_q_l) != len(corr):
+        _q_l = zeros(len(corr), dtype=complex_same_precision_as(corr))
+        _qtilde_l = zeros(len(corr), dtype=complex_same_precision_as(corr))
+    q = _q_l
+    qtilde = _qtilde_l
+
+    chisq = zeros(len(indices), dtype=real_same_precision_as(corr))
+    num_bins = len(bins) - 1
+
+    for j in range(num_bins):
+        k_min = int(bins[j])
+        k_max = int(bins[j+1])
+
+        qtilde[k_min:k_max] = corr[k_min:k_max]
+        pycbc.fft.ifft(qtilde, q)
+        qtilde[k_min:k_max].clear()
+        chisq_accum_bin(chisq, q.take(indices))
+
+    snr = numpy.array(snr, copy=False)
+    return (chisq.numpy() * num_bins - (snr.conj() * snr).real) * \
+           (snr_norm ** 2.0)
+
+_batch_q_l = None
+_batch_qtilde_l = None
+_batch_ifft_l = {}
+def power_chisq_at_points_batch(corrs, snrs, snr_norms, bins, indices):
+    """Calculate the chisq at selected points for a batch of templates.
+
+    Each bin of every template is transformed with one batched inverse FFT,
+    and the chisq of every point of every template is then accumulated
+    at once. All the templates must have the same number of bins, but
+    the bin edges may differ between templates.
+
+    Parameters
+    ----------
+    corrs: list of FrequencySeries
+        The product of each template and the data in the frequency domain.
+        These must all have the same length and type.
+    snrs: list of numpy.ndarray
+        The unnormalized snr of each template at only the selected points.
+    snr_norms: list of floats
+        The snr normalization factor of each template.
+    bins: list of lists of integers
+        The edges of the equal power bins of each template.
+    indices: list of Arrays
+        The indices where we will calculate the chisq of each template.
+        These must be relative to the corresponding `corrs` series.
+
+    Returns
+    -------
+    chisq: list of numpy.ndarray
+        For each template, the chisq at its selected points.
+    """
+    global _batch_q_l, _batch_qtilde_l, _batch_ifft_l
+
+    num = len(corrs)
+    tlen = len(corrs[0])
+    dtype = complex_same_precision_as(corrs[0])
+    num_bins = len(bins[0]) - 1
+    if any(len(b) - 1 != num_bins for b in bins):
+        raise ValueError("The templates of a batch must have the same "
+                         "number of chisq bins")
+
+    # The buffers only grow, so that they are allocated once for the
+    # largest batch, and the plans of each batch size are kept. The size of
+    # a batch changes from call to call with the templates that pass the
+    # threshold, and planning again each time would be expensive.
+    if _batch_q_l is None or len(_batch_q_l) < num * tlen or \
+                                                _batch_q_l.dtype != dtype:
+        if _batch_q_l is None or _batch_q_l.dtype != dtype:
+            size = num * tlen
+        else:
+            size = max(num * tlen, len(_batch_q_l))
+        _batch_q_l = zeros(size, dtype=dtype)
+        _batch_qtilde_l = zeros(size, dtype=dtype)
+        _batch_ifft_l = {}
+    key = (num, tlen, dtype)
+    if key not in _batch_ifft_l:
+        _batch_ifft_l[key] = pycbc.fft.IFFT(_batch_qtilde_l[0:num * tlen],
+                                            _batch_q_l[0:num * tlen],
+                                            nbatch=num, size=tlen)
+    ifft = _batch_ifft_l[key]
+    qtilde = _batch_qtilde_l.numpy()[0:num * tlen].reshape(num, tlen)
+    q = _batch_q_l.numpy()
+
+    # Templates which share their bin edges are copied and cleared together
+    layouts = {}
+    for row, edges in enumerate(bins):
+        layouts.setdefault(tuple(int(k) for k in edges), []).append(row)
+
+    # Offsets into the flattened batch of the points of every template
+    counts = [len(i) for i in indices]
+    points = numpy.concatenate([numpy.array(i, dtype=numpy.int64) + row * tlen
+                                for row, i in enumerate(indices)])
+    chisq = numpy.zeros(len(points), dtype=real_same_precision_as(corrs[0]))
+
+    for j in range(num_bins):
+        for edges, rows in layouts.items():
+            k_min, k_max = edges[j], edges[j + 1]
+            for row in rows:
+                qtilde[row, k_min:k_max] = corrs[row].data[k_min:k_max]
+        ifft.execute()
+        for edges, rows in layouts.items():
+            qtilde[rows, edges[j]:edges[j + 1]] = 0
+
+        values = q.take(points)
+        chisq += values.real ** 2.0 + values.imag ** 2.0
+
+    results = []
+    for i, part in enumerate(numpy.split(chisq, numpy.cumsum(counts)[:-1])):
+        snr = numpy.array(snrs[i], copy=False)
+        results.append((part * num_bins - (snr.conj() * snr).real) *
+                       (snr_norms[i] ** 2.0))
+    return results
+
 def fastest_power_chisq_at_points(corr, snr, snrv, snr_norm, bins, indices):
     """Calculate the chisq values for only selected points.
 
@@ -299,8 +445,25 @@ def power_chisq(template, data, num_bins, psd,
 class SingleDetPowerChisq(object):
     """Class that handles precomputation and memory management for efficiently
     running the power chisq in a single detector inspiral analysis.
+
+    The chisq at the triggers of a template can be found either by time
+    shifting and summing the bins at each trigger ('points'), at a cost
+    which grows with the number of triggers and the number of frequency
+    samples in the bins, or by an inverse FFT of each bin ('ifft'), at a
+    cost which grows with the number of bins and the segment length. With
+    method 'auto' the cost of each is measured once for each segment
+    length, and the cheaper is chosen for each template.
+
+    Batches of templates filtered against the same segment may be given to
+    `values_batch`, which finds the chisq of the templates using the 'ifft'
+    method with one batched inverse FFT per bin. Templates whose bin edges
+    all lie within `bin_tolerance` frequency samples of those of an earlier
+    template in the batch then use the bins of that template.
     """
-    def __init__(self, num_bins=0, snr_threshold=None):
+    methods = ['auto', 'points', 'ifft']
+
+    def __init__(self, num_bins=0, snr_threshold=None, method='points',
+                 bin_tolerance=0):
         if not (num_bins == "0" or num_bins == 0):
             self.do = True
             self.column_name = "chisq"
@@ -310,6 +473,99 @@ class SingleDetPowerChisq(object):
             self.do = False
         self.snr_threshold = snr_threshold
 
+        if method not in self.methods:
+            raise ValueError("Unknown power chisq method %s" % method)
+        self.method = method
+        self.method_counts = dict((m, 0) for m in self.methods[1:])
+        self.costs = {}
+        self.bin_tolerance = bin_tolerance
+
+    def calibrate(self, tlen, dtype=complex64, num_points=64, num_bins=4,
+                  repeat=3, seed=0):
+        """ Measure the cost of each method of finding the chisq.
+
+        Parameters
+        ----------
+        tlen: int
+            The length of the correlation vector, i.e. of the snr time series.
+        dtype: {complex64, numpy.dtype}
+            The type of the correlation vector.
+        num_points: {64, int}
+            The number of points at which to time the 'points' method.
+        num_bins: {4, int}
+            The number of bins with which to time the 'ifft' method.
+        repeat: {3, int}
+            The number of timings of each method, of which the fastest is
+            kept.
+        seed: {0, int}
+            The seed of the noise which is timed. The global random state is
+            not used, so that the rest of the job is not affected.
+
+        Returns
+        -------
+        point_cost: float
+            The time in seconds for each point and frequency sample taken
+            by the 'points' method.
+        ifft_cost: float
+            The time in seconds for each bin taken by the 'ifft' method.
+        """
+        flen = tlen / 2 + 1
+        data = numpy.zeros(tlen, dtype=numpy.complex128)
+        rng = numpy.random.RandomState(seed)
+        data[0:flen] = rng.normal(size=flen) + 1.0j * rng.normal(size=flen)
+        corr = Array(data, dtype=dtype)
+        bins = numpy.linspace(0, flen, num_bins + 1).astype(numpy.int64)
+        indices = numpy.arange(num_points) * (tlen / num_points)
+        snr = numpy.zeros(num_points, dtype=numpy.complex64)
+
+        # The first call of each compiles code or plans the FFT
+        timings = {'points': [], 'ifft': []}
+        for i in range(repeat + 1):
+            for method, func in [('points',
+                                  power_chisq_at_points_from_precomputed),
+                                 ('ifft', power_chisq_at_points_from_ifft)]:
+                start = time.time()
+                func(corr, snr, 1.0, bins, indices)
+                if i > 0:
+                    timings[method].append(time.time() - start)
+
+        point_cost = min(timings['points']) / (num_points * flen)
+        ifft_cost = min(timings['ifft']) / num_bins
+        logging.info('Power chisq costs for length %s: %.3g s per point and '
+                     'frequency sample, %.3g s per bin', tlen, point_cost,
+                     ifft_cost)
+        self.costs[tlen] = point_cost, ifft_cost
+        return point_cost, ifft_cost
+
+    def choose_method(self, tlen, num_points, bins):
+        """ Choose how to find the chisq at a number of points.
+
+        Parameters
+        ----------
+        tlen: int
+            The length of the correlation vector.
+        num_points: int
+            The number of points at which to find the chisq.
+        bins: List of integers
+            The edges of the chisq bins.
+
+        Returns
+        -------
+        method: str
+            Either 'points' or 'ifft'. Unless this instance was made with
+            method 'auto', this is the method it was made with.
+        """
+        if self.method != 'auto':
+            return self.method
+
+        if tlen not in self.costs:
+            self.calibrate(tlen)
+        point_cost, ifft_cost = self.costs[tlen]
+
+        points = point_cost * num_points * (bins[-1] - bins[0])
+        ifft = ifft_cost * (len(bins) - 1)
+        return 'points' if points <= ifft else 'ifft'
+
     @staticmethod
     def parse_option(row, arg):
         safe_dict = {}
@@ -375,7 +631,13 @@ class SingleDetPowerChisq(object):
             if num_above > 0:
                 bins = self.cached_chisq_bins(template, psd)
                 dof = (len(bins) - 1) * 2 - 2
-                chisq = power_chisq_at_points_from_precomputed(corr,
+                method = self.choose_method(len(corr), num_above, bins)
+                self.method_counts[method] += 1
+                if method == 'points':
+                    chisq = power_chisq_at_points_from_precomputed(corr,
+                                     above_snrv, snr_norm, bins, above_indices)
+                else:
+                    chisq = power_chisq_at_points_from_ifft(corr,
                                      above_snrv, snr_norm, bins, above_indices)
 
             if self.snr_threshold:
@@ -388,6 +650,88 @@ class SingleDetPowerChisq(object):
         else:
             return None, None
 
+    def values_batch(self, corrs, snrvs, snr_norms, psd, indices, templates):
+        """ Calculate the chisq at points given by indices for a batch of
+        templates filtered against the same data.
+
+        Parameters
+        ----------
+        corrs: list of FrequencySeries
+            The correlation of each template with the data.
+        snrvs: list of numpy.ndarray
+            The unnormalized snr of each template at its points.
+        snr_norms: list of floats
+            The snr normalization factor of each template.
+        psd: FrequencySeries
+            The psd of the data.
+        indices: list of Arrays
+            The indices of the points of each template.
+        templates: list of FrequencySeries
+            The templates.
+
+        Returns
+        -------
+        values: list
+            For each template, the tuple (chisq, chisq_dof) which `values`
+            would return.
+        """
+        if not self.do:
+            return [(None, None)] * len(templates)
+
+        logging.info("...Doing power chisq for a batch of %s templates",
+                     len(templates))
+
+        chisqs = [None] * len(templates)
+        dofs = [-100] * len(templates)
+        aboves = [None] * len(templates)
+        batches = {}
+        for i, (corr, snrv, snr_norm, idx, template) in \
+                enumerate(zip(corrs, snrvs, snr_norms, indices, templates)):
+            if self.snr_threshold:
+                above = abs(snrv * snr_norm) > self.snr_threshold
+                aboves[i] = above
+                snrv = snrv[above]
+                idx = idx[above]
+            if len(idx) == 0:
+                continue
+
+            bins = self.cached_chisq_bins(template, psd)
+            dofs[i] = (len(bins) - 1) * 2 - 2
+            method = self.choose_method(len(corr), len(idx), bins)
+            if method == 'points':
+                self.method_counts['points'] += 1
+                chisqs[i] = power_chisq_at_points_from_precomputed(corr,
+                                                snrv, snr_norm, bins, idx)
+                continue
+
+            # Share the bins of an earlier template of the batch if they
+            # are close enough
+            self.method_counts['ifft'] += 1
+            layouts = batches.setdefault((len(bins), len(corr)), [])
+            for shared in set(tuple(l[3]) for l in layouts):
+                if numpy.abs(numpy.array(shared) - bins).max() <= \
+                                                        self.bin_tolerance:
+                    bins = shared
+                    break
+            layouts.append((i, corr, snrv, bins, idx, snr_norm))
+
+        for rows in batches.values():
+            i, corr, snrv, bins, idx, snr_norm = zip(*rows)
+            chisq = power_chisq_at_points_batch(corr, snrv, snr_norm,
+                                                bins, idx)
+            for row, values in zip(i, chisq):
+                chisqs[row] = values
+
+        results = []
+        for chisq, dof, above, idx in zip(chisqs, dofs, aboves, indices):
+            if above is not None:
+                rchisq = numpy.zeros(len(idx), dtype=numpy.float32)
+                if chisq is not None:
+                    rchisq[above] = chisq
+                chisq = rchisq
+            results.append((chisq, numpy.repeat(dof, len(idx))))
+        return results
+
 class SingleDetSkyMaxPowerChisq(SingleDetPowerChisq):
     """Class that handles precomputation and memory management for efficiently
     running the power chisq in a single detector inspiral analysis when
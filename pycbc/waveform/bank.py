@@ -29,6 +29,9 @@ import types
 import numpy
 import logging
 import os.path
+import json
+import hashlib
+import tempfile
 import h5py
 from copy import copy
 import numpy as np
@@ -36,8 +39,9 @@ from glue.ligolw import ligolw, table, lsctables, utils as ligolw_utils
 import pycbc.waveform
 import pycbc.pnutils
 import pycbc.waveform.compress
+import pycbc.waveform.spa_tmplt
 from pycbc import DYN_RANGE_FAC
-from pycbc.types import zeros
+from pycbc.types import zeros, Array, FrequencySeries
 import pycbc.io
 
 def sigma_cached(self, psd):
@@ -85,6 +89,206 @@ def sigma_cached(self, psd):
             self._sigmasq[key] = self.sigma_view.inner(psd.invsqrt)
     return self._sigmasq[key]
 
+class TemplateCache(object):
+    """Store of generated frequency-domain templates on disk.
+
+    Each template is stored under a key describing how it was generated, as
+    a .npy file holding only the non-zero band of the template and a small
+    json file of metadata. The directory may be shared between any number
+    of jobs; files are written atomically so concurrent writers are safe.
+    Stored templates are read back by memory map.
+
+    Parameters
+    ----------
+    directory : string
+        The directory holding the cache. It is created if it does not exist.
+    """
+    # Increment when the stored format or generation conventions change
+    version = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    @classmethod
+    def key(cls, template_hash, approximant, delta_f, f_lower, length, dtype,
+            **kwds):
+        """Return the key under which a template is stored.
+
+        Parameters
+        ----------
+        template_hash : int
+            The hash identifying the template parameters.
+        approximant : string
+            The approximant used to generate the template.
+        delta_f : float
+            The frequency step of the template.
+        f_lower : float
+            The starting frequency of the template.
+        length : int
+            The length of the frequency series.
+        dtype : numpy.dtype
+            The data type of the stored template.
+        \**kwds :
+            Any other arguments that change the generated template.
+
+        Returns
+        -------
+        key : string
+            A hex digest uniquely describing the template.
+        """
+        desc = [cls.version, int(template_hash), str(approximant),
+                repr(float(delta_f)), repr(float(f_lower)), int(length),
+                numpy.dtype(dtype).str]
+        desc += [(k, repr(kwds[k])) for k in sorted(kwds.keys())]
+        return hashlib.sha1(repr(desc)).hexdigest()
+
+    def _paths(self, key):
+        subdir = os.path.join(self.directory, key[0:2])
+        base = os.path.join(subdir, key)
+        return subdir, base + '.npy', base + '.json'
+
+    def get(self, key, out, delta_f):
+        """Read the template stored under key into the memory given by out.
+
+        Parameters
+        ----------
+        key : string
+            The key returned by `key`.
+        out : Array
+            Memory to write the template into. It is zeroed outside of the
+            stored band.
+        delta_f : float
+            The frequency step of the template.
+
+        Returns
+        -------
+        htilde : {None, FrequencySeries}
+            The template, using the memory of out, with its `chirp_length`
+            and `length_in_time` restored. None if the key is not stored.
+        """
+        _, dpath, mpath = self._paths(key)
+        try:
+            with open(mpath, 'r') as mfile:
+                meta = json.load(mfile)
+            band = numpy.load(dpath, mmap_mode='r')
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+
+        start = meta['start']
+        if start + len(band) > len(out):
+            self.misses += 1
+            return None
+
+        out.clear()
+        if len(band):
+            out[start:start + len(band)] = Array(band, dtype=out.dtype)
+        self.hits += 1
+
+        htilde = FrequencySeries(out, delta_f=delta_f, epoch=meta['epoch'],
+                                 copy=False)
+        htilde.chirp_length = meta['chirp_length']
+        htilde.length_in_time = meta['length_in_time']
+        return htilde
+
+    def put(self, key, htilde):
+        """Store a generated template under key.
+
+        Parameters
+        ----------
+        key : string
+            The key returned by `key`.
+        htilde : FrequencySeries
+            The template to store. Its `chirp_length` and `length_in_time`
+            attributes are stored too, if present.
+        """
+        data = htilde.numpy()
+        nonzero = numpy.flatnonzero(data)
+        if len(nonzero):
+            start, stop = nonzero[0], nonzero[-1] + 1
+        else:
+            start = stop = 0
+
+        def optional_float(name):
+            value = getattr(htilde, name, None)
+            return None if value is None else float(value)
+
+        epoch = htilde.get_epoch()
+        meta = {'start': int(start),
+                'epoch': None if epoch is None else float(epoch),
+                'chirp_length': optional_float('chirp_length'),
+                'length_in_time': optional_float('length_in_time')}
+
+        subdir, dpath, mpath = self._paths(key)
+        try:
+            os.makedirs(subdir)
+        except OSError:
+            if not os.path.isdir(subdir):
+                raise
+
+        # Write to temporary files and rename into place, the metadata last,
+        # so readers never see a partially written template
+        fd, tmp = tempfile.mkstemp(dir=subdir, suffix='.npy')
+        with os.fdopen(fd, 'wb') as dfile:
+            numpy.save(dfile, numpy.array(data[start:stop]))
+        os.rename(tmp, dpath)
+
+        fd, tmp = tempfile.mkstemp(dir=subdir, suffix='.json')
+        with os.fdopen(fd, 'w') as mfile:
+            json.dump(meta, mfile)
+        os.rename(tmp, mpath)
+
+def add_template_cache_arg(parser):
+    """Add an argument for an on-disk template cache to the given parser.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        The parser to add the argument to.
+    """
+    parser.add_argument("--template-cache-dir", metavar="DIR", default=None,
+                        help="Directory of an on-disk cache of generated "
+                             "templates, shared between jobs. Templates "
+                             "found in the cache are read from it rather than "
+                             "generated, and newly generated templates are "
+                             "added to it. If not given, no cache is used.")
+
+def template_cache_from_cli(opt):
+    """Return the TemplateCache given on the command line, or None."""
+    if getattr(opt, 'template_cache_dir', None) is None:
+        return None
+    return TemplateCache(opt.template_cache_dir)
+
+def template_hash_from_params(params):
+    """Return the hash identifying a template from its parameters.
+
+    This is the same hash that `TemplateBank.ensure_hash` assigns when the
+    bank file does not provide one.
+
+    Parameters
+    ----------
+    params : object
+        Any object with the template parameters as attributes.
+
+    Returns
+    -------
+    template_hash : int
+    """
+    return hash(tuple([getattr(params, p) for p in _template_hash_fields
+                       if hasattr(params, p)]))
+
+# The fields to use in making a template hash
+_template_hash_fields = ['mass1', 'mass2', 'inclination',
+                         'spin1x', 'spin1y', 'spin1z',
+                         'spin2x', 'spin2y', 'spin2z',]
+
 # dummy class needed for loading LIGOLW files
 class LIGOLWContentHandler(ligolw.LIGOLWContentHandler):
     pass
@@ -331,12 +535,7 @@ class TemplateBank(object):
         if 'template_hash' in fields:
              return
 
-        # The fields to use in making a template hash
-        hash_fields = ['mass1', 'mass2', 'inclination',
-                       'spin1x', 'spin1y', 'spin1z',
-                       'spin2x', 'spin2y', 'spin2z',]
-
-        fields = [f for f in hash_fields if f in fields]
+        fields = [f for f in _template_hash_fields if f in fields]
         template_hash = numpy.array([hash(v) for v in zip(*[self.table[p]
                                     for p in fields])])
         self.table = self.table.add_fields(template_hash, 'template_hash')
@@ -496,9 +695,10 @@ class LiveFilterBank(TemplateBank):
     def __init__(self, filename, sample_rate, minimum_buffer,
                        approximant=None, increment=8, parameters=None,
                        load_compressed=True, load_compressed_now=False, 
-                       low_frequency_cutoff=None,
+                       low_frequency_cutoff=None, template_cache=None,
                        **kwds):
 
+        self.template_cache = template_cache
         self.increment = increment
         self.filename = filename
         self.sample_rate = sample_rate
@@ -582,13 +782,25 @@ class LiveFilterBank(TemplateBank):
         logging.info("Generating %s, %ss, %i, starting from %s Hz",
                      approximant, 1.0/delta_f, index, flow)
 
-        # Get the waveform filter
+        # Get the waveform filter, from the template cache if possible
         distance = 1.0 / DYN_RANGE_FAC
-        htilde = pycbc.waveform.get_waveform_filter(
-            zeros(flen, dtype=numpy.complex64), self.table[index],
-            approximant=approximant, f_lower=flow, f_final=f_end,
-            delta_f=delta_f, delta_t=1.0/self.sample_rate, distance=distance,
-            **self.extra_args)
+        out = zeros(flen, dtype=numpy.complex64)
+        htilde = None
+        if self.template_cache is not None:
+            key = self.template_cache.key(self.table[index].template_hash,
+                        approximant, delta_f, flow, flen, numpy.complex64,
+                        f_final=f_end, delta_t=1.0/self.sample_rate,
+                        **self.extra_args)
+            htilde = self.template_cache.get(key, out, delta_f)
+
+        if htilde is None:
+            htilde = pycbc.waveform.get_waveform_filter(
+                out, self.table[index],
+                approximant=approximant, f_lower=flow, f_final=f_end,
+                delta_f=delta_f, delta_t=1.0/self.sample_rate, distance=distance,
+                **self.extra_args)
+            if self.template_cache is not None:
+                self.template_cache.put(key, htilde)
 
         # If available, record the total duration (which may
         # include ringdown) and the duration up to merger since they will be
@@ -628,8 +840,10 @@ class FilterBank(TemplateBank):
                  load_compressed=True,
                  load_compressed_now=False,
                  low_frequency_cutoff=None,
+                 template_cache=None,
                  **kwds):
         self.out = out
+        self.template_cache = template_cache
         self.dtype = dtype
         self.f_lower = low_frequency_cutoff
         self.filename = filename
@@ -653,10 +867,44 @@ class FilterBank(TemplateBank):
             tempout = self.out
 
         approximant = self.approximant(index)
+        f_end = self._filter_end_frequency(index)
+        f_low = self._filter_start_frequency(index, approximant)
+
+        logging.info('%s: generating %s from %s Hz' % (index, approximant, f_low))
+
+        # Clear the storage memory
+        poke  = tempout.data
+        tempout.clear()
+
+        # Get the waveform filter, from the template cache if possible
+        distance = 1.0 / DYN_RANGE_FAC
+        htilde = None
+        if self.template_cache is not None:
+            key = self.template_cache.key(self.table[index].template_hash,
+                        approximant, self.delta_f, f_low, self.filter_length,
+                        self.dtype, f_final=f_end, delta_t=self.delta_t,
+                        **self.extra_args)
+            htilde = self.template_cache.get(key,
+                        tempout[0:self.filter_length], self.delta_f)
+
+        if htilde is None:
+            htilde = pycbc.waveform.get_waveform_filter(
+                tempout[0:self.filter_length], self.table[index],
+                approximant=approximant, f_lower=f_low, f_final=f_end,
+                delta_f=self.delta_f, delta_t=self.delta_t, distance=distance,
+                **self.extra_args)
+            if self.template_cache is not None:
+                self.template_cache.put(key, htilde)
+
+        return self._finalize_filter(index, htilde, approximant, f_low, f_end)
+
+    def _filter_end_frequency(self, index):
         f_end = self.end_frequency(index)
         if f_end is None or f_end >= (self.filter_length * self.delta_f):
             f_end = (self.filter_length-1) * self.delta_f
+        return f_end
 
+    def _filter_start_frequency(self, index, approximant):
         # Find the start frequency, if variable
         if self.f_lower is None:
             f_low = self.table[index].f_lower
@@ -667,21 +915,9 @@ class FilterBank(TemplateBank):
                                                   self.max_template_length)
         else:
             f_low = self.f_lower
+        return f_low
 
-        logging.info('%s: generating %s from %s Hz' % (index, approximant, f_low))
-
-        # Clear the storage memory
-        poke  = tempout.data
-        tempout.clear()
-
-        # Get the waveform filter
-        distance = 1.0 / DYN_RANGE_FAC
-        htilde = pycbc.waveform.get_waveform_filter(
-            tempout[0:self.filter_length], self.table[index],
-            approximant=approximant, f_lower=f_low, f_final=f_end,
-            delta_f=self.delta_f, delta_t=self.delta_t, distance=distance,
-            **self.extra_args)
-
+    def _finalize_filter(self, index, htilde, approximant, f_low, f_end):
         # If available, record the total duration (which may
         # include ringdown) and the duration up to merger since they will be
         # erased by the type conversion below.
@@ -708,6 +944,68 @@ class FilterBank(TemplateBank):
         htilde._sigmasq = {}
         return htilde
 
+    def get_batch(self, indices, out):
+        """ Return the filters for several templates at once
+
+        The filters are written to consecutive rows of out, each
+        filter_length long, as used by the batched filtering of
+        MatchedFilterControl. If every template uses the SPAtmplt
+        approximant, they are generated together in a single pass of the
+        batched SPA engine, otherwise each is generated as by indexing
+        the bank.
+
+        Parameters
+        ----------
+        indices : list of ints
+            The indices of the templates in the bank.
+        out : Array
+            Memory of at least len(indices) * filter_length to hold the
+            filters.
+
+        Returns
+        -------
+        htildes : list of FrequencySeries
+            The filters, in the same order as indices.
+        """
+        flen = self.filter_length
+        approximants = [self.approximant(index) for index in indices]
+        if self.template_cache is not None or self.dtype != numpy.complex64 \
+                or any(a != 'SPAtmplt' for a in approximants):
+            htildes = []
+            self_out = self.out
+            for i, index in enumerate(indices):
+                self.out = out[i * flen:(i + 1) * flen]
+                htildes.append(self[index])
+            self.out = self_out
+            return htildes
+
+        f_ends = [self._filter_end_frequency(index) for index in indices]
+        f_lows = [self._filter_start_frequency(index, approximant)
+                  for index, approximant in zip(indices, approximants)]
+        logging.info('%s-%s: generating %s SPAtmplt templates',
+                     indices[0], indices[-1], len(indices))
+
+        tmplts = self.table[numpy.array(indices)]
+        htildes = pycbc.waveform.spa_tmplt.spa_tmplt_batch(
+            tmplts.mass1, tmplts.mass2, getattr(tmplts, 'spin1z', 0),
+            getattr(tmplts, 'spin2z', 0),
+            numpy.array(f_lows), self.delta_f, flen,
+            distance=1.0 / DYN_RANGE_FAC,
+            phase_order=int(self.extra_args.get('phase_order', -1)),
+            spin_order=int(self.extra_args.get('spin_order', -1)),
+            out=out)
+
+        for index, htilde, f_low in zip(indices, htildes, f_lows):
+            htilde.chirp_length = \
+                pycbc.waveform.get_waveform_filter_length_in_time(
+                    'SPAtmplt', self.table[index], f_lower=f_low,
+                    delta_f=self.delta_f, **self.extra_args)
+            htilde.length_in_time = htilde.chirp_length
+
+        return [self._finalize_filter(index, htilde, approximant, f_low, f_end)
+                for index, htilde, approximant, f_low, f_end
+                in zip(indices, htildes, approximants, f_lows, f_ends)]
+
 def find_variable_start_frequency(approximant, parameters, f_start, max_length,
                                   delta_f = 1):
     """ Find a frequency value above the starting frequency that results in a
@@ -152,28 +152,22 @@ def spa_tmplt_engine(htilde, kmin, phase_order, delta_f, piM, pfaN,
     """ Calculate the spa tmplt phase
     """
 
-def spa_tmplt(**kwds):
-    """ Generate a minimal TaylorF2 approximant with optimations for the sin/cos
+@schemed("pycbc.waveform.spa_tmplt_")
+def spa_tmplt_batch_engine(htilde, kmin, kmax, length, phase_order, delta_f,
+                           piM, pfa, amp_factor):
+    """ Calculate the spa tmplt phase for a block of templates
     """
-    # Pull out the input arguments
-    f_lower = kwds['f_lower']
-    delta_f = kwds['delta_f']
-    distance = kwds['distance']
-    mass1 = kwds['mass1']
-    mass2 = kwds['mass2']
-    s1z = kwds['spin1z']
-    s2z = kwds['spin2z']
-    phase_order = int(kwds['phase_order'])
-    amplitude_order = int(kwds['amplitude_order'])
-    spin_order = int(kwds['spin_order'])
 
-    if 'out' in kwds:
-        out = kwds['out']
-    else:
-        out = None
-
-    amp_factor = spa_amplitude_factor(mass1=mass1, mass2=mass2) / distance
+def spa_tmplt_coefficients(mass1, mass2, s1z, s2z, phase_order=-1,
+                           spin_order=-1):
+    """ Return the normalized TaylorF2 phasing coefficients
 
+    Returns
+    -------
+    pfa : tuple
+        The coefficients (pfaN, pfa2, pfa3, pfa4, pfa5, pfl5, pfa6, pfl6,
+        pfa7), all but pfaN normalized by pfaN.
+    """
     lal_pars = lal.CreateDict()
     if phase_order != -1:
         lalsimulation.SimInspiralWaveformParamsInsertPNPhaseOrder(
@@ -199,6 +193,33 @@ def spa_tmplt(**kwds):
     
     pfl5 = phasing.vlogv[5] / pfaN
     pfl6 = phasing.vlogv[6] / pfaN
+    return pfaN, pfa2, pfa3, pfa4, pfa5, pfl5, pfa6, pfl6, pfa7
+
+def spa_tmplt(**kwds):
+    """ Generate a minimal TaylorF2 approximant with optimations for the sin/cos
+    """
+    # Pull out the input arguments
+    f_lower = kwds['f_lower']
+    delta_f = kwds['delta_f']
+    distance = kwds['distance']
+    mass1 = kwds['mass1']
+    mass2 = kwds['mass2']
+    s1z = kwds['spin1z']
+    s2z = kwds['spin2z']
+    phase_order = int(kwds['phase_order'])
+    amplitude_order = int(kwds['amplitude_order'])
+    spin_order = int(kwds['spin_order'])
+
+    if 'out' in kwds:
+        out = kwds['out']
+    else:
+        out = None
+
+    amp_factor = spa_amplitude_factor(mass1=mass1, mass2=mass2) / distance
+
+    pfaN, pfa2, pfa3, pfa4, pfa5, pfl5, pfa6, pfl6, pfa7 = \
+        spa_tmplt_coefficients(mass1, mass2, s1z, s2z,
+                               phase_order=phase_order, spin_order=spin_order)
 
     piM = lal.PI * (mass1 + mass2) * lal.MTSUN_SI
 
@@ -226,3 +247,82 @@ def spa_tmplt(**kwds):
                      pfa6, pfl6, pfa7, amp_factor)
     return htilde
 
+def spa_tmplt_batch(mass1, mass2, spin1z, spin2z, f_lower, delta_f, length,
+                    distance=1.0, phase_order=-1, spin_order=-1, out=None):
+    """ Generate a block of minimal TaylorF2 templates in a single pass
+
+    The templates are written to consecutive rows of a single block of
+    memory, sharing the amplitude, cube root and logarithm tables over the
+    frequency grid. With out set to the `batch_template_mem` of a
+    MatchedFilterControl, the templates are generated directly into the
+    rows used by batched filtering.
+
+    Parameters
+    ----------
+    mass1 : array
+        The mass of the first component of each template in solar masses.
+    mass2 : array
+        The mass of the second component of each template in solar masses.
+    spin1z : array
+        The aligned spin of the first component of each template.
+    spin2z : array
+        The aligned spin of the second component of each template.
+    f_lower : {float, array}
+        The starting frequency of the templates.
+    delta_f : float
+        The frequency step of the templates.
+    length : int
+        The length of each template row.
+    distance : {1.0, float}
+        The distance of the templates in Mpc.
+    phase_order : {-1, int}
+        The PN phase order, -1 for the highest available.
+    spin_order : {-1, int}
+        The PN spin order, -1 for the highest available.
+    out : {None, Array}
+        complex64 memory of at least len(mass1) * length to write the
+        templates into. If None, new memory is allocated.
+
+    Returns
+    -------
+    htildes : list of FrequencySeries
+        One template for each set of parameters, each a view of its row of
+        the output memory.
+    """
+    mass1 = numpy.array(mass1, ndmin=1, dtype=numpy.float64)
+    mass2 = numpy.array(mass2, ndmin=1, dtype=numpy.float64)
+    num = len(mass1)
+    spin1z = numpy.zeros(num) + spin1z
+    spin2z = numpy.zeros(num) + spin2z
+    f_lower = numpy.zeros(num) + f_lower
+    length = int(length)
+
+    if out is None:
+        out = zeros(num * length, dtype=complex64)
+    else:
+        if len(out) < num * length:
+            raise ValueError("Output is too short for %s templates of "
+                             "length %s" % (num, length))
+        if out.dtype != complex64:
+            raise TypeError("Output array is the wrong dtype")
+    out[0:num * length].clear()
+
+    amp_factor = spa_amplitude_factor(mass1=mass1, mass2=mass2) / distance
+    pfa = numpy.array([spa_tmplt_coefficients(m1, m2, s1, s2,
+                                              phase_order=phase_order,
+                                              spin_order=spin_order)
+                       for m1, m2, s1, s2 in zip(mass1, mass2, spin1z, spin2z)],
+                      dtype=numpy.float64, ndmin=2)
+
+    piM = lal.PI * (mass1 + mass2) * lal.MTSUN_SI
+    kmin = (f_lower / float(delta_f)).astype(numpy.int32)
+    vISCO = 1. / sqrt(6.)
+    fISCO = vISCO * vISCO * vISCO / piM
+    kmax = numpy.minimum((fISCO / delta_f).astype(numpy.int64), length)
+    kmax = numpy.maximum(kmax, kmin).astype(numpy.int32)
+
+    spa_tmplt_batch_engine(out, kmin, kmax, length, int(phase_order), delta_f,
+                           piM, pfa, amp_factor.astype(numpy.float64))
+
+    return [FrequencySeries(out[i * length:(i + 1) * length], delta_f=delta_f,
+                            copy=False) for i in range(num)]
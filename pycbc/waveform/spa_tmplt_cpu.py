@@ -24,83 +24,15 @@ from scipy.weave import inline
 support = """
     #include <stdio.h>
     #include <math.h>
-"""
-
-if pycbc.HAVE_OMP:
-    omp_libs = ['gomp']
-    omp_flags = ['-fopenmp']
-else:
-    omp_libs = []
-    omp_flags = []
-
-# Precompute cbrt(f) ###########################################################
-
-def cbrt_lookup(vmax, delta):
-    vec = numpy.arange(0, vmax*1.2, delta)
-    return FrequencySeries(vec**(1.0/3.0), delta_f=delta).astype(float32)
-    
-_cbrt_vec = None
-    
-def get_cbrt(vmax, delta):
-    global _cbrt_vec
-    if _cbrt_vec is None or (_cbrt_vec.delta_f != delta) or (len(_cbrt_vec) < int(vmax/delta)):
-        _cbrt_vec = cbrt_lookup(vmax, delta)
-    return _cbrt_vec   
-    
-# Precompute log(v) ############################################################
-    
-def logv_lookup(vmax, delta):
-    vec = numpy.arange(0, vmax*1.2, delta)
-    vec[1:len(vec)] = numpy.log(vec[1:len(vec)])
-    return FrequencySeries(vec, delta_f=delta).astype(float32)
-    
-_logv_vec = None
-    
-def get_log(vmax, delta):
-    global _logv_vec
-    if _logv_vec is None or (_logv_vec.delta_f != delta) or (len(_logv_vec) < int(vmax/delta)):
-        _logv_vec = logv_lookup(vmax, delta)
-    return _logv_vec   
 
-# Precompute the sine function #################################################
-def sin_cos_lookup():
-    vec = numpy.arange(0, lal.TWOPI*3, lal.TWOPI/10000)
-    return Array(numpy.sin(vec)).astype(float32)
-sin_cos = Array([], dtype=float32)
-
-def spa_tmplt_engine(htilde,  kmin,  phase_order, delta_f, piM,  pfaN, 
-                    pfa2,  pfa3,  pfa4,  pfa5,  pfl5,
-                    pfa6,  pfl6,  pfa7, amp_factor):
-    """ Calculate the spa tmplt phase 
-    """
-    kfac = numpy.array(spa_tmplt_precondition(len(htilde), delta_f, kmin).data, copy=False)
-    htilde = numpy.array(htilde.data, copy=False)
-    cbrt_vec = numpy.array(get_cbrt(len(htilde)*delta_f + kmin, delta_f).data, copy=False)
-    logv_vec = numpy.array(get_log(len(htilde)*delta_f + kmin, delta_f).data, copy=False)
-    length = len(htilde)
-    
-    code = """ 
-    float piM13 = cbrtf(piM);
-    float logpiM13 = log(piM13);
-    float log4 = log(4.);
-    const float _pfaN=pfaN;
-    const float _pfa2=pfa2;
-    const float _pfa3=pfa3;
-    const float _pfa4=pfa4;
-    const float _pfa5=pfa5;
-    const float _pfl5=pfl5;
-    const float _pfa6=pfa6;
-    const float _pfl6=pfl6;
-    const float _pfa7=pfa7;
-    const float ampc = amp_factor;
-    const float two_pi = 2 * M_PI;
-    const float inv_two_pi = 1 / (2 * M_PI);
-    
-    #pragma omp parallel for schedule(dynamic, 1024)
-    for (unsigned int i=0; i<length; i++){
-        int index = i + kmin;
-        const float v =  piM13 * cbrt_vec[index];
-        const float logv = logv_vec[index] * 1.0/3.0 + logpiM13;
+    // Compute a single sample of the spa template from the PN parameter v,
+    // its log, and the normalized phasing coefficients held in pfa as
+    // (pfaN, pfa2, pfa3, pfa4, pfa5, pfl5, pfa6, pfl6, pfa7).
+    static inline std::complex<float> spa_tmplt_point(const float v,
+                        const float logv, const int phase_order,
+                        const float* pfa, const float amp){
+        const float log4 = log(4.);
+        const float two_pi = 2 * M_PI;
         const float v5 = v * v * v * v * v;
         float phasing = 0;
         float sinp, cosp;
@@ -109,25 +41,24 @@ def spa_tmplt_engine(htilde,  kmin,  phase_order, delta_f, piM,  pfaN,
         {   
             case -1:
             case 7:
-                phasing = _pfa7 * v;
+                phasing = pfa[8] * v;
             case 6:
-                phasing = (phasing + _pfa6 + _pfl6 * (logv + log4) ) * v;
+                phasing = (phasing + pfa[6] + pfa[7] * (logv + log4) ) * v;
             case 5:
-                phasing = (phasing + _pfa5 + _pfl5 * (logv) ) * v;
+                phasing = (phasing + pfa[4] + pfa[5] * (logv) ) * v;
             case 4:
-                phasing = (phasing + _pfa4) * v;
+                phasing = (phasing + pfa[3]) * v;
             case 3:
-                phasing = (phasing + _pfa3) * v;
+                phasing = (phasing + pfa[2]) * v;
             case 2:
-                phasing = (phasing + _pfa2) * v * v;
+                phasing = (phasing + pfa[1]) * v * v;
             case 0:
                 phasing += 1.;
                 break;
             default:
                 break;
         }
-        float amp = ampc * kfac[i];
-        phasing *= _pfaN / v5;
+        phasing *= pfa[0] / v5;
         phasing -= M_PI_4;
         
         phasing -= int(phasing / two_pi) * two_pi;
@@ -158,9 +89,7 @@ def spa_tmplt_engine(htilde,  kmin,  phase_order, delta_f, piM,  pfaN,
                 sinp = .225 * (sinp * sinp - sinp) + sinp;
         }
         
-        
         //compute cosine
-        
         phasing += M_PI_2;
         if (phasing >  M_PI)
             phasing -= two_pi;
@@ -181,12 +110,76 @@ def spa_tmplt_engine(htilde,  kmin,  phase_order, delta_f, piM,  pfaN,
             else
                 cosp = .225 * (cosp * cosp - cosp) + cosp;
         }
-           
-            
-        
-        //printf("%f %f %f \\n", sinp, sin(phasing), phasing);
-        
-        htilde[i] = std::complex<float>(cosp, - sinp) * amp;
+
+        return std::complex<float>(cosp, - sinp) * amp;
+    }
+"""
+
+if pycbc.HAVE_OMP:
+    omp_libs = ['gomp']
+    omp_flags = ['-fopenmp']
+else:
+    omp_libs = []
+    omp_flags = []
+
+# Precompute cbrt(f) ###########################################################
+
+def cbrt_lookup(vmax, delta):
+    vec = numpy.arange(0, vmax*1.2, delta)
+    return FrequencySeries(vec**(1.0/3.0), delta_f=delta).astype(float32)
+    
+_cbrt_vec = None
+    
+def get_cbrt(vmax, delta):
+    global _cbrt_vec
+    if _cbrt_vec is None or (_cbrt_vec.delta_f != delta) or (len(_cbrt_vec) < int(vmax/delta)):
+        _cbrt_vec = cbrt_lookup(vmax, delta)
+    return _cbrt_vec   
+    
+# Precompute log(v) ############################################################
+    
+def logv_lookup(vmax, delta):
+    vec = numpy.arange(0, vmax*1.2, delta)
+    vec[1:len(vec)] = numpy.log(vec[1:len(vec)])
+    return FrequencySeries(vec, delta_f=delta).astype(float32)
+    
+_logv_vec = None
+    
+def get_log(vmax, delta):
+    global _logv_vec
+    if _logv_vec is None or (_logv_vec.delta_f != delta) or (len(_logv_vec) < int(vmax/delta)):
+        _logv_vec = logv_lookup(vmax, delta)
+    return _logv_vec   
+
+# Precompute the sine function #################################################
+def sin_cos_lookup():
+    vec = numpy.arange(0, lal.TWOPI*3, lal.TWOPI/10000)
+    return Array(numpy.sin(vec)).astype(float32)
+sin_cos = Array([], dtype=float32)
+
+def spa_tmplt_engine(htilde,  kmin,  phase_order, delta_f, piM,  pfaN, 
+                    pfa2,  pfa3,  pfa4,  pfa5,  pfl5,
+                    pfa6,  pfl6,  pfa7, amp_factor):
+    """ Calculate the spa tmplt phase 
+    """
+    kfac = numpy.array(spa_tmplt_precondition(len(htilde), delta_f, kmin).data, copy=False)
+    htilde = numpy.array(htilde.data, copy=False)
+    cbrt_vec = numpy.array(get_cbrt(len(htilde)*delta_f + kmin, delta_f).data, copy=False)
+    logv_vec = numpy.array(get_log(len(htilde)*delta_f + kmin, delta_f).data, copy=False)
+    length = len(htilde)
+    
+    code = """ 
+    float piM13 = cbrtf(piM);
+    float logpiM13 = log(piM13);
+    const float pfa[9] = {pfaN, pfa2, pfa3, pfa4, pfa5, pfl5, pfa6, pfl6, pfa7};
+    const float ampc = amp_factor;
+    
+    #pragma omp parallel for schedule(dynamic, 1024)
+    for (unsigned int i=0; i<length; i++){
+        int index = i + kmin;
+        const float v =  piM13 * cbrt_vec[index];
+        const float logv = logv_vec[index] * 1.0/3.0 + logpiM13;
+        htilde[i] = spa_tmplt_point(v, logv, phase_order, pfa, ampc * kfac[i]);
     }
     """
     inline(code, ['htilde', 'cbrt_vec', 'logv_vec', 'kmin', 'phase_order', 
@@ -197,3 +190,44 @@ def spa_tmplt_engine(htilde,  kmin,  phase_order, delta_f, piM,  pfaN,
                     support_code = support,
                     libraries=omp_libs
                 )
+
+def spa_tmplt_batch_engine(htilde, kmin, kmax, length, phase_order, delta_f,
+                           piM, pfa, amp_factor):
+    """ Calculate the spa tmplt phase for a block of templates
+    """
+    vmax = int(kmax.max()) * delta_f
+    kfac = numpy.array(spa_tmplt_precondition(int(kmax.max()) + 1, delta_f).data, copy=False)
+    htilde = numpy.array(htilde.data, copy=False)
+    cbrt_vec = numpy.array(get_cbrt(vmax, delta_f).data, copy=False)
+    logv_vec = numpy.array(get_log(vmax, delta_f).data, copy=False)
+    pfa = numpy.array(pfa, dtype=numpy.float32)
+    piM = numpy.array(piM, dtype=numpy.float32)
+    amp_factor = numpy.array(amp_factor, dtype=numpy.float32)
+    kmin = numpy.array(kmin, dtype=numpy.int32)
+    kmax = numpy.array(kmax, dtype=numpy.int32)
+    num = len(kmin)
+
+    code = """
+    // The lookup tables are shared by all of the templates, only the
+    // mass dependent scaling of v differs between rows.
+    #pragma omp parallel for schedule(dynamic, 1)
+    for (int t=0; t<num; t++){
+        const float piM13 = cbrtf(piM[t]);
+        const float logpiM13 = log(piM13);
+        const float* tpfa = pfa + 9 * t;
+        std::complex<float>* row = htilde + (size_t) t * length;
+
+        for (int index=kmin[t]; index<kmax[t]; index++){
+            const float v =  piM13 * cbrt_vec[index];
+            const float logv = logv_vec[index] * 1.0/3.0 + logpiM13;
+            row[index] = spa_tmplt_point(v, logv, phase_order, tpfa,
+                                         amp_factor[t] * kfac[index]);
+        }
+    }
+    """
+    inline(code, ['htilde', 'cbrt_vec', 'logv_vec', 'kfac', 'kmin', 'kmax',
+                  'length', 'phase_order', 'piM', 'pfa', 'amp_factor', 'num'],
+                    extra_compile_args=[pycbc.WEAVE_FLAGS] + omp_flags,
+                    support_code = support,
+                    libraries=omp_libs
+                )
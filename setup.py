@@ -353,6 +353,7 @@ setup (
                'bin/pycbc_banksim_combine_banks',
                'bin/pycbc_banksim_match_combine',
                'bin/pycbc_faithsim',
+               'bin/pycbc_fftw_prewarm',
                'bin/pycbc_inspiral',
                'bin/pycbc_inspiral_skymax',
                'bin/pycbc_live',
@@ -139,6 +139,49 @@ class TestAutochisquare(unittest.TestCase):
     #    for i in xrange(1, len(achi_list)):
 	#   self.assertTrue(achi_list[i,2] > 4.0)
 
+    def test_single_det(self):
+        sigt = TimeSeries(self.sig1, self.del_t)
+        sig_tilde = make_frequency_series(sigt)
+        psd = FrequencySeries(self.Psd, sig_tilde.get_delta_f())
+        flow = self.low_frequency_cutoff
+
+        with _context:
+            hautocor, _, _ = matched_filter_core(self.htilde, self.htilde,
+                    psd=psd, low_frequency_cutoff=flow,
+                    high_frequency_cutoff=self.fmax)
+            hautocor = hautocor * float(np.real(1./hautocor[0]))
+            snr, _, nrm = matched_filter_core(self.htilde, sig_tilde,
+                    psd=psd, low_frequency_cutoff=flow,
+                    high_frequency_cutoff=self.fmax)
+
+            indx = np.array([352250, 352256, 352260])
+            _, expected, _ = autochisq_from_precomputed(snr * nrm, snr * nrm,
+                    Array(hautocor, copy=True), indx, stride=3, num_points=20)
+
+            autochisq = SingleDetAutoChisq(3, 20, cache_size=1)
+            for i in range(2):
+                achisq = autochisq.values(snr, indx, self.htilde, psd, nrm,
+                                          low_frequency_cutoff=flow,
+                                          high_frequency_cutoff=self.fmax)
+                self.assertTrue(np.allclose(expected, achisq, rtol=1e-4))
+            self.assertEqual(40, autochisq.dof)
+            self.assertEqual(1, len(autochisq._autocor_cache))
+
+    def test_blocks(self):
+        from pycbc.vetoes.autochisq import autochisq_at_offsets
+        from pycbc.vetoes.autochisq import autochisq_offsets
+        sn = np.random.normal(size=1000) + 1.0j * np.random.normal(size=1000)
+        hautocor = np.random.normal(size=1000) * 0.1 + 0.01j
+        offsets, _ = autochisq_offsets(len(sn), stride=2, num_points=100)
+        indx = np.arange(5, 1000, 7)
+        expected = autochisq_at_offsets(sn, sn, hautocor[offsets], offsets,
+                                        indx)
+        # Blocks smaller than a single trigger still evaluate one at a time
+        for max_elements in [1, len(offsets) * 3 + 1]:
+            achisq = autochisq_at_offsets(sn, sn, hautocor[offsets], offsets,
+                                          indx, max_elements=max_elements)
+            self.assertTrue(np.allclose(expected, achisq))
+
     def test_sg(self):
         ### use a sin-gaussian as a signal
  
@@ -0,0 +1,77 @@
+# Copyright (C) 2017 The PyCBC team
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the bank veto overlap cache of pycbc.vetoes
+"""
+import shutil
+import tempfile
+import unittest
+import numpy
+from pycbc.types import FrequencySeries
+from pycbc.vetoes import BankVetoOverlapCache, psd_fingerprint, psd_distance
+from utils import parse_args_all_schemes, simple_exit
+
+_scheme, _context = parse_args_all_schemes("Bank veto overlap cache")
+
+class TestOverlapCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fingerprint(self):
+        psd = FrequencySeries(numpy.linspace(1, 2, 1000), delta_f=0.25)
+        close = FrequencySeries(psd.numpy() * 1.01, delta_f=0.25)
+        fingerprint = psd_fingerprint(psd, 100, 1000)
+        self.assertEqual(64, len(fingerprint))
+        self.assertEqual(0, psd_distance(fingerprint, fingerprint))
+        distance = psd_distance(fingerprint, psd_fingerprint(close, 100, 1000))
+        self.assertAlmostEqual(numpy.log(1.01), distance)
+
+    def test_cache(self):
+        cache = BankVetoOverlapCache(self.directory)
+        key = cache.key(12345, 'psd', 'filters', f_lower=20.0)
+        self.assertNotEqual(key, cache.key(12345, 'psd', 'filters',
+                                           f_lower=30.0))
+        self.assertTrue(cache.get(key) is None)
+
+        overlaps = [0.5 + 0.1j, -0.25j, 0.75]
+        cache.put(key, overlaps)
+        self.assertTrue(numpy.allclose(overlaps, cache.get(key)))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+        # Fingerprints are seen by other jobs sharing the directory
+        cache.add_fingerprint('psd', numpy.arange(4.0))
+        other = BankVetoOverlapCache(self.directory)
+        self.assertEqual(['psd'], other.fingerprints().keys())
+        self.assertTrue(numpy.all(other.fingerprints()['psd'] ==
+                                  numpy.arange(4.0)))
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestOverlapCache))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
@@ -56,7 +56,76 @@ class TestChisq(unittest.TestCase):
             for i in range(0, 4):
                 chisq_accum_bin(z, self.x)
             self.assertTrue(self.z.almost_equal_elem(z, self.tolerance))
-            
+
+    def test_point_methods(self):
+        # The point method is only implemented on the cpu
+        if self.scheme != 'cpu':
+            return
+        from pycbc.vetoes import SingleDetPowerChisq
+        from pycbc.vetoes import power_chisq_at_points_from_precomputed
+        from pycbc.vetoes import power_chisq_at_points_from_ifft
+        with self.context:
+            tlen = 2**12
+            corr = Array(self.x[0:tlen], copy=True)
+            corr[tlen/2+1:].clear()
+            bins = numpy.array([10, 100, 300, 700, 2000])
+            indices = numpy.array([3, 500, 2000, 4000])
+            snr = numpy.array([1.0 + 2.0j, 0.5, -3.0j, 4.0],
+                              dtype=numpy.complex64)
+
+            points = power_chisq_at_points_from_precomputed(corr, snr, 0.1,
+                                                            bins, indices)
+            ifft = power_chisq_at_points_from_ifft(corr, snr, 0.1,
+                                                   bins, indices)
+            self.assertTrue(numpy.allclose(points, ifft, rtol=1e-3))
+
+            chisq = SingleDetPowerChisq(4, method='auto')
+            point_cost, ifft_cost = chisq.calibrate(tlen)
+            self.assertTrue(point_cost > 0 and ifft_cost > 0)
+            self.assertEqual('points', chisq.choose_method(tlen, 1, bins[0:2]))
+            self.assertEqual('ifft', chisq.choose_method(tlen, tlen, bins))
+            self.assertEqual('ifft', SingleDetPowerChisq(4, method='ifft'
+                                        ).choose_method(tlen, 1, bins))
+
+    def test_point_batch(self):
+        if self.scheme != 'cpu':
+            return
+        from pycbc.vetoes import power_chisq_at_points_from_precomputed
+        from pycbc.vetoes import power_chisq_at_points_batch
+        with self.context:
+            tlen = 2**12
+            corrs, snrs, norms, bins, indices = [], [], [], [], []
+            for i in range(3):
+                corr = Array(self.x[i*tlen:(i+1)*tlen], copy=True)
+                corr[tlen/2+1:].clear()
+                corrs.append(corr)
+                snrs.append(numpy.arange(i + 2) * (1.0 + 1.0j))
+                norms.append(0.1 * (i + 1))
+                bins.append(numpy.array([10, 100 + i, 300, 2000]))
+                indices.append(numpy.arange(i + 2) * 1000 + i)
+            bins[2] = bins[0]
+
+            batch = power_chisq_at_points_batch(corrs, snrs, norms, bins,
+                                                indices)
+            for i in range(3):
+                single = power_chisq_at_points_from_precomputed(corrs[i],
+                                     snrs[i], norms[i], bins[i], indices[i])
+                self.assertTrue(numpy.allclose(single, batch[i], rtol=1e-3))
+
+            # Smaller batches reuse the buffers of the largest one
+            from pycbc.vetoes import chisq as chisq_module
+            buf = chisq_module._batch_q_l
+            for num in [2, 3, 2]:
+                batch = power_chisq_at_points_batch(corrs[:num], snrs[:num],
+                                        norms[:num], bins[:num], indices[:num])
+                for i in range(num):
+                    single = power_chisq_at_points_from_precomputed(corrs[i],
+                                     snrs[i], norms[i], bins[i], indices[i])
+                    self.assertTrue(numpy.allclose(single, batch[i],
+                                                   rtol=1e-3))
+            self.assertTrue(chisq_module._batch_q_l is buf)
+            self.assertEqual(2, len(chisq_module._batch_ifft_l))
+
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestChisq))
 
@@ -0,0 +1,222 @@
+# Copyright (C) 2017 The PyCBC team
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the pycbc.events.coinc module
+"""
+import unittest
+import numpy
+from pycbc.events import coinc
+from utils import parse_args_all_schemes, simple_exit
+
+_scheme, _context = parse_args_all_schemes("Coinc")
+
+class TestCoinc(unittest.TestCase):
+    def setUp(self):
+        self.scheme = _scheme
+        rng = numpy.random.RandomState(1)
+        self.duration = 50.
+        self.step = 1.
+        self.times = [rng.uniform(0, self.duration, n) for n in [60, 50, 55]]
+        self.windows = {(0, 1): 0.02, (0, 2): 0.03, (1, 2): 0.03}
+
+    def brute_coincs(self, combo):
+        # Check every slide in turn, shifting detector k by k slides
+        found = set()
+        nslides = int(self.duration / self.step) + 1
+        for slide in range(-nslides, nslides + 1):
+            close = True
+            for a in range(len(combo)):
+                for b in range(a + 1, len(combo)):
+                    ta = self.times[combo[a]] + combo[a] * slide * self.step
+                    tb = self.times[combo[b]] + combo[b] * slide * self.step
+                    shape = [1] * len(combo)
+                    shape[a] = len(ta)
+                    ta = ta.reshape(shape)
+                    shape = [1] * len(combo)
+                    shape[b] = len(tb)
+                    tb = tb.reshape(shape)
+                    close = close & (abs(ta - tb) < self.windows[combo[a],
+                                                                 combo[b]])
+            for idx in zip(*numpy.where(close)):
+                found.add(tuple(idx) + (slide,))
+        return found
+
+    def test_multi_time_coincidence(self):
+        if self.scheme != 'cpu':
+            return
+        coincs = coinc.multi_time_coincidence(self.times, self.windows,
+                                              self.step)
+        self.assertEqual(set([(0, 1), (0, 2), (1, 2), (0, 1, 2)]),
+                         set(coincs.keys()))
+        for combo in [(0, 2), (0, 1, 2)]:
+            ids, slide = coincs[combo]
+            found = set(zip(*(list(ids) + [slide])))
+            self.assertEqual(len(found), len(slide))
+            self.assertTrue(len(found) > 0)
+            self.assertEqual(self.brute_coincs(combo), found)
+
+        # Two detectors are the same as a pairwise coincidence
+        coincs = coinc.multi_time_coincidence(self.times[:2], self.windows,
+                                              self.step)
+        i0, i1, slide = coinc.time_coincidence(self.times[0], self.times[1],
+                                               self.windows[0, 1], self.step)
+        self.assertTrue((coincs[0, 1][0][0] == i0).all())
+        self.assertTrue((coincs[0, 1][0][1] == i1).all())
+        self.assertTrue((coincs[0, 1][1] == slide).all())
+
+    def test_take_ranges(self):
+        if self.scheme != 'cpu':
+            return
+        values = numpy.arange(1000) * 3
+        rng = numpy.random.RandomState(2)
+        for length in [0, 3, 500]:
+            left = rng.randint(0, 1000, size=50)
+            right = numpy.minimum(left + rng.randint(0, length + 1, size=50),
+                                  1000)
+            expected = [values[l:r] for l, r in zip(left, right)]
+            expected = numpy.concatenate(expected)
+            taken = coinc.take_ranges(values, left, right)
+            self.assertEqual(expected.dtype, taken.dtype)
+            self.assertTrue((expected == taken).all())
+
+    def test_cluster_coincs(self):
+        if self.scheme != 'cpu':
+            return
+        # Two slides, each with a loud coincidence among quieter ones
+        time1 = numpy.array([10., 10.5, 11., 10.2, 10.4, 30.])
+        stat = numpy.array([5., 9., 6., 7., 8., 4.])
+        slide = numpy.array([0, 0, 0, 3, 3, 3])
+        cid = coinc.cluster_coincs(stat, time1, time1, slide, 0.1, 2.)
+        self.assertEqual([1, 4, 5], sorted(cid))
+
+        # The compiled sweep matches that of a given argmax
+        rng = numpy.random.RandomState(3)
+        time1 = rng.uniform(0, 1000, 5000) + 1e9
+        time2 = time1 + rng.uniform(-0.01, 0.01, 5000)
+        slide = rng.randint(-40, 41, 5000)
+        stat = rng.rayleigh(size=5000)
+        cid = coinc.cluster_coincs(stat, time1, time2, slide, 0.1, 2.)
+        pid = coinc.cluster_coincs(stat, time1, time2, slide, 0.1, 2.,
+                                   argmax=lambda v: numpy.argmax(v))
+        self.assertTrue(len(cid) < 5000)
+        self.assertTrue((cid == pid).all())
+
+    def test_background_index(self):
+        if self.scheme != 'cpu':
+            return
+        def n_louder(bstat, fstat, dec):
+            # The quietest background value is never counted
+            quietest = bstat.argmin()
+            return numpy.array([dec[bstat >= f].sum() - dec[quietest] *
+                                (f <= bstat[quietest]) for f in fstat])
+
+        rng = numpy.random.RandomState(4)
+        bstat = rng.rayleigh(size=2000)
+        dec = rng.choice([1, 100], size=2000)
+        fstat = numpy.concatenate([rng.rayleigh(size=100), [-1.]])
+        back, fore = coinc.calculate_n_louder(bstat, fstat, dec)
+        self.assertTrue((fore == n_louder(bstat, fstat, dec)).all())
+        self.assertTrue((back == n_louder(bstat, bstat, dec) - dec +
+                         dec[bstat.argmin()] * (bstat == bstat.min()))
+                        .all())
+
+        index = coinc.BackgroundIndex(bstat, dec, buffer_size=20)
+        alive = numpy.ones(len(bstat), dtype=bool)
+        for i in range(10):
+            remove = rng.randint(0, len(bstat), size=30)
+            index.remove(remove)
+            alive[remove] = False
+            new_stat = rng.rayleigh(size=7)
+            new_dec = rng.choice([1, 100], size=7)
+            ids = index.add(new_stat, new_dec)
+            self.assertEqual(len(bstat), ids[0])
+            bstat = numpy.concatenate([bstat, new_stat])
+            dec = numpy.concatenate([dec, new_dec])
+            alive = numpy.concatenate([alive, numpy.ones(7, dtype=bool)])
+
+            self.assertEqual(alive.sum(), len(index))
+            self.assertTrue((index.n_louder(fstat) ==
+                   n_louder(bstat[alive], fstat, dec[alive])).all())
+
+        ids, back = index.background_n_louder()
+        self.assertTrue((ids == numpy.flatnonzero(alive)).all())
+        self.assertTrue((back == coinc.calculate_n_louder(bstat[alive],
+                         fstat, dec[alive])[0]).all())
+
+    def test_hierarchical_removal(self):
+        if self.scheme != 'cpu':
+            return
+        rng = numpy.random.RandomState(5)
+        time1 = rng.uniform(0, 1000, 3000)
+        time2 = time1 + rng.uniform(-0.01, 0.01, 3000)
+        slide = rng.randint(-50, 51, 3000)
+        stat = rng.rayleigh(size=3000) * 2
+        dec = numpy.ones(3000, dtype=numpy.uint32)
+        fore = numpy.flatnonzero(slide == 0)
+        stat[fore[:3]] = [30., 20., 25.]
+
+        removals = coinc.hierarchical_removal(stat, time1, time2, slide, dec,
+                                              1.0)
+        removed = []
+        for idx, keep, fore_n_louder, index in removals:
+            removed.append(idx)
+            near = (abs(time1 - time1[idx]) < 0.9) | \
+                   (abs(time2 - time1[idx]) < 0.9)
+            self.assertFalse(keep[near].any())
+            self.assertEqual((keep & (slide != 0)).sum(), len(index))
+            self.assertTrue((fore_n_louder == coinc.calculate_n_louder(
+                             stat[keep & (slide != 0)], stat[keep & (slide == 0)],
+                             dec[keep & (slide != 0)], skip_background=True))
+                            .all())
+        self.assertEqual([fore[0], fore[2], fore[1]], removed)
+
+        removals = coinc.hierarchical_removal(stat, time1, time2, slide, dec,
+                                              1.0, max_removals=1)
+        self.assertEqual(1, len(list(removals)))
+
+    def test_timeslide_durations(self):
+        if self.scheme != 'cpu':
+            return
+        from pycbc.events import veto
+        rng = numpy.random.RandomState(6)
+        start1 = rng.uniform(0, 1e5, 100) + 1e9
+        end1 = start1 + rng.uniform(0, 2000, 100)
+        start2 = rng.uniform(0, 1e5, 80) + 1e9
+        end2 = start2 + rng.uniform(0, 2000, 80)
+        offsets = numpy.arange(-100, 100) * 37.3
+
+        durations = coinc.timeslide_durations(start1, start2, end1, end2,
+                                              offsets, chunk_size=1000)
+        seg2 = veto.start_end_to_segments(start2, end2).coalesce()
+        for offset, duration in zip(offsets, durations):
+            seg1 = veto.start_end_to_segments(start1 + offset, end1 + offset)
+            expected = abs((seg1.coalesce() & seg2).coalesce())
+            self.assertAlmostEqual(expected, duration, places=3)
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestCoinc))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
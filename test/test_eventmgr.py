@@ -0,0 +1,184 @@
+# Copyright (C) 2017 The PyCBC team
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the EventManager of pycbc.events
+"""
+import os
+import shutil
+import argparse
+import tempfile
+import unittest
+import h5py
+import numpy
+from pycbc.events import EventManager, newsnr
+from utils import parse_args_all_schemes, simple_exit
+
+_scheme, _context = parse_args_all_schemes("EventManager")
+
+names = ['time_index', 'snr', 'chisq', 'chisq_dof', 'bank_chisq',
+         'bank_chisq_dof', 'cont_chisq']
+types = [int, numpy.complex64, numpy.float32, int, numpy.float32, int,
+         numpy.float32]
+
+class Template(object):
+    def __init__(self, num):
+        self.template_hash = 1000 + num
+        self.template_duration = 0.5 * num
+
+class TestEventManager(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.opt = argparse.Namespace(channel_name='H1:TEST',
+                sample_rate=4096, gps_start_time=1000, gps_end_time=1256,
+                segment_start_pad=8, segment_end_pad=8, trig_start_time=0,
+                trig_end_time=0, autochi_number_points=0,
+                autochi_onesided=None, autochi_two_phase=False,
+                autochi_max_valued_dof=None, chisq_bins=16)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_events(self, name, reductions, max_events=None):
+        numpy.random.seed(0)
+        mgr = EventManager(self.opt, names, types)
+        if max_events is not None:
+            mgr.stream_events(os.path.join(self.directory, name + '.spool'),
+                              max_events, reductions)
+        for t in range(20):
+            mgr.new_template(tmplt=Template(t), sigmasq=float(t))
+            num = numpy.random.randint(0, 10)
+            mgr.add_template_events(names, [
+                numpy.random.randint(0, 256 * 4096, size=num),
+                numpy.random.normal(size=num) * 8,
+                numpy.random.uniform(0, 40, size=num),
+                numpy.repeat(30, num), numpy.zeros(num), numpy.zeros(num),
+                numpy.zeros(num)])
+            mgr.finalize_template_events()
+
+        if max_events is None:
+            mgr.apply_reductions(reductions)
+        else:
+            mgr.finish_streaming()
+        outname = os.path.join(self.directory, name + '.hdf')
+        mgr.write_events(outname)
+        return h5py.File(outname, 'r')
+
+    def compare(self, reductions):
+        expected = self.run_events('memory', reductions)
+        streamed = self.run_events('stream', reductions, max_events=7)
+        self.assertFalse(os.path.exists(os.path.join(self.directory,
+                                                     'stream.spool')))
+        self.assertEqual(sorted(expected['H1'].keys()),
+                         sorted(streamed['H1'].keys()))
+        # Events of the same template may be in any order
+        order = lambda f: numpy.lexsort((f['H1/end_time'][:],
+                                         f['H1/template_hash'][:]))
+        eorder, sorder = order(expected), order(streamed)
+        for key in expected['H1'].keys():
+            if key != 'search':
+                self.assertTrue(numpy.all(expected['H1'][key][:][eorder] ==
+                                          streamed['H1'][key][:][sorder]))
+        return len(eorder)
+
+    def test_spooled(self):
+        self.assertTrue(self.compare([('newsnr_threshold', (6,))]) > 0)
+
+    def test_bounded(self):
+        self.assertTrue(self.compare([('newsnr_threshold', (6,)),
+            ('keep_loudest_in_interval', (4096 * 16, 1)),
+            ('maximize_over_bank', ('time_index', 'snr', 4096))]) > 0)
+
+    def test_small_buffer(self):
+        # Keeping every event leaves more than the limit after each flush,
+        # so the events are only reduced again once their number doubles
+        mgr = EventManager(self.opt, names, types)
+        mgr.stream_events(os.path.join(self.directory, 'small.spool'), 2,
+                          [('keep_loudest_in_interval', (4096, 1000))])
+        flushes = []
+        mgr.apply_reductions = lambda r: flushes.append(len(mgr.events))
+        for t in range(100):
+            mgr.new_template(tmplt=Template(t), sigmasq=float(t))
+            mgr.add_template_events(names, [numpy.arange(3)] +
+                                    [numpy.ones(3)] * (len(names) - 1))
+            mgr.finalize_template_events()
+        self.assertEqual([3, 6, 12, 24, 48, 96, 192], flushes)
+        self.assertEqual(300, len(mgr.events))
+
+    def test_large_buffer(self):
+        # The chunks of the spool do not grow with the number of buffered
+        # events, which HDF5 limits to 4GB
+        mgr = EventManager(self.opt, names, types)
+        mgr.stream_events(os.path.join(self.directory, 'large.spool'),
+                          10 ** 9, [('newsnr_threshold', (6,))])
+        self.assertEqual((2 ** 16,), mgr.spool.data.chunks)
+        mgr.new_template(tmplt=Template(0), sigmasq=1.0)
+        mgr.add_template_events(names, [numpy.arange(3),
+                numpy.repeat(10, 3), numpy.ones(3), numpy.repeat(30, 3),
+                numpy.zeros(3), numpy.zeros(3), numpy.zeros(3)])
+        mgr.finalize_template_events()
+        self.assertEqual(3, mgr.finish_streaming())
+        outname = os.path.join(self.directory, 'large.hdf')
+        mgr.write_events(outname)
+        with h5py.File(outname, 'r') as f:
+            self.assertEqual(3, len(f['H1/snr']))
+
+    def test_reductions(self):
+        # Compare with the reductions done one event at a time
+        numpy.random.seed(1)
+        mgr = EventManager(self.opt, names, types)
+        mgr.new_template(tmplt=Template(0), sigmasq=1.0)
+        num = 1000
+        mgr.add_template_events(names, [
+            numpy.random.randint(0, 64 * 4096, size=num),
+            numpy.random.normal(size=num) * 8,
+            numpy.random.uniform(0, 40, size=num), numpy.repeat(30, num),
+            numpy.zeros(num), numpy.zeros(num), numpy.zeros(num)])
+        mgr.finalize_template_events()
+        events = mgr.events.copy()
+
+        mgr.keep_loudest_in_interval(4096, 3)
+        stat = newsnr(abs(events['snr']), events['chisq'] /
+                      events['chisq_dof'])
+        wtime = events['time_index'] / 4096
+        keep = []
+        for b in numpy.unique(wtime):
+            bloc = numpy.where(wtime == b)[0]
+            keep.append(bloc[stat[bloc].argsort()[-3:]])
+        self.assertTrue(numpy.all(events[numpy.concatenate(keep)] ==
+                                  mgr.events))
+
+        mgr.events = events
+        mgr.maximize_over_bank('time_index', 'snr', 256)
+        events = numpy.sort(events, order='time_index')
+        groups = events['time_index'] / 256
+        loudest = [events[groups == g][abs(events[groups == g]['snr']).argmax()]
+                   for g in numpy.unique(groups)]
+        self.assertTrue(numpy.all(numpy.array(loudest) == mgr.events))
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestEventManager))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
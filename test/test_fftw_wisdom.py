@@ -0,0 +1,93 @@
+# Copyright (C) 2017 The PyCBC team
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the wisdom cache of the pycbc.fft.fftw module
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import pycbc.fft
+import pycbc.scheme
+from pycbc.types import zeros, complex64
+from utils import parse_args_all_schemes, simple_exit
+
+_scheme, _context = parse_args_all_schemes("FFTW wisdom")
+
+class TestWisdomCache(unittest.TestCase):
+    def setUp(self):
+        self.context = _context
+        self.scheme = _scheme
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_load(self):
+        # The wisdom cache only applies to FFTW on the cpu
+        if self.scheme != 'cpu':
+            return
+        import pycbc.fft.fftw as fftw
+        with self.context:
+            level = fftw.get_measure_level()
+            fftw.set_measure_level(1)
+            nthreads = pycbc.scheme.mgr.state.num_threads
+            try:
+                cache = fftw.WisdomCache(self.directory, nthreads)
+                cache.load()
+                self.assertEqual(0, len(cache.loaded))
+
+                invec = zeros(4096, dtype=complex64)
+                outvec = zeros(4096, dtype=complex64)
+                fftw.IFFT(invec, outvec)
+                self.assertTrue(cache.save() >= 1)
+                self.assertEqual(0, cache.save())
+
+                for name in ['float.wisdom', 'double.wisdom', 'index.json',
+                             'host.json']:
+                    self.assertTrue(os.path.exists(os.path.join(
+                                    cache.directory, name)))
+                with open(os.path.join(cache.directory, 'index.json')) as f:
+                    sizes = [p[0] for p in json.load(f)]
+                self.assertTrue(4096 in sizes)
+
+                # A second job on the same host sees the saved transforms
+                other = fftw.WisdomCache(self.directory, nthreads)
+                self.assertEqual(cache.directory, other.directory)
+                other.load()
+                self.assertEqual(cache.loaded, other.loaded)
+
+                # Wisdom for other thread counts is kept separately
+                threaded = fftw.WisdomCache(self.directory, nthreads + 1)
+                self.assertNotEqual(cache.directory, threaded.directory)
+            finally:
+                fftw.set_measure_level(level)
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestWisdomCache))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
@@ -0,0 +1,170 @@
+# Copyright (C) 2017 The PyCBC team
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the trigger file utilities of pycbc.io.hdf
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import h5py
+from pycbc.io import hdf
+from utils import parse_args_all_schemes, simple_exit
+
+_scheme, _context = parse_args_all_schemes("HDF")
+
+class TestTriggerFiles(unittest.TestCase):
+    def setUp(self):
+        self.scheme = _scheme
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'H1-TRIGGERS.hdf')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_column_array(self):
+        if self.scheme != 'cpu':
+            return
+        snr = numpy.random.uniform(5, 10, size=1000).astype(numpy.float32)
+        with h5py.File(self.filename, 'w') as f:
+            f.create_dataset('H1/snr', data=snr)
+            f.create_dataset('H1/snr_lzf', data=snr, chunks=(100,),
+                             compression='lzf')
+            f.create_dataset('H1/empty', data=numpy.array([]))
+
+        with h5py.File(self.filename, 'r') as f:
+            column = hdf.column_array(f['H1/snr'])
+            self.assertTrue(isinstance(column, numpy.memmap))
+            self.assertTrue((column[100:200] == snr[100:200]).all())
+            self.assertTrue((column[[5, 1, 900]] == snr[[5, 1, 900]]).all())
+
+            column = hdf.column_array(f['H1/snr_lzf'])
+            self.assertFalse(isinstance(column, numpy.memmap))
+            self.assertTrue((column[100:200] == snr[100:200]).all())
+            self.assertEqual(0, len(hdf.column_array(f['H1/empty'])))
+
+    def test_column_writer(self):
+        if self.scheme != 'cpu':
+            return
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(2)
+        # The last chunk is only partly filled
+        values = {'snr': numpy.random.uniform(5, 10, size=1030),
+                  'template_id': numpy.random.randint(0, 100, size=1030)}
+        with h5py.File(self.filename, 'w') as f:
+            for key in values:
+                f.create_dataset('h5py/' + key, data=values[key],
+                                 chunks=(100,), compression='gzip',
+                                 compression_opts=6, shuffle=True)
+                for compression in [None, 'gzip', 'lzf']:
+                    writer = hdf.ColumnWriter(f, '%s/%s' % (compression, key),
+                                              values[key].dtype, 1030,
+                                              compression=compression,
+                                              compression_level=6,
+                                              chunk_size=100, pool=pool)
+                    for i in range(0, 1030, 250):
+                        writer.append(values[key][i:i + 250])
+                    writer.close()
+        pool.close()
+
+        with h5py.File(self.filename, 'r') as f:
+            for key in values:
+                expected = f['h5py/' + key]
+                self.assertTrue((expected[:] == values[key]).all())
+                for compression in [None, 'gzip', 'lzf']:
+                    written = f['%s/%s' % (compression, key)]
+                    self.assertEqual(compression, written.compression)
+                    self.assertTrue((written[:] == expected[:]).all())
+                written = f['gzip/' + key]
+                self.assertEqual(expected.chunks, written.chunks)
+                self.assertEqual(expected.shuffle, written.shuffle)
+                self.assertEqual(expected.compression_opts,
+                                 written.compression_opts)
+
+    def test_masked_column(self):
+        if self.scheme != 'cpu':
+            return
+        snr = numpy.random.uniform(5, 10, size=1000).astype(numpy.float32)
+        with h5py.File(self.filename, 'w') as f:
+            f.create_dataset('H1/snr', data=snr)
+            f.create_dataset('H1/snr_lzf', data=snr, chunks=(100,),
+                             compression='lzf')
+
+        idx = numpy.random.permutation(1000)[:50]
+        mask = numpy.zeros(1000, dtype=bool)
+        mask[[3, 500, 999]] = True
+        with h5py.File(self.filename, 'r') as f:
+            for key in ['H1/snr', 'H1/snr_lzf']:
+                values = hdf.masked_column(f[key], idx, chunk_size=64)
+                self.assertTrue((values == snr[idx]).all())
+                values = hdf.masked_column(f[key], mask, chunk_size=64)
+                self.assertTrue((values == snr[mask]).all())
+                values = hdf.masked_column(f[key], idx[:0], chunk_size=64)
+                self.assertEqual(0, len(values))
+                value = hdf.masked_column(f[key], numpy.int64(7))
+                self.assertEqual(snr[7], value)
+
+    def test_select(self):
+        if self.scheme != 'cpu':
+            return
+        counts = numpy.random.poisson(20, size=50)
+        template_id = numpy.repeat(numpy.arange(50), counts)
+        snr = numpy.random.uniform(5, 10, size=len(template_id))
+        with h5py.File(self.filename, 'w') as f:
+            f.create_dataset('H1/snr', data=snr, chunks=(100,),
+                             compression='lzf')
+            f['H1/template_id'] = template_id
+            f['H1/template_boundaries'] = numpy.concatenate([[0],
+                                                  numpy.cumsum(counts)])
+            f.attrs['layout'] = 'columnar'
+
+        louder = snr > 7
+        premask = numpy.random.uniform(size=len(snr)) > 0.5
+        tids = [0, 5, 49]
+        with hdf.HFile(self.filename, 'r') as f:
+            self.assertTrue((f.select(lambda s: s > 7, 'H1/snr', threads=2)
+                             == snr[louder]).all())
+            idx = f.select(lambda s: s > 7, 'H1/snr', premask=premask,
+                           return_data=False)
+            self.assertTrue((idx == numpy.flatnonzero(louder & premask))
+                            .all())
+            idx, s, t = f.select(lambda s, t: s > 7, 'H1/snr',
+                                 'H1/template_id', template_ids=tids,
+                                 return_indices=True)
+            expected = louder & numpy.in1d(template_id, tids)
+            self.assertTrue((idx == numpy.flatnonzero(expected)).all())
+            self.assertTrue((s == snr[expected]).all())
+            self.assertTrue((t == template_id[expected]).all())
+            self.assertEqual(0, len(f.select(lambda s: s > 7, 'H1/snr',
+                                             end=0)))
+            self.assertTrue((f.select(lambda s: s > 7, 'H1/snr', start=10,
+                             end=100) == snr[10:100][louder[10:100]]).all())
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestTriggerFiles))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
@@ -126,6 +126,92 @@ class TestMatchedFilter(unittest.TestCase):
             o,i = match(self.filtD,self.filt2D)
             self.assertAlmostEqual(sqrt(0.5),o,places=3)
 
+    def test_batched_filter(self):
+        # The batched correlator is only implemented for the cpu
+        if self.scheme != 'cpu':
+            return
+        with self.context:
+            stilde = make_frequency_series(self.filt_offset)
+            stilde.analyze = slice(0, len(self.filt_offset))
+            tlen = len(self.filt_offset)
+            flen = len(stilde)
+            template_mem = zeros(flen, dtype=complex64)
+            mf = MatchedFilterControl(None, None, 5.0, tlen, stilde.delta_f,
+                                      complex64, [stilde], template_mem,
+                                      True, cluster_function='findchirp',
+                                      batch_size=2)
+
+            htilde = make_frequency_series(self.filt)
+            htilde2 = make_frequency_series(self.filt2)
+            mf.batch_htilde[0][:] = htilde
+            mf.batch_htilde[1][:] = htilde2
+            norms = [sigmasq(htilde), sigmasq(htilde2)]
+            results = mf.batched_matched_filter_and_cluster(0, norms, 4096)
+
+            for h, norm, result in zip([htilde, htilde2], norms, results):
+                template_mem[:] = h
+                _, n, _, idx, snrv = mf.matched_filter_and_cluster(0, norm,
+                                                                   4096)
+                self.assertAlmostEqual(n, result[1], places=5)
+                self.assertEqual(list(idx), list(result[3]))
+                numpy.testing.assert_allclose(snrv, result[4], rtol=1e-4)
+
+    def test_hierarchical_filter(self):
+        # The pruned fft is only implemented for the cpu
+        if self.scheme != 'cpu':
+            return
+        from pycbc.filter.matchedfilter import hierarchical_snr_fraction
+        with self.context:
+            stilde = make_frequency_series(self.filt_offset)
+            stilde.analyze = slice(0, len(self.filt_offset))
+            tlen = len(self.filt_offset)
+            htilde = make_frequency_series(self.filt)
+            norm = sigmasq(htilde)
+
+            results = []
+            for factor, loss in [(1, None), (4, None), (4, 0.5), (4, 0.0)]:
+                template_mem = zeros(len(stilde), dtype=complex64)
+                template_mem[:] = htilde
+                mf = MatchedFilterControl(None, None, 5.0, tlen,
+                                          stilde.delta_f, complex64,
+                                          [stilde], template_mem, True,
+                                          cluster_function='findchirp',
+                                          downsample_factor=factor,
+                                          upsample_threshold=0.9,
+                                          max_snr_loss=loss)
+                _, n, _, idx, snrv = mf.matched_filter_and_cluster(0, norm,
+                                                                   4096)
+                peak = numpy.argmax(abs(snrv))
+                results.append((n, idx[peak], abs(snrv[peak])))
+
+            # A loss of zero forces the full rate filter
+            self.assertEqual(1, mf.num_full_rate)
+            for n, peak_idx, peak in results[1:]:
+                self.assertAlmostEqual(results[0][0], n, places=5)
+                self.assertEqual(results[0][1], peak_idx)
+                self.assertAlmostEqual(1, peak / results[0][2], places=3)
+
+            fraction = hierarchical_snr_fraction(htilde, None, 1,
+                                                 len(htilde), len(htilde),
+                                                 tlen, 1)
+            self.assertAlmostEqual(1.0, fraction, places=5)
+            fraction = hierarchical_snr_fraction(htilde, None, 1, 100,
+                                                 len(htilde), tlen, 8)
+            self.assertTrue(0 < fraction <= 1)
+
+    def test_tile_sizes(self):
+        from pycbc.filter.matchedfilter import get_batch_correlate_block_size
+        # Four template bands and one segment band fit in the cache
+        self.assertEqual(4, get_template_batch_size(0, 1024, 8,
+                                                    cache_size=5 * 8192))
+        self.assertEqual(1, get_template_batch_size(0, 1024, 8,
+                                                    cache_size=1024))
+        self.assertEqual(64, get_template_batch_size(0, 16, 8,
+                                                     cache_size=2 ** 30))
+        bsize = get_batch_correlate_block_size(4, 8, cache_size=2 ** 20)
+        self.assertEqual(0, bsize % 64)
+        self.assertTrue(bsize * 9 * 8 <= 2 ** 19)
+
     def test_errors(self):
         with self.context:
             #Check that an incompatible data and filter produce an error
@@ -0,0 +1,126 @@
+# Copyright (C) 2017 The PyCBC team
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the pycbc.pipeline module
+"""
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import unittest
+import numpy
+import h5py
+from pycbc.pipeline import Pipeline
+from utils import parse_args_all_schemes, simple_exit
+
+_scheme, _context = parse_args_all_schemes("Pipeline")
+
+class TestPipeline(unittest.TestCase):
+    def test_order(self):
+        out = []
+        pipeline = Pipeline([lambda x: x * 2, lambda x: x + 1, out.append])
+        pipeline.run(range(100))
+        self.assertEqual([x * 2 + 1 for x in range(100)], out)
+        self.assertEqual(5, pipeline.max_items)
+
+    def test_error(self):
+        out = []
+        def fail(x):
+            if x == 10:
+                raise ValueError("failed on %s" % x)
+            return x
+        pipeline = Pipeline([fail, out.append], depth=2)
+        self.assertRaises(ValueError, pipeline.run, range(100))
+        self.assertEqual(range(10), out)
+
+        # The pipeline can be reused after an error
+        out = []
+        pipeline = Pipeline([out.append])
+        pipeline.run(range(3))
+        self.assertEqual(range(3), out)
+
+class TestInspiralPipeline(unittest.TestCase):
+    """ Compare the triggers of pycbc_inspiral filtering templates one at a
+    time with those of its pipelined template loop
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bank = os.path.join(self.directory, 'bank.hdf')
+        rng = numpy.random.RandomState(7)
+        with h5py.File(self.bank, 'w') as f:
+            f['mass1'] = rng.uniform(5, 15, size=12)
+            f['mass2'] = rng.uniform(5, 15, size=12)
+            f['spin1z'] = numpy.zeros(12)
+            f['spin2z'] = numpy.zeros(12)
+            f.attrs['parameters'] = ['mass1', 'mass2', 'spin1z', 'spin2z']
+        self.inspiral = os.path.join(os.path.dirname(__file__), '..', 'bin',
+                                     'pycbc_inspiral')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_inspiral(self, name, *args):
+        output = os.path.join(self.directory, name)
+        subprocess.check_call([sys.executable, self.inspiral,
+            '--bank-file', self.bank, '--approximant', 'SPAtmplt',
+            '--gps-start-time', '1026026000', '--gps-end-time', '1026026512',
+            '--pad-data', '8', '--sample-rate', '1024',
+            '--strain-high-pass', '30', '--channel-name', 'H1:FAKE-STRAIN',
+            '--fake-strain', 'aLIGOZeroDetHighPower',
+            '--fake-strain-seed', '1',
+            '--psd-model', 'aLIGOZeroDetHighPower',
+            '--segment-length', '256', '--segment-start-pad', '64',
+            '--segment-end-pad', '16', '--low-frequency-cutoff', '40',
+            '--snr-threshold', '4', '--cluster-method', 'window',
+            '--cluster-window', '0.2', '--cluster-function', 'symmetric',
+            '--chisq-bins', '8', '--autochi-stride', '4',
+            '--autochi-number-points', '8', '--processing-scheme', 'cpu',
+            '--output', output] + list(args))
+        return h5py.File(output, 'r')
+
+    def test_triggers(self):
+        if _scheme != 'cpu':
+            return
+        serial = self.run_inspiral('serial.hdf')
+        piped = self.run_inspiral('piped.hdf', '--pipeline-stages')
+
+        names = []
+        serial['H1'].visititems(lambda name, obj: names.append(name)
+                                if isinstance(obj, h5py.Dataset) and
+                                not name.startswith('search') else None)
+        self.assertTrue(len(serial['H1/snr']) > 0)
+        for name in names:
+            self.assertTrue(numpy.array_equal(serial['H1'][name][:],
+                                              piped['H1'][name][:]), name)
+        serial.close()
+        piped.close()
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestPipeline))
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestInspiralPipeline))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
@@ -0,0 +1,124 @@
+# Copyright (C) 2017 The PyCBC team
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the pycbc.io.record module
+"""
+import unittest
+import numpy
+from pycbc.io import record
+from utils import parse_args_all_schemes, simple_exit
+
+_scheme, _context = parse_args_all_schemes("Record")
+
+def mtotal(self):
+    return self.mass1 + self['mass2']
+
+class TestColumnArray(unittest.TestCase):
+    def setUp(self):
+        self.scheme = _scheme
+        rng = numpy.random.RandomState(8)
+        self.mass1 = rng.uniform(1, 3, 100)
+        self.mass2 = rng.uniform(1, 3, 100)
+        self.fields = record.FieldArray.from_kwargs(mass1=self.mass1,
+                                                    mass2=self.mass2)
+        self.columns = record.ColumnArray.from_fieldarray(self.fields)
+
+    def test_getitem(self):
+        if self.scheme != 'cpu':
+            return
+        for item in ['mass1', 'mass1 + mass2', 'log(mass1 / mass2)']:
+            self.assertTrue(numpy.allclose(self.fields[item],
+                                           self.columns[item]))
+        mask = self.mass1 > 2
+        self.assertTrue((self.columns[mask].mass2 == self.mass2[mask]).all())
+        self.assertTrue((self.columns[10:20].mass1 ==
+                         self.mass1[10:20]).all())
+        self.assertEqual(tuple(self.fields[-1]), tuple(self.columns[-1]))
+
+        arr = self.columns.add_virtualfields('mtotal', mtotal)
+        self.assertTrue(numpy.allclose(arr.mtotal, self.mass1 + self.mass2))
+        self.assertTrue(numpy.allclose(arr['mtotal / 2'],
+                                       (self.mass1 + self.mass2) / 2))
+        self.assertEqual(set(['mass1', 'mass2']),
+                         record.get_needed_fieldnames(arr, 'mtotal'))
+
+    def test_append(self):
+        if self.scheme != 'cpu':
+            return
+        fields = self.fields
+        columns = self.columns
+        for i in range(20):
+            fields = fields.append(self.fields[i:i + 3])
+            columns = columns.append(self.columns[i:i + 3])
+            if i == 10:
+                middle = columns
+        self.assertEqual(len(fields), len(columns))
+        self.assertTrue((fields.mass1 == columns.mass1).all())
+        self.assertTrue((fields.mass2 == columns.mass2).all())
+        self.assertEqual(len(self.mass1), len(self.columns))
+
+        # Appending to an earlier array leaves later ones unchanged
+        other = middle.append(self.columns[50:60])
+        self.assertTrue((columns.mass1 == fields.mass1).all())
+        self.assertTrue((other.mass1[-10:] == self.mass1[50:60]).all())
+
+        short = record.ColumnArray.from_kwargs(ifo=numpy.array(['H1']))
+        both = short.append(record.ColumnArray.from_kwargs(
+                            ifo=numpy.array(['H1L1V1'])))
+        self.assertEqual(['H1', 'H1L1V1'], list(both.ifo))
+
+    def test_append_shared(self):
+        if self.scheme != 'cpu':
+            return
+        # a has room to grow, so b shares its fields
+        a = self.columns[:10].append(self.columns[10:20])
+        b = a.append(self.columns[20:25])
+        a.sort(order='mass2')
+        self.assertTrue((b.mass1 == self.mass1[:25]).all())
+        self.assertTrue((a.mass2 == numpy.sort(self.mass2[:20])).all())
+
+        c = b.append(self.columns[25:30])
+        b['mass1'] = 0
+        b.mass2[:] = 0
+        self.assertTrue((c.mass1 == self.mass1[:30]).all())
+        self.assertTrue((c.mass2 == self.mass2[:30]).all())
+        c.sort(order='mass1')
+        self.assertTrue((b.mass1 == 0).all())
+
+    def test_sort(self):
+        if self.scheme != 'cpu':
+            return
+        self.fields.sort(order='mass1')
+        self.columns.sort(order='mass1')
+        self.assertTrue((self.fields.mass1 == self.columns.mass1).all())
+        self.assertTrue((self.fields.mass2 == self.columns.mass2).all())
+        fields = self.columns.to_fieldarray()
+        self.assertEqual(self.fields.fieldnames, fields.fieldnames)
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestColumnArray))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
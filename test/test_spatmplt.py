@@ -76,6 +76,36 @@ class TestSPAtmplt(unittest.TestCase):
 
                             print "checked m1: %s m2:: %s s1z: %s s2z: %s] overlap = %s, diff = %s" % (m1, m2, s1, s2, o, diff)
 
+    def test_spatmplt_batch(self):
+        # The batched engine is only implemented for the cpu
+        if self.scheme != 'cpu':
+            return
+        from pycbc.waveform.spa_tmplt import spa_tmplt_batch
+        fl = 25
+        delta_f = 1.0 / 256
+        length = 256 * 1024 + 1
+        mass1 = [1, 1.4, 20, 3]
+        mass2 = [1.4, 1.4, 20, 1.2]
+        spin1z = [0, 0.5, -0.9, 0.3]
+        spin2z = [0, -0.2, 0.9, 0]
+
+        with self.context:
+            out = zeros(len(mass1) * length, dtype=complex64)
+            hps = spa_tmplt_batch(mass1, mass2, spin1z, spin2z, fl, delta_f,
+                                  length, out=out)
+            self.assertEqual(len(mass1), len(hps))
+            for hp, m1, m2, s1, s2 in zip(hps, mass1, mass2, spin1z, spin2z):
+                ref = zeros(length, dtype=complex64)
+                ref = get_waveform_filter(ref, mass1=m1, mass2=m2,
+                                          spin1z=s1, spin2z=s2,
+                                          delta_f=delta_f, f_lower=fl,
+                                          approximant="SPAtmplt",
+                                          amplitude_order=0, spin_order=-1,
+                                          phase_order=-1)
+                self.assertEqual(len(ref), len(hp))
+                numpy.testing.assert_allclose(hp.numpy(), ref.numpy(),
+                                              rtol=1e-5, atol=1e-30)
+
 
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestSPAtmplt))
@@ -0,0 +1,131 @@
+# Copyright (C) 2017 The PyCBC team
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the pycbc.events.veto module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from pycbc.events import veto
+from utils import parse_args_all_schemes, simple_exit
+
+_scheme, _context = parse_args_all_schemes("Veto")
+
+class TestVeto(unittest.TestCase):
+    def setUp(self):
+        self.scheme = _scheme
+        rng = numpy.random.RandomState(7)
+        self.start1 = rng.uniform(0, 1000, 60)
+        self.end1 = self.start1 + rng.uniform(0, 30, 60)
+        self.start2 = rng.uniform(0, 1000, 40)
+        self.end2 = self.start2 + rng.uniform(0, 30, 40)
+        self.times = rng.uniform(-10, 1040, 5000)
+
+    def test_indices_within_times(self):
+        if self.scheme != 'cpu':
+            return
+        segs = veto.start_end_to_segments(self.start1, self.end1).coalesce()
+        inside = numpy.array([t in segs for t in self.times])
+        within = veto.indices_within_times(self.times, self.start1,
+                                           self.end1)
+        outside = veto.indices_outside_times(self.times, self.start1,
+                                             self.end1)
+        self.assertTrue((within == numpy.flatnonzero(inside)).all())
+        self.assertTrue((outside == numpy.flatnonzero(~inside)).all())
+
+    def test_segment_index_operations(self):
+        if self.scheme != 'cpu':
+            return
+        index1 = veto.SegmentIndex(self.start1, self.end1)
+        index2 = veto.SegmentIndex(self.start2, self.end2)
+        segs1 = veto.start_end_to_segments(self.start1, self.end1).coalesce()
+        segs2 = veto.start_end_to_segments(self.start2, self.end2).coalesce()
+        for index, segs in [(index1 & index2, segs1 & segs2),
+                            (index1 | index2, segs1 | segs2),
+                            (index1 - index2, segs1 - segs2)]:
+            start, end = veto.segments_to_start_end(segs.coalesce())
+            self.assertTrue((index.start == start).all())
+            self.assertTrue((index.end == end).all())
+            self.assertAlmostEqual(abs(segs), abs(index), places=6)
+        self.assertEqual(0, len(index1 & veto.SegmentIndex()))
+
+    def test_segment_cache(self):
+        if self.scheme != 'cpu':
+            return
+        directory = tempfile.mkdtemp()
+        cache_dir = os.path.join(directory, 'cache')
+        os.mkdir(cache_dir)
+        fname = os.path.join(directory, 'H1-VETOES.xml')
+        with open(fname, 'w') as f:
+            f.write('segments')
+
+        calls = []
+        def parse(segment_file, segment_name, ifo):
+            calls.append(segment_name)
+            return self.start1, self.end1
+
+        parse_orig = veto._parse_start_end_by_definer
+        veto._parse_start_end_by_definer = parse
+        try:
+            # Nothing is cached unless a cache directory is given
+            os.environ.pop('PYCBC_SEGMENT_CACHE_DIR', None)
+            veto.start_end_by_definer(fname, 'CAT1', 'H1')
+            self.assertEqual(['H1-VETOES.xml', 'cache'],
+                             sorted(os.listdir(directory)))
+            del calls[:]
+
+            for name in ['CAT1', 'CAT1', 'CAT2']:
+                start, end = veto.start_end_by_definer(fname, name, 'H1',
+                                                       cache_dir=cache_dir)
+                self.assertTrue((start == self.start1).all())
+                self.assertTrue((end == self.end1).all())
+            self.assertEqual(['CAT1', 'CAT2'], calls)
+
+            # The cached times can be read by other users
+            umask = os.umask(0)
+            os.umask(umask)
+            for name in os.listdir(cache_dir):
+                mode = os.stat(os.path.join(cache_dir, name)).st_mode
+                self.assertEqual(0o666 & ~umask, mode & 0o777)
+
+            # A changed file is parsed again
+            with open(fname, 'w') as f:
+                f.write('new segments')
+            os.environ['PYCBC_SEGMENT_CACHE_DIR'] = cache_dir
+            index = veto.SegmentIndex.from_segment_file(fname, 'CAT1', 'H1')
+            self.assertEqual(['CAT1', 'CAT2', 'CAT1'], calls)
+            self.assertTrue((index.start[1:] > index.end[:-1]).all())
+        finally:
+            veto._parse_start_end_by_definer = parse_orig
+            os.environ.pop('PYCBC_SEGMENT_CACHE_DIR', None)
+            shutil.rmtree(directory)
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestVeto))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
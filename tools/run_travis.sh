@@ -72,6 +72,30 @@ test $? -ne 0 && RESULT=1
 python test/test_inference.py
 test $? -ne 0 && RESULT=1
 
+python test/test_fftw_wisdom.py
+test $? -ne 0 && RESULT=1
+
+python test/test_pipeline.py
+test $? -ne 0 && RESULT=1
+
+python test/test_bank_chisq.py
+test $? -ne 0 && RESULT=1
+
+python test/test_eventmgr.py
+test $? -ne 0 && RESULT=1
+
+python test/test_coinc.py
+test $? -ne 0 && RESULT=1
+
+python test/test_hdf.py
+test $? -ne 0 && RESULT=1
+
+python test/test_veto.py
+test $? -ne 0 && RESULT=1
+
+python test/test_record.py
+test $? -ne 0 && RESULT=1
+
 # check for trivial failures of important executables
 
 function test_exec_help {
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+""" Time finding the time slide coincidences of two detectors for synthetic
+triggers, one template at a time, at a range of trigger densities. The join
+of time_coincidence is compared to concatenating the slices one by one.
+"""
+import time
+import numpy
+from optparse import OptionParser
+from pycbc.events import coinc
+
+parser = OptionParser()
+parser.add_option('--num-templates', type=int, default=20,
+                  help='number of templates to find coincidences of [20]')
+parser.add_option('--trigger-rates', default='0.01,0.1,0.3,1',
+                  help='comma separated single detector triggers per second '
+                       'of each template [0.01,0.1,0.3,1]')
+parser.add_option('--duration', type=float, default=2048,
+                  help='duration of the analysed data in seconds [2048]')
+parser.add_option('--window', type=float, default=0.015,
+                  help='coincidence window in seconds [0.015]')
+parser.add_option('--timeslide-interval', type=float, default=0.1,
+                  help='interval between time slides in seconds [0.1]')
+
+(options, args) = parser.parse_args()
+
+def slice_join(values, left, right):
+    idx = [values[l:r] for l, r in zip(left, right)]
+    if len(idx) > 0:
+        return numpy.concatenate(idx)
+    return numpy.array([], dtype=numpy.int64)
+
+numpy.random.seed(0)
+for rate in [float(r) for r in options.trigger_rates.split(',')]:
+    triggers = []
+    for i in range(options.num_templates):
+        num = numpy.random.poisson(rate * options.duration, size=2)
+        triggers.append([numpy.random.uniform(0, options.duration, n) + 1e9
+                         for n in num])
+
+    num_coincs = 0
+    start = time.time()
+    for t1, t2 in triggers:
+        num_coincs += len(coinc.time_coincidence(t1, t2, options.window,
+                                       options.timeslide_interval)[0])
+    join_time = time.time() - start
+
+    take_ranges = coinc.take_ranges
+    coinc.take_ranges = slice_join
+    start = time.time()
+    for t1, t2 in triggers:
+        coinc.time_coincidence(t1, t2, options.window,
+                               options.timeslide_interval)
+    slice_time = time.time() - start
+    coinc.take_ranges = take_ranges
+
+    print '%s triggers per second: %s coincidences, %.2f s, ' \
+          '%.2f s with slices' % (rate, num_coincs, join_time, slice_time)
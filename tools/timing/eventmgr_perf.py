@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+""" Time adding synthetic triggers to an EventManager one template at a time,
+and the reductions applied to them once all templates are filtered.
+"""
+import time
+import argparse
+import numpy
+from optparse import OptionParser
+from pycbc.events import EventManager
+
+parser = OptionParser()
+parser.add_option('--num-triggers', type=int, default=10 ** 6,
+                  help='total number of triggers [1000000]')
+parser.add_option('--num-templates', type=int, default=10000,
+                  help='number of templates the triggers are spread over '
+                       '[10000]')
+parser.add_option('--duration', type=float, default=2048,
+                  help='duration of the analysed data in seconds [2048]')
+parser.add_option('--sample-rate', type=int, default=4096)
+parser.add_option('--keep-loudest-interval', type=float, default=2,
+                  help='interval in seconds of keep_loudest_in_interval [2]')
+parser.add_option('--keep-loudest-num', type=int, default=100)
+parser.add_option('--maximization-interval', type=float, default=30,
+                  help='window in ms of maximize_over_bank [30]')
+
+(options, args) = parser.parse_args()
+
+names = ['time_index', 'snr', 'chisq', 'chisq_dof']
+types = [int, numpy.complex64, numpy.float32, int]
+opt = argparse.Namespace(sample_rate=options.sample_rate, gps_start_time=0,
+                         chisq_bins=16)
+
+numpy.random.seed(0)
+counts = numpy.random.multinomial(options.num_triggers,
+                    numpy.ones(options.num_templates) / options.num_templates)
+num_samples = int(options.duration * options.sample_rate)
+
+def make_manager():
+    mgr = EventManager(opt, names, types)
+    for num in counts:
+        mgr.new_template()
+        snr = numpy.random.rayleigh(size=num) + 5
+        mgr.add_template_events(names, [
+            numpy.random.randint(0, num_samples, size=num),
+            snr * numpy.exp(1.0j * numpy.random.uniform(0, 6.28, size=num)),
+            numpy.random.chisquare(30, size=num), numpy.repeat(30, num)])
+        mgr.finalize_template_events()
+    return mgr
+
+start = time.time()
+mgr = make_manager()
+print 'Adding %s triggers of %s templates: %.2f s' % (options.num_triggers,
+                               options.num_templates, time.time() - start)
+
+start = time.time()
+mgr.keep_loudest_in_interval(options.keep_loudest_interval *
+                             options.sample_rate, options.keep_loudest_num)
+print 'keep_loudest_in_interval: %.2f s, %s triggers kept' % \
+      (time.time() - start, len(mgr.events))
+
+mgr = make_manager()
+start = time.time()
+mgr.maximize_over_bank('time_index', 'snr', int(options.maximization_interval
+                                           * options.sample_rate / 1000))
+print 'maximize_over_bank: %.2f s, %s triggers kept' % \
+      (time.time() - start, len(mgr.events))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+""" Compare the cost of the full rate and heirarchical (pruned fft) matched
+filters of MatchedFilterControl for a single template in Gaussian noise.
+"""
+from pycbc.scheme import *
+from pycbc.types import *
+from pycbc.filter import *
+from pycbc.waveform import get_waveform_filter
+import pycbc.psd
+import pycbc.noise
+import numpy
+import numpy.random
+from optparse import OptionParser
+import timeit
+
+import logging
+logging.basicConfig(format='%(asctime)s : %(message)s', level=logging.WARNING)
+
+parser = OptionParser()
+parser.add_option('--size', type=int, default=20,
+                  help='filter length in log2 [20]')
+parser.add_option('--sample-rate', type=float, default=4096,
+                  help='sample rate of the data [4096]')
+parser.add_option('--iterations', type=int, default=10,
+                  help='Number of iterations to perform [10]')
+parser.add_option('--downsample-factor', type=int, default=4,
+                  help='Reduction in sample rate of the first stage [4]')
+parser.add_option('--upsample-threshold', type=float, default=0.9,
+                  help='Fraction of the snr threshold for the first stage')
+parser.add_option('--max-snr-loss', type=float, default=None,
+                  help='Largest worst case snr loss of the first stage')
+parser.add_option('--snr-threshold', type=float, default=5.5)
+parser.add_option('--mass1', type=float, default=20)
+parser.add_option('--mass2', type=float, default=20)
+parser.add_option('--approximant', default='SPAtmplt')
+parser.add_option('--f-lower', type=float, default=30)
+
+(options, args) = parser.parse_args()
+
+ctx = CPUScheme()
+N = 2 ** options.size
+n = N / 2 + 1
+delta_t = 1.0 / options.sample_rate
+delta_f = 1.0 / (N * delta_t)
+
+with ctx:
+    psd = pycbc.psd.aLIGOZeroDetHighPower(n, delta_f, options.f_lower)
+    psd.data[0:int(options.f_lower / delta_f) + 1] = psd[int(options.f_lower / delta_f) + 1]
+    noise = pycbc.noise.noise_from_psd(N, delta_t, psd, seed=0)
+    stilde = make_frequency_series(noise.astype(float32))
+    stilde = (stilde / psd).astype(complex64)
+    stilde.psd = psd
+    stilde.analyze = slice(N / 4, 3 * N / 4)
+
+    htilde = zeros(n, dtype=complex64)
+    htilde = get_waveform_filter(htilde, mass1=options.mass1,
+                                 mass2=options.mass2,
+                                 approximant=options.approximant,
+                                 f_lower=options.f_lower, delta_f=delta_f,
+                                 delta_t=delta_t, distance=1.0 / pycbc.DYN_RANGE_FAC)
+    template_mem = zeros(n, dtype=complex64)
+    template_mem[:] = htilde
+    norm = sigmasq(htilde, psd=psd, low_frequency_cutoff=options.f_lower)
+
+    engines = {}
+    for name, factor in [('FULL', 1), ('HIERARCHICAL', options.downsample_factor)]:
+        engines[name] = MatchedFilterControl(options.f_lower, None,
+                                options.snr_threshold, N, delta_f, complex64,
+                                [stilde], template_mem, True,
+                                downsample_factor=factor,
+                                upsample_threshold=options.upsample_threshold,
+                                max_snr_loss=options.max_snr_loss,
+                                cluster_function='findchirp')
+        engines[name].matched_filter_and_cluster(0, norm, 4096)
+
+mf = engines['HIERARCHICAL']
+fraction = hierarchical_snr_fraction(htilde, psd, mf.kmin_red, mf.kmax_red,
+                                     mf.kmax_full, N, options.downsample_factor)
+print "SIZE %s DOWNSAMPLE %s" % (options.size, options.downsample_factor)
+print "WORST CASE SNR FRACTION OF THE FIRST STAGE %.4f" % fraction
+
+for name in ['FULL', 'HIERARCHICAL']:
+    def run():
+        with ctx:
+            for i in range(options.iterations):
+                engines[name].matched_filter_and_cluster(0, norm, 4096)
+    t = 1000 * timeit.Timer(run).timeit(number=1) / options.iterations
+    print "%s %.2f msec" % (name, t), " %5.1f op/min " % (1000 * 60 / t)